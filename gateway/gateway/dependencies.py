@@ -0,0 +1,121 @@
+import time
+from collections import OrderedDict, defaultdict
+
+from eventlet.queue import Empty, LightQueue
+from nameko.extensions import DependencyProvider
+
+from gateway.metrics import CACHE_LOOKUPS, CACHE_SIZE, STATUS_WATCHES
+
+
+class PaymentCache(DependencyProvider):
+    """ Bounded LRU cache of payment documents, shared by every worker in
+    the gateway container.
+
+    Pending payments expire after ``PAYMENT_CACHE_TTL`` seconds as a
+    safety net, the ``payment_state_changed`` event normally evicts them
+    first. Settled payments (Completed / Cancelled) never change again, so
+    they stay until pushed out by the LRU bound.
+    """
+
+    SETTLED = (2, 3)
+
+    def setup(self):
+        config = self.container.config
+
+        self.max_size = config.get('PAYMENT_CACHE_SIZE', 10000)
+        self.ttl = config.get('PAYMENT_CACHE_TTL', 5)
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        CACHE_SIZE.set_function(lambda: len(self.entries))
+
+    def get_dependency(self, worker_ctx):
+        return self
+
+    def get(self, payment_id):
+        key = str(payment_id)
+        entry = self.entries.get(key)
+
+        if entry is None or (entry[0] is not None and entry[0] < time.monotonic()):
+            self.entries.pop(key, None)
+            self.misses += 1
+            CACHE_LOOKUPS.labels('miss').inc()
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        CACHE_LOOKUPS.labels('hit').inc()
+        return entry[1]
+
+    def set(self, payment_id, payment):
+        expires = None if payment.get('status') in self.SETTLED else time.monotonic() + self.ttl
+
+        key = str(payment_id)
+        self.entries[key] = (expires, payment)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, payment_id):
+        self.entries.pop(str(payment_id), None)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries)}
+
+
+class StatusWatch(object):
+    """ One request's subscription to the status changes of a payment,
+    from ``StatusWatchers.watch`` until ``close``.
+    """
+
+    def __init__(self, watchers, key):
+        self.watchers = watchers
+        self.key = key
+        self.queue = LightQueue()
+
+    def wait(self, timeout):
+        """ The next status published for the payment, or None after
+        ``timeout`` seconds without one.
+        """
+        try:
+            return self.queue.get(block=timeout > 0, timeout=timeout)
+        except Empty:
+            return None
+
+    def close(self):
+        self.watchers.discard(self)
+
+
+class StatusWatchers(DependencyProvider):
+    """ Requests waiting on a payment's status, shared by every worker in
+    the gateway container.
+
+    ``payment_state_changed`` publishes to them. Register the watch before
+    reading the current status, a change landing in between is then
+    queued instead of lost.
+    """
+
+    def setup(self):
+        self.watches = defaultdict(set)
+        STATUS_WATCHES.set_function(lambda: sum(len(watches) for watches in self.watches.values()))
+
+    def get_dependency(self, worker_ctx):
+        return self
+
+    def watch(self, payment_id):
+        watch = StatusWatch(self, str(payment_id))
+        self.watches[watch.key].add(watch)
+        return watch
+
+    def discard(self, watch):
+        watches = self.watches.get(watch.key)
+        if watches is None:
+            return
+
+        watches.discard(watch)
+        if not watches:
+            del self.watches[watch.key]
+
+    def publish(self, payment_id, status):
+        for watch in self.watches.get(str(payment_id), ()):
+            watch.queue.put(status)
@@ -0,0 +1,80 @@
+"""
+Single-pass response documents, the same dicts ``GetPaymentSchema.dump``
+returns for the payment documents of the payments service, built
+without going through marshmallow.
+
+Values arrive already typed by ``PaymentSchema`` on the payments side,
+so they are copied as they are. ``GetPaymentSchema`` stays the reference
+for the output, ``test/test_documents.py`` and
+``tools/check_documents.py`` compare the two.
+
+``payment_etag`` / ``page_etag`` and ``payment_cache_control`` drive the
+conditional GETs of the read endpoints.
+"""
+import hashlib
+from datetime import datetime, timezone
+
+from nameko import config
+
+from gateway.schemas import STATUS_TEXT
+
+
+REQUESTER_TEXT = {
+    1: "Order",
+    2: "Reservation",
+    3: "Event",
+}
+
+COPIED_FIELDS = (
+    'id', 'customer_id', 'requester_id', 'secondary_requester_id',
+    'payment_method', 'payment_amount', 'payment_info',
+)
+
+DATETIME_FIELDS = ('settle_date', 'created_at', 'updated_at')
+
+# Completed and cancelled payments never change again
+FINAL_STATUSES = (2, 3)
+
+
+def render_payment(payment):
+    document = {
+        'requester_type': REQUESTER_TEXT.get(payment.get('requester_type'), "Unknown"),
+        'status': STATUS_TEXT.get(payment.get('status'), "Unknown"),
+    }
+    for name in COPIED_FIELDS:
+        if name in payment:
+            document[name] = payment[name]
+
+    # Like GetPaymentSchema's DateTime fields: the ISO strings payments sends fail to
+    # format and are left out, only nulls (and real datetimes) make it into the response
+    for name in DATETIME_FIELDS:
+        value = payment.get(name, '')
+        if value is None:
+            document[name] = None
+        elif isinstance(value, datetime):
+            document[name] = (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).astimezone(timezone.utc).isoformat()
+    return document
+
+
+def render_payments(payments):
+    return [render_payment(payment) for payment in payments]
+
+
+def payment_etag(payment):
+    """ Changes whenever the payment does, every status change moves ``updated_at``. """
+    return '{}-{}'.format(payment['id'], hashlib.sha1(str(payment.get('updated_at')).encode()).hexdigest()[:16])
+
+
+def page_etag(payments):
+    """ Version of a whole page, from the ids and ``updated_at`` of its rows. """
+    digest = hashlib.sha1()
+    for payment in payments:
+        digest.update('{}:{};'.format(payment['id'], payment.get('updated_at')).encode())
+    return 'page-' + digest.hexdigest()[:24]
+
+
+def payment_cache_control(payment):
+    # Only the user's own client may keep them, the documents sit behind Authorization
+    if payment.get('status') in FINAL_STATUSES:
+        return 'private, max-age={}'.format(config.get('PAYMENT_FINAL_MAX_AGE', 86400))
+    return 'no-cache'
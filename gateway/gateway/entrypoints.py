@@ -1,21 +1,110 @@
+import gzip
 import json
+import uuid
 
 from marshmallow import ValidationError
+from nameko import config
 from nameko.exceptions import safe_for_serialization, BadRequest
-from gateway.exceptions import PaymentNotFound  
+from gateway.exceptions import IdempotencyConflict, PaymentNotFound
+from payment_common.tracing import CORRELATION_KEY
 from nameko.web.handlers import HttpRequestHandler
+from nameko.web.server import WebServer
 from werkzeug import Response
 
+CORRELATION_HEADER = 'X-Correlation-ID'
+
+
+class TracingWebServer(WebServer):
+    """ Starts every worker's context data with the caller's correlation id,
+    or a fresh one, so it travels with each RPC and event the request causes.
+    """
+
+    def context_data_from_headers(self, request):
+        request.correlation_id = request.headers.get(CORRELATION_HEADER) or uuid.uuid4().hex
+        return {CORRELATION_KEY: request.correlation_id}
+
+
+class Document(object):
+    """ Handler result the entrypoint turns into the response. ``render``
+    builds the body, and is never called when the client's
+    ``If-None-Match`` already holds ``etag``, the client gets a 304 instead.
+    """
+
+    def __init__(self, render, etag=None, cache_control=None, headers=None, mimetype='application/json'):
+        self.render = render
+        self.etag = etag
+        self.cache_control = cache_control
+        self.headers = headers
+        self.mimetype = mimetype
+
+
 class HttpEntrypoint(HttpRequestHandler):
     """ Overrides `response_from_exception` so we can customize error handling.
+
+    Handlers may also return a `Document` for conditional GET. Responses of
+    at least ``HTTP_GZIP_MIN_SIZE`` bytes are gzipped for clients that
+    accept it.
     """
 
+    server = TracingWebServer()
+
     mapped_errors = {
         BadRequest: (400, 'BAD_REQUEST'),
         ValidationError: (400, 'VALIDATION_ERROR'),
         PaymentNotFound: (404, 'NOT_FOUND'),
+        IdempotencyConflict: (409, 'IDEMPOTENCY_CONFLICT'),
     }
 
+    def handle_request(self, request):
+        response = super(HttpEntrypoint, self).handle_request(request)
+
+        if isinstance(response, Document):
+            try:
+                response = self.response_from_document(request, response)
+            except Exception as exc:
+                response = self.response_from_exception(exc)
+
+        response = self.compress(request, response)
+        response.headers[CORRELATION_HEADER] = getattr(request, 'correlation_id', '')
+        return response
+
+    def response_from_result(self, result):
+        # Rendered in handle_request, which has the request headers
+        if isinstance(result, Document):
+            return result
+        return super(HttpEntrypoint, self).response_from_result(result)
+
+    def response_from_document(self, request, document):
+        if document.etag is not None and request.if_none_match.contains_weak(document.etag):
+            response = Response(status=304, headers=document.headers)
+        else:
+            response = Response(document.render(), headers=document.headers, mimetype=document.mimetype)
+
+        # Weak, the gzipped and plain bodies share it
+        if document.etag is not None:
+            response.set_etag(document.etag, weak=True)
+        if document.cache_control is not None:
+            response.headers['Cache-Control'] = document.cache_control
+        return response
+
+    def compress(self, request, response):
+        minSize = config.get('HTTP_GZIP_MIN_SIZE', 1024)
+        if (
+            minSize is None or response.is_streamed or response.status_code != 200
+            or 'Content-Encoding' in response.headers
+        ):
+            return response
+
+        body = response.get_data()
+        if len(body) < minSize:
+            return response
+
+        response.vary.add('Accept-Encoding')
+        if request.accept_encodings['gzip']:
+            response.set_data(gzip.compress(body, compresslevel=config.get('HTTP_GZIP_LEVEL', 6)))
+            response.headers['Content-Encoding'] = 'gzip'
+        return response
+
     def response_from_exception(self, exc):
         status_code, error_code = 500, 'UNEXPECTED_ERROR'
 
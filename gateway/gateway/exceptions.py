@@ -22,3 +22,12 @@ class PaymentNotFound(Exception):
     exception instead.
     """
     pass
+
+
+@remote_error('payments.exceptions.IdempotencyConflict')
+class IdempotencyConflict(Exception):
+    """
+    The ``Idempotency-Key`` of a create was already used with a different
+    body. Retrying under the same key can never succeed.
+    """
+    pass
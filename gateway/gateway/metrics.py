@@ -0,0 +1,8 @@
+from prometheus_client import Counter, Gauge
+
+from payment_common.metrics import REGISTRY
+
+
+CACHE_LOOKUPS = Counter('payment_cache_lookups_total', 'Payment cache lookups', ['result'], registry=REGISTRY)
+CACHE_SIZE = Gauge('payment_cache_entries', 'Payments currently cached', registry=REGISTRY)
+STATUS_WATCHES = Gauge('payment_status_watches', 'Long-poll and event stream requests waiting on a payment', registry=REGISTRY)
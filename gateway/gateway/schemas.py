@@ -1,4 +1,15 @@
-from marshmallow import Schema, fields, validate
+from marshmallow import Schema, ValidationError, fields, validate, validates
+from nameko import config
+
+STATUS_TEXT = {
+    1: "Pending",
+    2: "Completed",
+    3: "Cancelled",
+    4: "Charging"
+}
+
+# The groupings payments.summary.report accepts
+REPORT_GROUPS = ('customer', 'requester_type', 'payment_method', 'day')
     
 class CreatePaymentSchema(Schema):
     customer_id = fields.Int(required=True)
@@ -12,7 +23,21 @@ class CreatePaymentSchema(Schema):
     )
     payment_amount = fields.Float(required=True)
 
+    # From the Idempotency-Key header, a retry with the same key returns the first payment
+    idempotency_key = fields.Str(allow_none=True, validate=validate.Length(min=1, max=255))
+
     # status, psp_id, signature_key, settle_date diisi di dalam service
+
+
+class LookupPaymentSchema(Schema):
+    ids = fields.List(fields.Int(), required=True)
+
+    @validates('ids')
+    def validate_ids(self, ids):
+        # Read per load, the same limit GET /payment/status and the payments RPC apply
+        maxIds = config.get('PAYMENT_MAX_LOOKUP_IDS', 500)
+        if not 1 <= len(ids) <= maxIds:
+            raise ValidationError("Expected between 1 and {} ids".format(maxIds))
     
 class GetPaymentSchema(Schema):
     id = fields.Int()
@@ -24,7 +49,7 @@ class GetPaymentSchema(Schema):
 
     payment_method = fields.Str()
     payment_amount = fields.Float()
-    payment_info = fields.Method("get_payment_info")
+    payment_info = fields.Str(allow_none=True)                  # Precomputed by the payments service
     status = fields.Method("get_status")
 
     settle_date = fields.DateTime(allow_none=True)
@@ -42,36 +67,5 @@ class GetPaymentSchema(Schema):
             return "Event"
         return "Unknown"
     
-    def get_payment_info(self, obj):
-        try:
-            raw = obj.get('raw_response', {})
-            method = obj.get('payment_method', '')
-
-            if isinstance(raw, str):
-                import json
-                raw = json.loads(raw)
-                
-            # bank_transfer → BCA VA
-            if method == "bca_va":
-                va_list = raw.get("va_numbers", [])
-                if va_list:
-                    return va_list[0].get("va_number")
-
-            # gopay or qris → use actions[].url
-            if method in ["gopay", "qris"]:
-                actions = raw.get("actions", [])
-                for action in actions:
-                    if action.get("name") == "generate-qr-code":
-                        return action.get("url")
-
-            return f"raw_response: {raw} | method: {method}"
-        except Exception as e:
-            return f"error: {str(e)}"
-        
     def get_status(self, obj):
-        status = {
-            1: "Pending",
-            2: "Completed",
-            3: "Cancelled"
-        }
-        return status.get(obj.get('status'), "Unknown")
\ No newline at end of file
+        return STATUS_TEXT.get(obj.get('status'), "Unknown")
\ No newline at end of file
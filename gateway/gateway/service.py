@@ -1,117 +1,292 @@
 import json
+import time
+from datetime import date
 
 from marshmallow import ValidationError
 from nameko import config
+from nameko.events import BROADCAST, EventDispatcher, event_handler
 from nameko.exceptions import BadRequest
 from nameko.rpc import RpcProxy
 from werkzeug import Response
 
-from gateway.entrypoints import http
-from gateway.exceptions import PaymentNotFound
-from gateway.schemas import CreatePaymentSchema, GetPaymentSchema
+from payment_common.metrics import CONTENT_TYPE, Metrics
+from payment_common.tracing import Tracer
+
+from gateway.dependencies import PaymentCache, StatusWatchers
+from gateway.documents import FINAL_STATUSES, page_etag, payment_cache_control, payment_etag, render_payment, render_payments
+from gateway.entrypoints import Document, http
+from gateway.exceptions import IdempotencyConflict, PaymentNotFound
+from gateway.schemas import REPORT_GROUPS, STATUS_TEXT, CreatePaymentSchema, LookupPaymentSchema
 
 
 class GatewayService(object):
     name = 'gateway'
 
-    payments_rpc = RpcProxy('payments')
+    payments_rpc = RpcProxy('payments', serializer=config.get('PAYMENTS_RPC_SERIALIZER', 'json'))
+    event_dispatcher = EventDispatcher()
+    payment_cache = PaymentCache()
+    status_watchers = StatusWatchers()
+    metrics = Metrics()
+    tracer = Tracer()
 
     @http("GET", "/payment", expected_exceptions=(BadRequest,))
     def get_payment_list(self, request):
         self.checkPaymentToken(request)
+        after_id, limit = self.get_page_args(request)
         
-        paymentList = self.payments_rpc.get_payment_list()
-        return Response(
-            GetPaymentSchema(many=True).dumps(paymentList).data,
-            mimetype='application/json'
-        )
+        paymentList = self.payments_rpc.get_payment_list(after_id, limit)
+        return self.page_response(paymentList, limit)
+
+    @http("GET", "/payment/export", expected_exceptions=(BadRequest,))
+    def export_payment_list(self, request):
+        self.checkPaymentToken(request)
+        after_id, _ = self.get_page_args(request)
+        limit = config.get('PAYMENT_EXPORT_PAGE_SIZE', 1000)
+
+        # Stream one NDJSON line per payment, only one page is ever held in memory.
+        # Payments may clamp the page below limit, so only an empty page ends the export
+        def generate(after_id):
+            while True:
+                paymentList = self.payments_rpc.get_payment_list(after_id, limit)
+                if not paymentList:
+                    return
+
+                for payment in paymentList:
+                    yield json.dumps(render_payment(payment)) + "\n"
+                after_id = paymentList[-1]['id']
+
+        return Response(generate(after_id), mimetype='application/x-ndjson')
         
     @http("GET", "/payment/<int:payment_id>", expected_exceptions=(PaymentNotFound,BadRequest,))
     def get_payment_by_id(self, request, payment_id):
         self.checkPaymentToken(request)
 
-        payment = self.payments_rpc.get_payment_by_id(payment_id)
+        payment = self.get_payment_document(payment_id)
         
-        return Response(
-            GetPaymentSchema().dumps(payment).data,
-            mimetype='application/json'
-        )
+        return self.payment_response(payment, lambda: json.dumps(render_payment(payment)))
     
     @http("GET", "/payment/customer/<int:customer_id>", expected_exceptions=(BadRequest,))
     def get_payment_by_customer_id(self, request, customer_id):
         self.checkPaymentToken(request)
         
-        paymentList = self.payments_rpc.get_payment_by_customer_id(customer_id)
+        after_id, limit = self.get_page_args(request)
         
-        return Response(
-            GetPaymentSchema(many=True).dumps(paymentList).data,
-            mimetype='application/json'
-        )
+        paymentList = self.payments_rpc.get_payment_by_customer_id(customer_id, after_id, limit)
+        return self.page_response(paymentList, limit)
     
     @http("GET", "/payment/requester/<int:requester_id>", expected_exceptions=(BadRequest,))
     def get_payment_by_requester_id(self, request, requester_id):
         self.checkPaymentToken(request)
         
-        paymentList = self.payments_rpc.get_payment_by_requester_id(requester_id)
+        after_id, limit = self.get_page_args(request)
         
-        return Response(
-            GetPaymentSchema(many=True).dumps(paymentList).data,
-            mimetype='application/json'
-        )
+        paymentList = self.payments_rpc.get_payment_by_requester_id(requester_id, after_id, limit)
+        return self.page_response(paymentList, limit)
         
     @http("GET", "/payment/<string:payment_id>/status", expected_exceptions=(PaymentNotFound,BadRequest,))
     def get_payment_status(self, request, payment_id):
         self.checkPaymentToken(request)
         
-        status = self.payments_rpc.get_payment_status(payment_id)
+        payment = self.get_payment_document(payment_id)
         
-        status_text = {
-        1: "Pending",
-        2: "Completed",
-        3: "Cancelled"
-        }.get(status, "Unknown")
+        status_text = STATUS_TEXT.get(payment['status'], "Unknown")
         
+        return self.payment_response(payment, lambda: json.dumps({"status": status_text}))
+
+    @http("GET", "/payment/<int:payment_id>/wait", expected_exceptions=(PaymentNotFound,BadRequest,))
+    def wait_payment_status(self, request, payment_id):
+        self.checkPaymentToken(request)
+
+        try:
+            timeout = float(request.args.get('timeout') or config.get('PAYMENT_WAIT_TIMEOUT', 30))
+        except ValueError as exc:
+            raise BadRequest("Invalid timeout: {}".format(exc))
+        if timeout < 0:
+            raise BadRequest("timeout must not be negative")
+        timeout = min(timeout, config.get('PAYMENT_WAIT_MAX_TIMEOUT', 60))
+
+        watch, status = self.watch_payment_status(payment_id)
+        # The status the client last saw, a change it missed is answered right away
+        known = request.args.get('status') or STATUS_TEXT.get(status, "Unknown")
+
+        def wait(status):
+            deadline = time.monotonic() + timeout
+            while STATUS_TEXT.get(status, "Unknown") == known and status not in FINAL_STATUSES:
+                changed = watch.wait(deadline - time.monotonic())
+                if changed is None:
+                    break
+                status = changed
+
+            status_text = STATUS_TEXT.get(status, "Unknown")
+            yield json.dumps({"status": status_text, "changed": status_text != known})
+
+        return self.watch_response(request, watch, wait(status), 'application/json')
+
+    @http("GET", "/payment/<int:payment_id>/events", expected_exceptions=(PaymentNotFound,BadRequest,))
+    def stream_payment_status(self, request, payment_id):
+        self.checkPaymentToken(request)
+
+        watch, status = self.watch_payment_status(payment_id)
+        heartbeat = config.get('PAYMENT_EVENTS_HEARTBEAT', 15)
+        duration = config.get('PAYMENT_EVENTS_MAX_DURATION', 300)
+
+        # One "status" event now and one per change, until the payment is final.
+        # EventSource reconnects by itself when the stream ends before that
+        def generate(status):
+            deadline = time.monotonic() + duration
+            sent = None
+            while True:
+                status_text = STATUS_TEXT.get(status, "Unknown")
+                if status_text != sent:
+                    yield "event: status\ndata: {}\n\n".format(json.dumps({"status": status_text}))
+                    sent = status_text
+
+                remaining = deadline - time.monotonic()
+                if status in FINAL_STATUSES or remaining <= 0:
+                    return
+
+                changed = watch.wait(min(heartbeat, remaining))
+                if changed is None:
+                    # Keeps proxies from dropping an idle connection
+                    yield ": keep-alive\n\n"
+                else:
+                    status = changed
+
+        return self.watch_response(request, watch, generate(status), 'text/event-stream')
+    
+    @http("GET", "/payment/status", expected_exceptions=(BadRequest,))
+    def get_payment_statuses(self, request):
+        self.checkPaymentToken(request)
+
+        try:
+            paymentIds = [int(payment_id) for payment_id in request.args.get('ids', '').split(',') if payment_id.strip()]
+        except ValueError as exc:
+            raise BadRequest("Invalid ids: {}".format(exc))
+
+        maxIds = config.get('PAYMENT_MAX_LOOKUP_IDS', 500)
+        if not paymentIds or len(paymentIds) > maxIds:
+            raise BadRequest("Expected between 1 and {} comma separated ids".format(maxIds))
+
+        statuses = {}
+        missingIds = []
+        for payment_id in paymentIds:
+            payment = self.payment_cache.get(payment_id)
+            if payment is None:
+                missingIds.append(payment_id)
+            else:
+                statuses[str(payment_id)] = payment['status']
+
+        if missingIds:
+            statuses.update(self.payments_rpc.get_payment_statuses(missingIds))
+
         return Response(
-            json.dumps({"status": status_text}),
+            json.dumps({
+                payment_id: {"status": STATUS_TEXT.get(statuses[payment_id], "Unknown")} if statuses.get(payment_id) is not None else self.not_found(payment_id)
+                for payment_id in map(str, paymentIds)
+            }),
             mimetype='application/json'
         )
-    
-    @http("GET", "/payment/<string:payment_id>/amount", expected_exceptions=(PaymentNotFound,BadRequest,))
-    def get_payment_amount(self, request, payment_id):
+
+    @http("POST", "/payment/lookup", expected_exceptions=(ValidationError, BadRequest))
+    def lookup_payments(self, request):
         self.checkPaymentToken(request)
 
-        amount = self.payments_rpc.get_payment_amount(payment_id)
+        try:
+            paymentIds = LookupPaymentSchema(strict=True).loads(request.get_data(as_text=True)).data['ids']
+        except ValueError as exc:
+            raise BadRequest("Invalid json: {}".format(exc))
+
+        payments = {}
+        missingIds = []
+        for payment_id in paymentIds:
+            payment = self.payment_cache.get(payment_id)
+            if payment is None:
+                missingIds.append(payment_id)
+            else:
+                payments[str(payment_id)] = payment
+
+        if missingIds:
+            for payment_id, payment in self.payments_rpc.get_payments_by_ids(missingIds).items():
+                if payment is not None:
+                    self.payment_cache.set(payment_id, payment)
+                payments[payment_id] = payment
+
         return Response(
-            json.dumps({"amount": amount}),
+            json.dumps({
+                payment_id: render_payment(payments[payment_id]) if payments.get(payment_id) is not None else self.not_found(payment_id)
+                for payment_id in map(str, paymentIds)
+            }),
             mimetype='application/json'
         )
+
+    @http("GET", "/payment/<string:payment_id>/amount", expected_exceptions=(PaymentNotFound,BadRequest,))
+    def get_payment_amount(self, request, payment_id):
+        self.checkPaymentToken(request)
+
+        payment = self.get_payment_document(payment_id)
+        return self.payment_response(payment, lambda: json.dumps({"amount": payment['payment_amount']}))
         
-    @http("POST", "/payment", expected_exceptions=(BadRequest))
+    @http("POST", "/payment", expected_exceptions=(ValidationError, BadRequest, IdempotencyConflict))
     def create_payment(self, request):
         self.checkPaymentToken(request)
         
         schema = CreatePaymentSchema(strict=True)
 
-        try:
-            payment_data = schema.loads(request.get_data(as_text=True)).data
-        except ValueError as exc:
-            raise BadRequest("Invalid json: {}".format(exc))
+        with self.tracer.span("validate"):
+            try:
+                payment_data = json.loads(request.get_data(as_text=True))
+            except ValueError as exc:
+                raise BadRequest("Invalid json: {}".format(exc))
+
+            if not isinstance(payment_data, dict):
+                raise BadRequest("Invalid json: expected an object")
+            payment_data['idempotency_key'] = request.headers.get('Idempotency-Key')
+            payment_data = schema.load(payment_data).data
 
-        insertResult = self.payments_rpc.create_payment(payment_data)
+        with self.tracer.span("payments_rpc.create_payment"):
+            insertResult = self.payments_rpc.create_payment(payment_data)
         
         # newPaymentId = insertResult['id']
         # return Response(json.dumps({'id': newPaymentId}), mimetype='application/json')
         
         return Response(
-            GetPaymentSchema().dumps(insertResult).data,
+            json.dumps(render_payment(insertResult)),
             mimetype='application/json'
         )
     
+    @http("POST", "/payment/batch", expected_exceptions=(ValidationError, BadRequest))
+    def create_payment_batch(self, request):
+        self.checkPaymentToken(request)
+
+        schema = CreatePaymentSchema(many=True, strict=True)
+
+        try:
+            payment_data = schema.loads(request.get_data(as_text=True)).data
+        except ValueError as exc:
+            raise BadRequest("Invalid json: {}".format(exc))
+
+        maxBatchSize = config.get('PAYMENT_MAX_BATCH_SIZE', 500)
+        if len(payment_data) > maxBatchSize:
+            raise BadRequest("At most {} payments per batch".format(maxBatchSize))
+
+        insertResults = self.payments_rpc.create_payments_bulk(payment_data)
+
+        # Payments created but not charged are told apart by their charge_error
+        paymentList = [
+            dict(render_payment(result), charge_error=result.get('charge_error'))
+            for result in insertResults
+        ]
+        return Response(
+            json.dumps(paymentList),
+            mimetype='application/json'
+        )
+
     @http("PATCH", "/payment/<int:payment_id>/complete", expected_exceptions=(PaymentNotFound,BadRequest,))
     def complete_payment(self, request, payment_id):
         self.checkPaymentToken(request)
         
         result = self.payments_rpc.complete_payment(payment_id)
+        self.payment_cache.invalidate(payment_id)
         return Response(
             json.dumps({"response": result}),
             mimetype='application/json'
@@ -122,6 +297,7 @@ class GatewayService(object):
         self.checkPaymentToken(request)
         
         result = self.payments_rpc.cancel_payment(payment_id)
+        self.payment_cache.invalidate(payment_id)
         return Response(
             json.dumps({"response": result}),
             mimetype='application/json'
@@ -134,15 +310,121 @@ class GatewayService(object):
         except ValueError as exc:
             raise BadRequest("Invalid json: {}".format(exc))
         
-        transaction_id = midtrans_data.get("transaction_id")
-        transaction_status = midtrans_data.get("transaction_status")
-        
-        result = self.payments_rpc.handle_midtrans_callback(transaction_id, transaction_status)
+        # Acknowledge right away, the payments service applies notifications in batches
+        self.event_dispatcher("midtrans_callback_received", {
+            "transaction_id": midtrans_data.get("transaction_id"),
+            "transaction_status": midtrans_data.get("transaction_status"),
+        })
         return Response(
-            json.dumps({"response": result}),
+            json.dumps({"response": "Accepted"}),
+            mimetype='application/json'
+        )
+
+    @http("GET", "/payment/report/<string:group_by>", expected_exceptions=(BadRequest,))
+    def get_payment_report(self, request, group_by):
+        self.checkPaymentToken(request)
+
+        # Checked here, payments' own BadRequest would reach the client as a 500
+        if group_by not in REPORT_GROUPS:
+            raise BadRequest("group_by must be one of {}".format(", ".join(sorted(REPORT_GROUPS))))
+
+        try:
+            customer_id = request.args.get('customer_id')
+            customer_id = int(customer_id) if customer_id is not None else None
+        except ValueError as exc:
+            raise BadRequest("Invalid customer_id: {}".format(exc))
+
+        date_from, date_to = request.args.get('from'), request.args.get('to')
+        try:
+            for day in (date_from, date_to):
+                if day is not None:
+                    date.fromisoformat(day)
+        except ValueError:
+            raise BadRequest("Dates must be YYYY-MM-DD")
+
+        report = self.payments_rpc.get_payment_report(group_by, customer_id, date_from, date_to)
+        for row in report:
+            row['status'] = STATUS_TEXT.get(row['status'], "Unknown")
+
+        return Response(
+            json.dumps(report),
             mimetype='application/json'
         )
 
+    @http("GET", "/payment/cache/stats")
+    def get_payment_cache_stats(self, request):
+        return Response(
+            json.dumps(self.payment_cache.stats()),
+            mimetype='application/json'
+        )
+
+    @http("GET", "/metrics")
+    def get_metrics(self, request):
+        return Response(self.metrics.render(), content_type=CONTENT_TYPE)
+
+    @event_handler("payments", "payment_state_changed", handler_type=BROADCAST, reliable_delivery=False)
+    def invalidate_payment_cache(self, payload):
+        # Broadcast so every gateway instance drops its own copy
+        self.payment_cache.invalidate(payload['payment_id'])
+        self.status_watchers.publish(payload['payment_id'], payload['status'])
+
+    def get_payment_document(self, payment_id):
+        payment = self.payment_cache.get(payment_id)
+
+        if payment is None:
+            payment = self.payments_rpc.get_payment_by_id(payment_id)
+            self.payment_cache.set(payment_id, payment)
+        return payment
+
+    def watch_payment_status(self, payment_id):
+        # Watch before reading, a change landing in between is then queued rather than missed.
+        # Read from the primary, a cached or replica status may predate a change already published
+        watch = self.status_watchers.watch(payment_id)
+        try:
+            return watch, self.payments_rpc.get_payment_status(payment_id, primary=True)
+        except Exception:
+            watch.close()
+            raise
+
+    def watch_response(self, request, watch, body, mimetype):
+        # The body does the waiting on the connection's own greenthread, after the
+        # worker has returned, so waiting clients do not hold any of the max_workers.
+        # eventlet holds back writes under 4KB, each event has to go out as it happens
+        request.environ['eventlet.minimum_write_chunk_size'] = 0
+        response = Response(body, mimetype=mimetype, headers={'Cache-Control': 'no-store', 'X-Accel-Buffering': 'no'})
+        response.call_on_close(watch.close)
+        return response
+
+    def not_found(self, payment_id):
+        return {"error": "NOT_FOUND", "message": "Payment with id {} not found".format(payment_id)}
+
+    def get_page_args(self, request):
+        try:
+            after_id = request.args.get('after_id')
+            after_id = int(after_id) if after_id is not None else None
+            limit = int(request.args.get('limit') or config.get('PAYMENT_PAGE_SIZE', 100))
+        except ValueError as exc:
+            raise BadRequest("Invalid pagination argument: {}".format(exc))
+
+        if limit < 1:
+            raise BadRequest("limit must be positive")
+        return after_id, min(limit, config.get('PAYMENT_MAX_PAGE_SIZE', 1000))
+
+    def page_response(self, paymentList, limit):
+        # A full page means there may be more rows, hand the client its next cursor
+        headers = {}
+        if len(paymentList) == limit:
+            headers['X-Next-After-Id'] = str(paymentList[-1]['id'])
+
+        return Document(
+            lambda: json.dumps(render_payments(paymentList)),
+            etag=page_etag(paymentList), cache_control='no-cache', headers=headers,
+        )
+
+    def payment_response(self, payment, render):
+        # Pollers that already hold this version of the payment get a 304, render never runs
+        return Document(render, etag=payment_etag(payment), cache_control=payment_cache_control(payment))
+
     def checkPaymentToken(self, request):
         # TODO: Delete return & fill entities' token
         return
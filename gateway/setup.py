@@ -9,6 +9,8 @@ setup(
     install_requires=[
         "marshmallow==2.19.2",
         "nameko==v3.0.0-rc6",
+        "prometheus-client<1.0",
+        "payment-service-common",
     ],
     extras_require={
         'dev': [
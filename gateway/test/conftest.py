@@ -0,0 +1,24 @@
+import pytest
+from nameko.testing.services import replace_dependencies, restrict_entrypoints
+from nameko.web.server import WebServer
+from werkzeug.test import Client
+
+from gateway.service import GatewayService
+
+
+@pytest.fixture
+def gateway(container_factory):
+    """ The gateway's HTTP entrypoints on a started container, with
+    ``payments_rpc`` mocked. Requests go through the real routing and
+    error mapping, no broker is needed.
+    """
+    def make(*entrypoints):
+        container = container_factory(GatewayService, {'AMQP_URI': 'memory://', 'WEB_SERVER_ADDRESS': '127.0.0.1:0'})
+        payments_rpc, _ = replace_dependencies(container, 'payments_rpc', 'event_dispatcher')
+        restrict_entrypoints(container, *entrypoints)
+        container.start()
+
+        server = next(extension for extension in container.subextensions if isinstance(extension, WebServer))
+        return Client(server.get_wsgi_app()), payments_rpc
+
+    return make
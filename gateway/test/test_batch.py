@@ -0,0 +1,26 @@
+import json
+
+
+PAYMENT = {
+    'customer_id': 1,
+    'requester_type': 1,
+    'requester_id': 7,
+    'payment_method': 'bca_va',
+    'payment_amount': 150000.0,
+}
+
+
+def test_batch_passes_charge_errors_on(gateway):
+    web, payments_rpc = gateway('create_payment_batch')
+    payments_rpc.create_payments_bulk.return_value = [
+        dict(PAYMENT, id=1, status=1, psp_id='9aed5972-1', charge_error=None),
+        dict(PAYMENT, id=2, status=1, psp_id=None, charge_error='Duplicate order ID'),
+    ]
+
+    response = web.post('/payment/batch', data=json.dumps([PAYMENT, PAYMENT]))
+
+    assert response.status_code == 200
+    assert [(payment['id'], payment['status'], payment['charge_error']) for payment in json.loads(response.get_data())] == [
+        (1, 'Pending', None),
+        (2, 'Pending', 'Duplicate order ID'),
+    ]
@@ -0,0 +1,55 @@
+import itertools
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from gateway.documents import render_payment
+from gateway.schemas import GetPaymentSchema
+
+
+def payment_documents():
+    """ Payment documents as they arrive from the payments service over json
+    RPC, covering every status, requester type and null column, like
+    ``tools/check_documents.py`` generates.
+    """
+    started = datetime(2026, 10, 18, 7, 41, 15, 927798)
+    cases = itertools.product(['bca_va', 'gopay', 'tunai'], [1, 2, 3, 4, 9], [1, 2, 3, 7], [None, 67890])
+    for index, (method, status, requester_type, secondary_requester_id) in enumerate(cases, 1):
+        created_at = started + timedelta(seconds=index * 7)
+        if index % 11 == 0:
+            created_at = created_at.replace(tzinfo=timezone(timedelta(hours=7)))
+        settle_date = created_at + timedelta(minutes=5) if status in (2, 3) else None
+        yield {
+            'id': index,
+            'customer_id': 12345423 + index,
+            'requester_type': requester_type,
+            'requester_id': index % 1000,
+            'secondary_requester_id': secondary_requester_id,
+            'payment_method': method,
+            'payment_amount': float(index * 500),
+            'status': status,
+            'psp_id': None if index % 4 == 0 else "9aed5972-{}".format(index),
+            'payment_info': None if index % 2 else "0248{:0>12}".format(index),
+            'created_at': created_at.isoformat(),
+            'updated_at': (created_at + timedelta(minutes=5)).isoformat(),
+            'settle_date': settle_date and settle_date.isoformat(),
+        }, created_at, settle_date
+
+
+def as_sent(document, created_at, settle_date):
+    return document
+
+
+def with_datetimes(document, created_at, settle_date):
+    return dict(document, created_at=created_at, updated_at=created_at + timedelta(minutes=5), settle_date=settle_date)
+
+
+def without_optional_keys(document, created_at, settle_date):
+    return {key: value for key, value in document.items() if key not in ('payment_info', 'status', 'settle_date')}
+
+
+@pytest.mark.parametrize('variant', [as_sent, with_datetimes, without_optional_keys])
+def test_render_payment_matches_schema(variant):
+    for document in payment_documents():
+        payment = variant(*document)
+        assert render_payment(payment) == GetPaymentSchema().dump(payment).data, payment['id']
@@ -0,0 +1,38 @@
+import json
+
+from nameko.exceptions import deserialize
+
+from gateway.exceptions import IdempotencyConflict
+
+
+PAYMENT = {
+    'customer_id': 1,
+    'requester_type': 1,
+    'requester_id': 7,
+    'payment_method': 'bca_va',
+    'payment_amount': 150000.0,
+}
+
+
+def test_remote_conflict_is_raised_locally():
+    exc = deserialize({
+        'exc_path': 'payments.exceptions.IdempotencyConflict',
+        'exc_type': 'IdempotencyConflict',
+        'exc_args': ['Idempotency-Key key-1 was already used for a different payment'],
+        'value': 'Idempotency-Key key-1 was already used for a different payment',
+    })
+
+    assert isinstance(exc, IdempotencyConflict)
+
+
+def test_reused_key_is_a_conflict(gateway):
+    web, payments_rpc = gateway('create_payment')
+    payments_rpc.create_payment.side_effect = IdempotencyConflict(
+        'Idempotency-Key key-1 was already used for a different payment'
+    )
+
+    response = web.post('/payment', data=json.dumps(PAYMENT), headers={'Idempotency-Key': 'key-1'})
+
+    assert response.status_code == 409
+    assert json.loads(response.get_data())['error'] == 'IDEMPOTENCY_CONFLICT'
+    assert payments_rpc.create_payment.call_args[0][0]['idempotency_key'] == 'key-1'
@@ -0,0 +1,39 @@
+import json
+
+import pytest
+
+
+@pytest.fixture
+def client(gateway):
+    return gateway('get_payment_report')
+
+
+def test_report_by_status_text(client):
+    web, payments_rpc = client
+    payments_rpc.get_payment_report.return_value = [
+        {'day': '2026-10-01', 'status': 2, 'payment_count': 3, 'total_amount': 450000.0},
+    ]
+
+    response = web.get('/payment/report/day?customer_id=7&from=2026-10-01&to=2026-10-31')
+
+    assert response.status_code == 200
+    assert json.loads(response.get_data()) == [
+        {'day': '2026-10-01', 'status': 'Completed', 'payment_count': 3, 'total_amount': 450000.0},
+    ]
+    payments_rpc.get_payment_report.assert_called_once_with('day', 7, '2026-10-01', '2026-10-31')
+
+
+@pytest.mark.parametrize('path', [
+    '/payment/report/amount',
+    '/payment/report/day?customer_id=seven',
+    '/payment/report/day?from=2026-13-01',
+    '/payment/report/day?to=yesterday',
+])
+def test_report_rejects_bad_requests(client, path):
+    web, payments_rpc = client
+
+    response = web.get(path)
+
+    assert response.status_code == 400
+    assert json.loads(response.get_data())['error'] == 'BAD_REQUEST'
+    assert not payments_rpc.get_payment_report.called
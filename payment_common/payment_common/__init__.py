@@ -0,0 +1,5 @@
+"""
+Code shared by the gateway and payments services, installed into both
+images from this directory: the RPC serializer, tracing and the worker
+metrics.
+"""
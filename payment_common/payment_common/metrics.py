@@ -0,0 +1,64 @@
+import time
+
+from nameko.extensions import DependencyProvider
+from prometheus_client import (
+    CONTENT_TYPE_LATEST as CONTENT_TYPE, CollectorRegistry, Gauge, Histogram,
+    GCCollector, PlatformCollector, ProcessCollector, generate_latest,
+)
+
+
+# One registry for the services in this process, with the usual process metrics. Worker
+# metrics carry the service name, so services sharing a process (benchmarks, tools) do not clash
+REGISTRY = CollectorRegistry()
+ProcessCollector(registry=REGISTRY)
+PlatformCollector(registry=REGISTRY)
+GCCollector(registry=REGISTRY)
+
+
+ENTRYPOINT_DURATION = Histogram(
+    'nameko_entrypoint_duration_seconds', 'Worker run time per entrypoint',
+    ['service', 'entrypoint', 'kind', 'outcome'], registry=REGISTRY,
+)
+WORKERS_ACTIVE = Gauge('nameko_workers_active', 'Workers currently running', ['service'], registry=REGISTRY)
+WORKERS_MAX = Gauge('nameko_workers_max', 'Size of the worker pool', ['service'], registry=REGISTRY)
+
+
+class Metrics(DependencyProvider):
+    """ Prometheus instrumentation for every worker of the container: run
+    time and outcome per entrypoint, and active workers against
+    ``max_workers``.
+
+    ``self.workers`` holds a state dict per running worker, which
+    subclasses can add measurements of their own to.
+    """
+
+    def setup(self):
+        self.service_name = self.container.service_name
+        self.workers = {}
+
+        WORKERS_MAX.labels(self.service_name).set(self.container.max_workers)
+
+    def get_dependency(self, worker_ctx):
+        return self
+
+    def worker_setup(self, worker_ctx):
+        self.workers[worker_ctx] = {"started": time.perf_counter()}
+        WORKERS_ACTIVE.labels(self.service_name).inc()
+
+    def worker_result(self, worker_ctx, result=None, exc_info=None):
+        state = self.workers.get(worker_ctx)
+        if state is None:
+            return
+
+        entrypoint = worker_ctx.entrypoint
+        ENTRYPOINT_DURATION.labels(
+            self.service_name, entrypoint.method_name, type(entrypoint).__name__,
+            'success' if exc_info is None else 'error',
+        ).observe(time.perf_counter() - state["started"])
+
+    def worker_teardown(self, worker_ctx):
+        if self.workers.pop(worker_ctx, None) is not None:
+            WORKERS_ACTIVE.labels(self.service_name).dec()
+
+    def render(self):
+        return generate_latest(REGISTRY)
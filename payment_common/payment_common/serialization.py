@@ -0,0 +1,53 @@
+"""
+msgpack serializer for nameko messages, registered with kombu through the
+``SERIALIZERS`` config key.
+
+Besides what msgpack packs natively, ``datetime``, ``date`` and
+``Decimal`` travel as extension types and come back as the same types,
+where the JSON serializer turns them into strings. Enums are sent as their
+value, as the JSON serializer would after a schema dump.
+"""
+import enum
+from datetime import date, datetime
+from decimal import Decimal
+
+import msgpack
+
+
+NAME = 'msgpack-ext'
+CONTENT_TYPE = 'application/x-msgpack-ext'
+
+EXT_DATETIME = 1
+EXT_DATE = 2
+EXT_DECIMAL = 3
+
+
+def default(value):
+    # datetime first, it is a date subclass
+    if isinstance(value, datetime):
+        return msgpack.ExtType(EXT_DATETIME, value.isoformat().encode())
+    if isinstance(value, date):
+        return msgpack.ExtType(EXT_DATE, value.isoformat().encode())
+    if isinstance(value, Decimal):
+        return msgpack.ExtType(EXT_DECIMAL, str(value).encode())
+    if isinstance(value, enum.Enum):
+        return value.value
+    raise TypeError("Cannot serialize {!r}".format(value))
+
+
+def ext_hook(code, data):
+    if code == EXT_DATETIME:
+        return datetime.fromisoformat(data.decode())
+    if code == EXT_DATE:
+        return date.fromisoformat(data.decode())
+    if code == EXT_DECIMAL:
+        return Decimal(data.decode())
+    return msgpack.ExtType(code, data)
+
+
+def dumps(payload):
+    return msgpack.packb(payload, default=default, use_bin_type=True)
+
+
+def loads(data):
+    return msgpack.unpackb(data, ext_hook=ext_hook, raw=False, strict_map_key=False)
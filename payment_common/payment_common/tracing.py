@@ -0,0 +1,122 @@
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from nameko.extensions import DependencyProvider
+
+
+# Context data key, nameko copies context data onto every RPC and event it sends
+CORRELATION_KEY = 'correlation_id'
+
+
+class SpanLog(object):
+    """ Appends spans as JSON lines to ``path``, or drops them if ``path`` is
+    ``None``.
+    """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.file = open(path, 'a', buffering=1) if path else None
+
+    def write(self, span):
+        if self.file is None:
+            return
+        line = json.dumps(span) + "\n"
+        with self.lock:
+            self.file.write(line)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+class WorkerTracer(object):
+    """ Worker-facing handle: the request's correlation id and child spans
+    of the running worker.
+    """
+
+    def __init__(self, tracer, worker_ctx):
+        self.tracer = tracer
+        self.worker_ctx = worker_ctx
+
+    @property
+    def correlation_id(self):
+        return self.worker_ctx.data.get(CORRELATION_KEY)
+
+    @correlation_id.setter
+    def correlation_id(self, value):
+        # Same dict the worker's RPC proxies and dispatchers encode into their headers
+        self.worker_ctx.data[CORRELATION_KEY] = value
+
+    @contextmanager
+    def span(self, name, **attributes):
+        started = time.time()
+        outcome = 'success'
+        try:
+            yield
+        except BaseException:
+            outcome = 'error'
+            raise
+        finally:
+            self.tracer.emit(
+                self.worker_ctx, name, 'internal', started, time.time() - started, outcome,
+                span_id=uuid.uuid4().hex[:16], parent_id=self.worker_ctx.call_id, **attributes
+            )
+
+
+class Tracer(DependencyProvider):
+    """ Writes one timing span per worker to the ``SPAN_LOG_PATH`` JSON-lines
+    file, plus any child spans the worker opens with ``self.tracer.span()``.
+
+    The span id is nameko's ``call_id`` and the parent is the calling
+    worker's, so the spans of one request line up across services.
+    ``tools/trace_waterfall.py`` puts them back together.
+    """
+
+    def setup(self):
+        self.service_name = self.container.service_name
+        self.log = SpanLog(self.container.config.get('SPAN_LOG_PATH'))
+        self.started = {}
+
+    def stop(self):
+        self.log.close()
+
+    def kill(self):
+        self.log.close()
+
+    def get_dependency(self, worker_ctx):
+        return WorkerTracer(self, worker_ctx)
+
+    def worker_setup(self, worker_ctx):
+        # Timers and anything arriving without an id start a trace of their own
+        worker_ctx.data.setdefault(CORRELATION_KEY, uuid.uuid4().hex)
+        self.started[worker_ctx] = time.time()
+
+    def worker_result(self, worker_ctx, result=None, exc_info=None):
+        started = self.started.pop(worker_ctx, None)
+        if started is None:
+            return
+
+        entrypoint = worker_ctx.entrypoint
+        self.emit(
+            worker_ctx, entrypoint.method_name, type(entrypoint).__name__,
+            started, time.time() - started, 'success' if exc_info is None else 'error',
+            span_id=worker_ctx.call_id, parent_id=worker_ctx.immediate_parent_call_id,
+        )
+
+    def worker_teardown(self, worker_ctx):
+        self.started.pop(worker_ctx, None)
+
+    def emit(self, worker_ctx, name, kind, started, duration, outcome, **fields):
+        self.log.write(dict(
+            fields,
+            trace_id=worker_ctx.data.get(CORRELATION_KEY),
+            service=self.service_name,
+            name=name,
+            kind=kind,
+            start=started,
+            duration_ms=duration * 1000,
+            outcome=outcome,
+        ))
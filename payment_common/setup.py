@@ -0,0 +1,15 @@
+#!/usr/bin/env python
+from setuptools import find_packages, setup
+
+setup(
+    name='payment-service-common',
+    version='0.0.1',
+    description='Code shared by the gateway and payments services',
+    packages=find_packages(exclude=['test', 'test.*']),
+    install_requires=[
+        "msgpack>=1.0,<2.0",
+        "nameko==v3.0.0-rc6",
+        "prometheus-client<1.0",
+    ],
+    zip_safe=True
+)
@@ -0,0 +1,34 @@
+"""Payment lookup indexes
+
+Revision ID: 5d1f0a7c3b92
+Revises: a4235c10f8fa
+Create Date: 2026-10-18 09:12:31.204117
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5d1f0a7c3b92'
+down_revision = 'a4235c10f8fa'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block,
+    # building this way keeps the payment table writable while the indexes build
+    with op.get_context().autocommit_block():
+        op.create_index('ix_payment_psp_id', 'payment', ['psp_id'], unique=True, postgresql_concurrently=True)
+        op.create_index('ix_payment_customer_id_created_at', 'payment', ['customer_id', 'created_at'], postgresql_concurrently=True)
+        op.create_index('ix_payment_requester_id_requester_type', 'payment', ['requester_id', 'requester_type'], postgresql_concurrently=True)
+        op.create_index('ix_payment_pending', 'payment', ['id'], postgresql_where=sa.text('status = 1'), postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_payment_pending', table_name='payment', postgresql_concurrently=True)
+        op.drop_index('ix_payment_requester_id_requester_type', table_name='payment', postgresql_concurrently=True)
+        op.drop_index('ix_payment_customer_id_created_at', table_name='payment', postgresql_concurrently=True)
+        op.drop_index('ix_payment_psp_id', table_name='payment', postgresql_concurrently=True)
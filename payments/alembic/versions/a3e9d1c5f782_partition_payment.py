@@ -0,0 +1,80 @@
+"""Partition payment by month
+
+Revision ID: a3e9d1c5f782
+Revises: f5b2d8e6a417
+Create Date: 2026-10-18 19:04:12.481930
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'a3e9d1c5f782'
+down_revision = 'f5b2d8e6a417'
+branch_labels = None
+depends_on = None
+
+from datetime import date
+
+from alembic import op
+import sqlalchemy as sa
+
+INDEXES = (
+    ('ix_payment_customer_id_created_at', ['customer_id', 'created_at']),
+    ('ix_payment_requester_id_requester_type', ['requester_id', 'requester_type']),
+)
+
+
+# The DDL of payments.partitions as it stood, so later changes to it never change this migration
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def upgrade():
+    # Rows are copied over in this one transaction, payment is unavailable until it commits
+    connection = op.get_bind()
+    op.execute("LOCK TABLE payment IN EXCLUSIVE MODE")
+    op.execute("ALTER TABLE payment RENAME TO payment_unpartitioned")
+    op.execute("ALTER SEQUENCE payment_id_seq OWNED BY NONE")
+
+    op.execute("CREATE TABLE payment (LIKE payment_unpartitioned INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)")
+    op.execute("ALTER SEQUENCE payment_id_seq OWNED BY payment.id")
+
+    first = connection.execute(sa.text("SELECT min(created_at) FROM payment_unpartitioned")).scalar()
+    current = month_start(date.today())
+    month = month_start(first) if first else current
+    while month <= add_months(current, 3):
+        op.execute("CREATE TABLE payment_{:%Y_%m} PARTITION OF payment FOR VALUES FROM ('{:%Y-%m-%d}') TO ('{:%Y-%m-%d}')".format(
+            month, month, add_months(month, 1)))
+        month = add_months(month, 1)
+    op.execute("CREATE TABLE payment_default PARTITION OF payment DEFAULT")
+
+    op.execute("INSERT INTO payment SELECT * FROM payment_unpartitioned")
+    op.drop_table('payment_unpartitioned')
+
+    # Built after the copy, once per partition
+    op.create_primary_key('payment_pkey', 'payment', ['id', 'created_at'])
+    op.create_index('ix_payment_psp_id', 'payment', ['psp_id'])
+    for name, columns in INDEXES:
+        op.create_index(name, 'payment', columns)
+    op.create_index('ix_payment_pending', 'payment', ['id'], postgresql_where=sa.text('status = 1'))
+
+
+def downgrade():
+    op.execute("LOCK TABLE payment IN EXCLUSIVE MODE")
+    op.execute("ALTER TABLE payment RENAME TO payment_partitioned")
+    op.execute("ALTER SEQUENCE payment_id_seq OWNED BY NONE")
+
+    op.execute("CREATE TABLE payment (LIKE payment_partitioned INCLUDING DEFAULTS)")
+    op.execute("ALTER SEQUENCE payment_id_seq OWNED BY payment.id")
+    op.execute("INSERT INTO payment SELECT * FROM payment_partitioned")
+    op.execute("DROP TABLE payment_partitioned CASCADE")
+
+    op.create_primary_key('payment_pkey', 'payment', ['id'])
+    op.create_index('ix_payment_psp_id', 'payment', ['psp_id'], unique=True)
+    for name, columns in INDEXES:
+        op.create_index(name, 'payment', columns)
+    op.create_index('ix_payment_pending', 'payment', ['id'], postgresql_where=sa.text('status = 1'))
@@ -0,0 +1,25 @@
+"""Payment charging index
+
+Revision ID: b4f1e8a2c6d9
+Revises: a3e9d1c5f782
+Create Date: 2026-10-18 10:05:12.418220
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'b4f1e8a2c6d9'
+down_revision = 'a3e9d1c5f782'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # Partitioned tables cannot build indexes CONCURRENTLY, few rows match so it is quick
+    op.create_index('ix_payment_charging', 'payment', ['id'], postgresql_where=sa.text('status = 4'))
+
+
+def downgrade():
+    op.drop_index('ix_payment_charging', table_name='payment')
@@ -0,0 +1,39 @@
+"""Payment info column
+
+Revision ID: b8e2c4d17f06
+Revises: 5d1f0a7c3b92
+Create Date: 2026-10-18 11:40:07.918352
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'b8e2c4d17f06'
+down_revision = '5d1f0a7c3b92'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('payment', sa.Column('payment_info', sa.String(), nullable=True))
+
+    # Same rules as payments.midtrans.payment_info_from_response
+    op.execute("""
+        UPDATE payment SET payment_info = CASE
+            WHEN payment_method = 'bca_va' THEN raw_response -> 'va_numbers' -> 0 ->> 'va_number'
+            WHEN payment_method IN ('gopay', 'qris') THEN (
+                SELECT action ->> 'url'
+                FROM jsonb_array_elements(raw_response -> 'actions') AS action
+                WHERE action ->> 'name' = 'generate-qr-code'
+                LIMIT 1
+            )
+        END
+        WHERE raw_response IS NOT NULL
+          AND (jsonb_typeof(raw_response -> 'va_numbers') = 'array' OR jsonb_typeof(raw_response -> 'actions') = 'array')
+    """)
+
+
+def downgrade():
+    op.drop_column('payment', 'payment_info')
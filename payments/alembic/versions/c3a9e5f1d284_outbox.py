@@ -0,0 +1,42 @@
+"""Outbox
+
+Revision ID: c3a9e5f1d284
+Revises: b8e2c4d17f06
+Create Date: 2026-10-18 13:02:44.571209
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'c3a9e5f1d284'
+down_revision = 'b8e2c4d17f06'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'outbox',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('payment_id', sa.Integer(), nullable=False),
+
+        sa.Column('requester_type', sa.Integer(), nullable=False),
+        sa.Column('requester_id', sa.Integer(), nullable=False),
+        sa.Column('secondary_requester_id', sa.Integer(), nullable=True),
+        sa.Column('status', sa.Integer(), nullable=False),
+
+        sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('available_at', sa.DateTime(), nullable=False),
+        sa.Column('last_error', sa.String(), nullable=True),
+
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index('ix_outbox_available_at', 'outbox', ['available_at'])
+
+
+def downgrade():
+    op.drop_index('ix_outbox_available_at', table_name='outbox')
+    op.drop_table('outbox')
@@ -0,0 +1,37 @@
+"""Payment psp ids
+
+Revision ID: c6d2a9f4e1b7
+Revises: b4f1e8a2c6d9
+Create Date: 2026-10-18 10:31:47.902114
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'c6d2a9f4e1b7'
+down_revision = 'b4f1e8a2c6d9'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'payment_psp',
+        sa.Column('psp_id', sa.String(), primary_key=True),
+        sa.Column('payment_id', sa.Integer(), nullable=False),
+
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+    )
+
+    # Fails on a psp_id shared by two payments, those have to be sorted out by hand first
+    op.execute(
+        "INSERT INTO payment_psp (psp_id, payment_id, created_at, updated_at) "
+        "SELECT psp_id, id, created_at, updated_at FROM payment WHERE psp_id IS NOT NULL"
+    )
+
+
+def downgrade():
+    op.drop_table('payment_psp')
@@ -0,0 +1,50 @@
+"""Payment summary
+
+Revision ID: d7f3b6a2c915
+Revises: c3a9e5f1d284
+Create Date: 2026-10-18 14:26:51.033860
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'd7f3b6a2c915'
+down_revision = 'c3a9e5f1d284'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+from sqlalchemy.dialects import postgresql
+import sqlalchemy as sa
+
+
+# The summary as of this revision, later changes to payments.summary must not reach it
+REBUILD_SQL = """
+    INSERT INTO payment_summary (day, customer_id, requester_type, payment_method, status,
+                                 payment_count, total_amount, created_at, updated_at)
+    SELECT created_at::date, customer_id, requester_type, payment_method, status,
+           count(*), sum(payment_amount), now(), now()
+    FROM payment
+    GROUP BY 1, 2, 3, 4, 5
+"""
+
+
+def upgrade():
+    op.create_table(
+        'payment_summary',
+        sa.Column('day', sa.Date(), primary_key=True),
+        sa.Column('customer_id', sa.Integer(), primary_key=True),
+        sa.Column('requester_type', sa.Integer(), primary_key=True),
+        sa.Column('payment_method', postgresql.ENUM(name='payment_method_enum', create_type=False), primary_key=True),
+        sa.Column('status', sa.Integer(), primary_key=True),
+
+        sa.Column('payment_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('total_amount', sa.Float(), nullable=False, server_default='0'),
+
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+    )
+    op.execute(REBUILD_SQL)
+
+
+def downgrade():
+    op.drop_table('payment_summary')
@@ -0,0 +1,27 @@
+"""Payment customer keyset index
+
+Revision ID: d8e3b5c1f2a6
+Revises: c6d2a9f4e1b7
+Create Date: 2026-10-18 10:52:03.337561
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'd8e3b5c1f2a6'
+down_revision = 'c6d2a9f4e1b7'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+
+
+def upgrade():
+    # get_payment_by_customer_id pages on customer_id = ? AND id > ? ORDER BY id,
+    # (customer_id, created_at) could only filter, not return the rows in id order
+    op.create_index('ix_payment_customer_id_id', 'payment', ['customer_id', 'id'])
+    op.drop_index('ix_payment_customer_id_created_at', table_name='payment')
+
+
+def downgrade():
+    op.create_index('ix_payment_customer_id_created_at', 'payment', ['customer_id', 'created_at'])
+    op.drop_index('ix_payment_customer_id_id', table_name='payment')
@@ -0,0 +1,24 @@
+"""Outbox correlation id
+
+Revision ID: e1a4c7b9d320
+Revises: d7f3b6a2c915
+Create Date: 2026-10-18 15:10:37.418952
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e1a4c7b9d320'
+down_revision = 'd7f3b6a2c915'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('outbox', sa.Column('correlation_id', sa.String(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('outbox', 'correlation_id')
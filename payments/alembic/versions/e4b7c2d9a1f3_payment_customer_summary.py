@@ -0,0 +1,107 @@
+"""Payment customer summary
+
+Revision ID: e4b7c2d9a1f3
+Revises: d8e3b5c1f2a6
+Create Date: 2026-10-18 19:12:40.518307
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e4b7c2d9a1f3'
+down_revision = 'd8e3b5c1f2a6'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+from sqlalchemy.dialects import postgresql
+import sqlalchemy as sa
+
+
+# The summaries as of this revision, later changes to payments.summary must not reach them
+SUMMARY_SHARDS = 8
+
+REBUILD_SQL = [
+    """
+    INSERT INTO payment_summary (day, requester_type, payment_method, status, shard,
+                                 payment_count, total_amount, created_at, updated_at)
+    SELECT created_at::date, requester_type, payment_method, status, customer_id % {shards},
+           count(*), sum(payment_amount), now(), now()
+    FROM payment
+    GROUP BY 1, 2, 3, 4, 5
+    """.format(shards=SUMMARY_SHARDS),
+    """
+    INSERT INTO payment_customer_summary (customer_id, day, requester_type, payment_method, status,
+                                          payment_count, total_amount, created_at, updated_at)
+    SELECT customer_id, created_at::date, requester_type, payment_method, status,
+           count(*), sum(payment_amount), now(), now()
+    FROM payment
+    GROUP BY 1, 2, 3, 4, 5
+    """,
+]
+
+DOWNGRADE_REBUILD_SQL = """
+    INSERT INTO payment_summary (day, customer_id, requester_type, payment_method, status,
+                                 payment_count, total_amount, created_at, updated_at)
+    SELECT created_at::date, customer_id, requester_type, payment_method, status,
+           count(*), sum(payment_amount), now(), now()
+    FROM payment
+    GROUP BY 1, 2, 3, 4, 5
+"""
+
+
+def summary_columns():
+    return [
+        sa.Column('payment_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('total_amount', sa.Float(), nullable=False, server_default='0'),
+
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+    ]
+
+
+def payment_method():
+    return postgresql.ENUM(name='payment_method_enum', create_type=False)
+
+
+def upgrade():
+    # Rebuilt from payment, which is held still meanwhile so no change is counted twice or missed
+    op.execute("LOCK TABLE payment IN SHARE MODE")
+    op.drop_table('payment_summary')
+
+    op.create_table(
+        'payment_summary',
+        sa.Column('day', sa.Date(), primary_key=True),
+        sa.Column('requester_type', sa.Integer(), primary_key=True),
+        sa.Column('payment_method', payment_method(), primary_key=True),
+        sa.Column('status', sa.Integer(), primary_key=True),
+        sa.Column('shard', sa.Integer(), primary_key=True),
+        *summary_columns()
+    )
+    op.create_table(
+        'payment_customer_summary',
+        sa.Column('customer_id', sa.Integer(), primary_key=True),
+        sa.Column('day', sa.Date(), primary_key=True),
+        sa.Column('requester_type', sa.Integer(), primary_key=True),
+        sa.Column('payment_method', payment_method(), primary_key=True),
+        sa.Column('status', sa.Integer(), primary_key=True),
+        *summary_columns()
+    )
+    for statement in REBUILD_SQL:
+        op.execute(statement)
+
+
+def downgrade():
+    op.execute("LOCK TABLE payment IN SHARE MODE")
+    op.drop_table('payment_customer_summary')
+    op.drop_table('payment_summary')
+
+    op.create_table(
+        'payment_summary',
+        sa.Column('day', sa.Date(), primary_key=True),
+        sa.Column('customer_id', sa.Integer(), primary_key=True),
+        sa.Column('requester_type', sa.Integer(), primary_key=True),
+        sa.Column('payment_method', payment_method(), primary_key=True),
+        sa.Column('status', sa.Integer(), primary_key=True),
+        *summary_columns()
+    )
+    op.execute(DOWNGRADE_REBUILD_SQL)
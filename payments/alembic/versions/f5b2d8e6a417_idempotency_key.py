@@ -0,0 +1,34 @@
+"""Idempotency key
+
+Revision ID: f5b2d8e6a417
+Revises: e1a4c7b9d320
+Create Date: 2026-10-18 15:52:08.266104
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'f5b2d8e6a417'
+down_revision = 'e1a4c7b9d320'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+from sqlalchemy.dialects import postgresql
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'idempotency_key',
+        sa.Column('key', sa.String(length=255), primary_key=True),
+        sa.Column('payment_id', sa.Integer(), nullable=False),
+        sa.Column('request_hash', sa.String(length=64), nullable=False),
+        sa.Column('response', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table('idempotency_key')
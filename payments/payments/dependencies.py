@@ -0,0 +1,200 @@
+import logging
+import time
+from collections import OrderedDict, deque
+
+import eventlet
+from nameko.extensions import DependencyProvider
+from nameko_sqlalchemy import DB_URIS_KEY, DatabaseSession
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+log = logging.getLogger(__name__)
+
+
+class CallbackBuffer(DependencyProvider):
+    """ Container-wide buffer of Midtrans notifications waiting to be
+    applied in one batched UPDATE.
+
+    Keyed by ``psp_id`` so repeated notifications for one transaction
+    inside a window collapse into the latest one.
+    """
+
+    def setup(self):
+        self.pending = OrderedDict()
+
+    def get_dependency(self, worker_ctx):
+        return self
+
+    def add(self, psp_id, status):
+        self.pending.pop(psp_id, None)
+        self.pending[psp_id] = status
+        return len(self.pending)
+
+    def drain(self, max_items):
+        # No green yield in here, so two workers can never drain the same notification
+        drained = []
+        while self.pending and len(drained) < max_items:
+            drained.append(self.pending.popitem(last=False))
+        return drained
+
+    def restore(self, callbacks):
+        # Back to the front of the queue, a newer notification added meanwhile wins
+        for psp_id, status in reversed(callbacks):
+            if psp_id not in self.pending:
+                self.pending[psp_id] = status
+                self.pending.move_to_end(psp_id, last=False)
+        return len(self.pending)
+
+    def stop(self):
+        # Only left over if the final flush failed, the reconciler picks these up
+        if self.pending:
+            log.warning("%d Midtrans notifications left unapplied at shutdown", len(self.pending))
+
+
+class RateLimiter(object):
+    """ Spaces calls ``1 / rate`` seconds apart across every greenthread
+    sharing the limiter. A falsy ``rate`` disables limiting.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_slot = time.monotonic()
+
+    def acquire(self):
+        # Claim the slot before sleeping, so concurrent callers queue up behind each other
+        now = time.monotonic()
+        slot = max(self.next_slot, now)
+        self.next_slot = slot + self.interval
+
+        if slot > now:
+            eventlet.sleep(slot - now)
+
+
+class ReconcileState(DependencyProvider):
+    """ Container-wide state of the pending payment reconciler: the keyset
+    cursor it resumes from on the next tick, and the Midtrans rate limiter
+    its greenthreads share.
+    """
+
+    def setup(self):
+        self.after_id = 0
+        self.limiter = RateLimiter(self.container.config.get('RECONCILE_RATE_LIMIT', 20))
+
+    def get_dependency(self, worker_ctx):
+        return self
+
+
+class ReplicaSession(DatabaseSession):
+    """ Read-only session on the streaming replica at ``DB_REPLICA_URI``,
+    with a pool of its own (``DB_REPLICA_POOL_SIZE`` /
+    ``DB_REPLICA_MAX_OVERFLOW``) so listing and polling never queue behind
+    the writers for a connection.
+
+    Without a replica URI the sessions go to the primary, still read-only.
+    """
+
+    def setup(self):
+        config = self.container.config
+        uri_key = '{}:{}'.format(self.container.service_name, self.declarative_base.__name__)
+
+        self.db_uri = config.get('DB_REPLICA_URI') or config[DB_URIS_KEY][uri_key]
+        self.engine = create_engine(
+            self.db_uri,
+            pool_size=config.get('DB_REPLICA_POOL_SIZE', 10),
+            max_overflow=config.get('DB_REPLICA_MAX_OVERFLOW', 10),
+            **self.engine_options
+        )
+        self.Session = sessionmaker(
+            bind=self.engine.execution_options(postgresql_readonly=True), **self.session_options
+        )
+
+
+class RecentWrites(DependencyProvider):
+    """ Payment ids this container wrote in the last
+    ``DB_REPLICA_READ_YOUR_WRITES`` seconds. Reads of them go to the primary,
+    so a caller does not read back an older state than the one this
+    instance just wrote. ``0`` turns read-your-writes off.
+    """
+
+    def setup(self):
+        self.window = self.container.config.get('DB_REPLICA_READ_YOUR_WRITES', 5) or 0
+        self.expires = OrderedDict()
+
+    def get_dependency(self, worker_ctx):
+        return self
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def add(self, *payment_ids):
+        if not self.enabled:
+            return
+
+        # Same window for every id, so insertion order is expiry order
+        expires = time.monotonic() + self.window
+        for payment_id in payment_ids:
+            self.expires.pop(int(payment_id), None)
+            self.expires[int(payment_id)] = expires
+
+    def contains(self, payment_ids):
+        now = time.monotonic()
+        while self.expires and next(iter(self.expires.values())) < now:
+            self.expires.popitem(last=False)
+
+        return any(int(payment_id) in self.expires for payment_id in payment_ids)
+
+
+class IdempotencyCache(DependencyProvider):
+    """ Container-wide LRU of finished ``create_payment`` responses by
+    idempotency key, ``IDEMPOTENCY_CACHE_SIZE`` entries. A retry that hits
+    it costs neither a query nor a Midtrans call.
+    """
+
+    def setup(self):
+        self.max_size = self.container.config.get('IDEMPOTENCY_CACHE_SIZE', 10000)
+        self.entries = OrderedDict()
+
+    def get_dependency(self, worker_ctx):
+        return self
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def set(self, key, request_hash, response):
+        self.entries[key] = (request_hash, response)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+
+class PaymentIds(DependencyProvider):
+    """ Payment ids taken from ``payment_id_seq`` ``PAYMENT_ID_BLOCK_SIZE``
+    at a time and handed out by every worker in the container, so a
+    payment's id (the Midtrans ``order_id``) is known before its row is
+    written.
+
+    Ids are unique but no longer in creation order across instances, and
+    the unused rest of a block is skipped when the container stops.
+    """
+
+    def setup(self):
+        self.block_size = self.container.config.get('PAYMENT_ID_BLOCK_SIZE', 50)
+        self.ids = deque()
+
+    def get_dependency(self, worker_ctx):
+        return self
+
+    def next_id(self, session):
+        if not self.ids:
+            # On a connection of its own, the worker's session stays out of a transaction.
+            # Two workers refilling at once both add their block, nothing is handed out twice
+            with session.get_bind().connect() as connection:
+                self.ids.extend(connection.execute(
+                    text("SELECT nextval('payment_id_seq') FROM generate_series(1, :size)"),
+                    {"size": self.block_size},
+                ).scalars())
+        return self.ids.popleft()
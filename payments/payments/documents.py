@@ -0,0 +1,75 @@
+"""
+Single-pass payment documents, the same dicts ``PaymentSchema.dump``
+returns for a Payment, built without going through marshmallow.
+
+``dump_payments`` takes ORM payments or, cheaper, the rows of a query on
+``payment_columns()``, which skips building ORM instances altogether.
+``PaymentSchema`` stays the reference for the output, ``test/test_documents.py``
+and ``tools/check_documents.py`` compare the two.
+"""
+from datetime import timezone
+from operator import attrgetter
+
+from payments.models import Payment, PaymentMethodEnum
+
+
+FIELDS = (
+    'id', 'customer_id', 'requester_type', 'requester_id', 'secondary_requester_id',
+    'payment_method', 'payment_amount', 'status', 'psp_id', 'payment_info',
+    'created_at', 'updated_at', 'settle_date',
+)
+
+get_fields = attrgetter(*FIELDS)
+
+METHOD_VALUES = {method: method.value for method in PaymentMethodEnum}
+
+
+def payment_columns(include_raw=False):
+    """ Columns to query instead of ``Payment`` when the rows only get dumped.
+    ``raw_response`` is the full Midtrans JSONB blob, it is only read and
+    shipped over RPC when asked for.
+    """
+    columns = [getattr(Payment, name) for name in FIELDS]
+    if include_raw:
+        columns.append(Payment.raw_response)
+    return columns
+
+
+def isoformat(value):
+    # marshmallow's DateTime: naive datetimes are taken as UTC
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        return value.isoformat() + '+00:00'
+    return value.astimezone(timezone.utc).isoformat()
+
+
+def dump_payment(payment, include_raw=False):
+    (
+        payment_id, customer_id, requester_type, requester_id, secondary_requester_id,
+        payment_method, payment_amount, status, psp_id, payment_info,
+        created_at, updated_at, settle_date,
+    ) = get_fields(payment)
+
+    document = {
+        'id': payment_id,
+        'customer_id': customer_id,
+        'requester_type': requester_type,
+        'requester_id': requester_id,
+        'secondary_requester_id': secondary_requester_id,
+        'payment_method': METHOD_VALUES.get(payment_method) or str(payment_method),
+        'payment_amount': None if payment_amount is None else float(payment_amount),
+        'status': status,
+        'psp_id': psp_id,
+        'payment_info': payment_info,
+        'created_at': isoformat(created_at),
+        'updated_at': isoformat(updated_at),
+        'settle_date': isoformat(settle_date),
+    }
+    if include_raw:
+        document['raw_response'] = payment.raw_response
+    return document
+
+
+def dump_payments(payments, include_raw=False):
+    return [dump_payment(payment, include_raw) for payment in payments]
@@ -0,0 +1,20 @@
+from nameko.timer import Timer
+
+
+class FlushTimer(Timer):
+    """ ``timer`` that ticks once more when the container stops.
+
+    Entrypoints stop before dependencies, so the last tick still has the
+    database session and event dispatcher of a normal one. Whatever the
+    decorated method flushes from memory is written out instead of dropped
+    with the process.
+    """
+
+    def stop(self):
+        super(FlushTimer, self).stop()
+
+        self.handle_timer_tick()
+        self.worker_complete.wait()
+
+
+flush_timer = FlushTimer.decorator
@@ -1,2 +1,7 @@
 class NotFound(Exception):
     pass
+
+
+class IdempotencyConflict(Exception):
+    """ An Idempotency-Key reused for a request with a different body. """
+    pass
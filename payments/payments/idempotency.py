@@ -0,0 +1,44 @@
+import hashlib
+import json
+
+from sqlalchemy.dialects.postgresql import insert
+
+from payments.models import IdempotencyKey
+
+
+# Fields that make two create_payment calls the same request
+REQUEST_FIELDS = (
+    'customer_id', 'requester_type', 'requester_id', 'secondary_requester_id',
+    'payment_method', 'payment_amount', 'status',
+)
+
+
+def request_hash(validated):
+    request = {field: validated.get(field) for field in REQUEST_FIELDS}
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+
+def claim_key(session, key, request_hash, payment_id):
+    """ Bind ``key`` to the not yet committed ``payment_id``.
+
+    ``False`` means another call holds the key. If that call is still in
+    flight, the unique index makes this wait for it to commit or roll
+    back first.
+    """
+    claimed = session.execute(
+        insert(IdempotencyKey)
+        .values(key=key, payment_id=payment_id, request_hash=request_hash)
+        .on_conflict_do_nothing(index_elements=['key'])
+        .returning(IdempotencyKey.key)
+    ).first()
+    return claimed is not None
+
+
+def find_key(session, key):
+    return session.get(IdempotencyKey, key)
+
+
+def save_response(session, key, response):
+    session.query(IdempotencyKey).filter(IdempotencyKey.key == key).update(
+        {IdempotencyKey.response: response}, synchronize_session=False
+    )
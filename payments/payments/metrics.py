@@ -0,0 +1,75 @@
+import threading
+import time
+
+from prometheus_client import Counter, Histogram
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from payment_common import metrics
+from payment_common.metrics import REGISTRY
+
+
+DB_QUERIES = Counter('db_queries_total', 'Queries sent to the database', ['service', 'entrypoint'], registry=REGISTRY)
+DB_QUERIES_PER_WORKER = Histogram(
+    'db_queries_per_worker', 'Queries sent by one worker', ['service', 'entrypoint'],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100), registry=REGISTRY,
+)
+DB_TIME_PER_WORKER = Histogram(
+    'db_query_seconds_per_worker', 'Time one worker spent waiting on the database', ['service', 'entrypoint'],
+    registry=REGISTRY,
+)
+
+MIDTRANS_DURATION = Histogram(
+    'midtrans_request_duration_seconds', 'Midtrans API call latency', ['endpoint', 'outcome'], registry=REGISTRY,
+)
+
+
+class Metrics(metrics.Metrics):
+    """ The shared worker metrics, plus the number of queries each worker
+    sent and how long it waited on them.
+
+    Queries are attributed through a greenthread-local that is set while a
+    worker runs, so work a worker hands to a pool of its own is not counted.
+    """
+
+    def setup(self):
+        super(Metrics, self).setup()
+        self.current = threading.local()
+
+        event.listen(Engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self.after_cursor_execute)
+
+    def stop(self):
+        event.remove(Engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.remove(Engine, 'after_cursor_execute', self.after_cursor_execute)
+
+    def worker_setup(self, worker_ctx):
+        super(Metrics, self).worker_setup(worker_ctx)
+        state = self.workers[worker_ctx]
+        state.update(queries=0, db_time=0.0)
+        self.current.state = state
+
+    def worker_result(self, worker_ctx, result=None, exc_info=None):
+        super(Metrics, self).worker_result(worker_ctx, result, exc_info)
+        state = self.workers.get(worker_ctx)
+        if state is None:
+            return
+
+        entrypoint = worker_ctx.entrypoint
+        DB_QUERIES.labels(self.service_name, entrypoint.method_name).inc(state["queries"])
+        DB_QUERIES_PER_WORKER.labels(self.service_name, entrypoint.method_name).observe(state["queries"])
+        DB_TIME_PER_WORKER.labels(self.service_name, entrypoint.method_name).observe(state["db_time"])
+
+    def worker_teardown(self, worker_ctx):
+        super(Metrics, self).worker_teardown(worker_ctx)
+        self.current.state = None
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['query_started'].pop()
+        state = getattr(self.current, 'state', None)
+        if state is not None:
+            state["queries"] += 1
+            state["db_time"] += time.perf_counter() - started
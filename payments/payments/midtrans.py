@@ -0,0 +1,140 @@
+import time
+from base64 import b64encode
+
+import requests
+from nameko.extensions import DependencyProvider
+from requests.adapters import HTTPAdapter
+
+from payment_common.tracing import CORRELATION_KEY
+
+from payments.metrics import MIDTRANS_DURATION
+
+
+# Midtrans transaction_status -> payment status, anything else leaves the payment pending
+TRANSACTION_STATUS = {
+    "settlement": 2,        # DONE
+    "cancel": 3,            # CANCELLED
+    "expire": 3,            # CANCELLED
+}
+
+
+def payment_info_from_response(payment_method, raw_response):
+    """ What the customer needs to pay: the BCA virtual account number, or
+    the QR code url for gopay / qris. ``None`` for everything else.
+    """
+    method = getattr(payment_method, 'value', payment_method)
+    raw_response = raw_response or {}
+
+    # bank_transfer → BCA VA
+    if method == "bca_va":
+        va_list = raw_response.get("va_numbers") or []
+        if va_list:
+            return va_list[0].get("va_number")
+
+    # gopay or qris → use actions[].url
+    if method in ["gopay", "qris"]:
+        for action in raw_response.get("actions") or []:
+            if action.get("name") == "generate-qr-code":
+                return action.get("url")
+
+    return None
+
+
+def charge_error_from_response(raw_response):
+    """ Why a charge created no transaction, ``None`` if it did. """
+    raw_response = raw_response or {}
+    if raw_response.get("transaction_id"):
+        return None
+    return raw_response.get("status_message") or raw_response.get("error") or "Midtrans returned no transaction"
+
+
+class MidtransApi(object):
+    """ Worker-facing handle onto the shared, pooled Midtrans session.
+    """
+
+    def __init__(self, session, base_url, headers, timeout):
+        self.session = session
+        self.base_url = base_url
+        self.headers = headers
+        self.timeout = timeout
+
+    def charge(self, json_body):
+        # https://api.sandbox.midtrans.com/v2/charge
+        return self.request("POST", "/charge", json_body=json_body, endpoint="charge")
+
+    def status(self, psp_id):
+        # https://api.sandbox.midtrans.com/v2/{transaction_id}/status
+        return self.request("GET", "/" + str(psp_id) + "/status", endpoint="status")
+
+    def cancel(self, psp_id):
+        # https://api.sandbox.midtrans.com/v2/{transaction_id}/cancel
+        return self.request("POST", "/" + str(psp_id) + "/cancel", endpoint="cancel")
+
+    def request(self, method, path, json_body=None, endpoint="other"):
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            response = self.session.request(
+                method=method.upper(),
+                url=self.base_url + path,
+                headers=self.headers,
+                json=json_body,
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            outcome = type(e).__name__
+            return {"error": str(e), "status_code": getattr(e.response, 'status_code', None)}
+        finally:
+            MIDTRANS_DURATION.labels(endpoint, outcome).observe(time.perf_counter() - started)
+
+
+class MidtransClient(DependencyProvider):
+    """ Owns one keep-alive `requests.Session` per service container, so
+    Midtrans calls reuse pooled TCP+TLS connections instead of opening a
+    new one per call.
+
+    The pool holds ``MIDTRANS_POOL_SIZE`` connections, defaulting to the
+    container's ``max_workers`` so every worker can hold one at a time.
+    """
+
+    def setup(self):
+        config = self.container.config
+
+        self.base_url = config.get('MIDTRANS_URL', 'https://api.sandbox.midtrans.com/v2').rstrip('/')
+        self.timeout = (
+            config.get('MIDTRANS_CONNECT_TIMEOUT', 3.05),
+            config.get('MIDTRANS_READ_TIMEOUT', 10),
+        )
+
+        # Basic auth header never changes, build it once
+        auth = b64encode("{}:".format(config.get('MIDTRANS_SERVER_KEY') or "").encode()).decode()
+        self.headers = {
+            "Authorization": "Basic {}".format(auth),
+            "Content-Type": "application/json"
+        }
+
+    def start(self):
+        pool_size = self.container.config.get('MIDTRANS_POOL_SIZE') or self.container.max_workers
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def stop(self):
+        self.session.close()
+
+    def kill(self):
+        self.session.close()
+
+    def get_dependency(self, worker_ctx):
+        headers = self.headers
+        # No worker when a tool or benchmark drives the client directly
+        correlation_id = worker_ctx.data.get(CORRELATION_KEY) if worker_ctx is not None else None
+        if correlation_id:
+            # Lets a call be found again on the Midtrans side
+            headers = dict(headers, **{"X-Correlation-ID": correlation_id})
+        return MidtransApi(self.session, self.base_url, headers, self.timeout)
+
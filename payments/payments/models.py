@@ -2,7 +2,7 @@ import datetime
 import enum
 
 from sqlalchemy import (
-    Column, Integer, String, Enum, Float, DateTime
+    Column, Integer, String, Enum, Float, Date, DateTime, Index, PrimaryKeyConstraint, text
 )
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
@@ -33,9 +33,26 @@ class PaymentMethodEnum(enum.Enum):
     ovo = "ovo"
 
 class Payment(DeclarativeBase):
+    """ Range-partitioned by month on ``created_at``, see ``payments.partitions``.
+
+    A partitioned table's unique constraints must include ``created_at``, so
+    the table key is ``(id, created_at)`` and ``psp_id`` is only indexed
+    here, ``PaymentPsp`` keeps it unique. ``id`` alone still comes from one sequence and stays the ORM
+    identity, ``query.get(id)`` works as before.
+    """
     __tablename__ = "payment"
+    __table_args__ = (
+        PrimaryKeyConstraint("id", "created_at"),
+        Index("ix_payment_psp_id", "psp_id"),
+        Index("ix_payment_customer_id_id", "customer_id", "id"),                         # Keyset pages of a customer
+        Index("ix_payment_requester_id_requester_type", "requester_id", "requester_type"),
+        Index("ix_payment_pending", "id", postgresql_where=text("status = 1")),          # Pending work only
+        Index("ix_payment_charging", "id", postgresql_where=text("status = 4")),         # Async charges in flight
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+    __mapper_args__ = {"primary_key": ["id"]}
 
-    id                       = Column(Integer, primary_key=True, autoincrement=True)
+    id                       = Column(Integer, autoincrement=True)
     
     customer_id              = Column(Integer, nullable=False)
     requester_type           = Column(Integer, nullable=False)
@@ -48,6 +65,92 @@ class Payment(DeclarativeBase):
     
     psp_id                   = Column(String)
     raw_response             = Column(JSONB)
+    payment_info             = Column(String)                # VA number / QR url, derived from raw_response
     
     settle_date              = Column(DateTime, nullable=True)
 
+
+class PaymentSummary(DeclarativeBase):
+    """ Running payment counts and totals per day, requester type, payment
+    method and status, over all customers. Kept in step with ``payment`` by
+    ``payments.summary`` in the same transaction as every insert and
+    status change.
+
+    Each group is split over ``SUMMARY_SHARDS`` rows by customer, so
+    concurrent writers rarely wait on the same row. Reports sum the shards.
+    """
+    __tablename__ = "payment_summary"
+
+    day                      = Column(Date, primary_key=True)
+    requester_type           = Column(Integer, primary_key=True)
+    payment_method           = Column(Enum(PaymentMethodEnum, name="payment_method_enum"), primary_key=True)
+    status                   = Column(Integer, primary_key=True)
+    shard                    = Column(Integer, primary_key=True)                                    # customer_id % SUMMARY_SHARDS
+
+    payment_count            = Column(Integer, default=0, nullable=False)
+    total_amount             = Column(Float, default=0, nullable=False)
+
+
+class PaymentCustomerSummary(DeclarativeBase):
+    """ The same counts and totals per customer, for reports of one
+    customer or by customer. Maintained alongside ``PaymentSummary``.
+    """
+    __tablename__ = "payment_customer_summary"
+
+    customer_id              = Column(Integer, primary_key=True)
+    day                      = Column(Date, primary_key=True)
+    requester_type           = Column(Integer, primary_key=True)
+    payment_method           = Column(Enum(PaymentMethodEnum, name="payment_method_enum"), primary_key=True)
+    status                   = Column(Integer, primary_key=True)
+
+    payment_count            = Column(Integer, default=0, nullable=False)
+    total_amount             = Column(Float, default=0, nullable=False)
+
+
+class Outbox(DeclarativeBase):
+    """ Requester status notifications, written in the same transaction as
+    the payment status change and drained by ``PaymentsService.relay_outbox``.
+    """
+    __tablename__ = "outbox"
+    __table_args__ = (
+        Index("ix_outbox_available_at", "available_at"),
+    )
+
+    id                       = Column(Integer, primary_key=True, autoincrement=True)
+    payment_id               = Column(Integer, nullable=False)
+
+    requester_type           = Column(Integer, nullable=False)
+    requester_id             = Column(Integer, nullable=False)
+    secondary_requester_id   = Column(Integer)
+    status                   = Column(Integer, nullable=False)
+
+    attempts                 = Column(Integer, default=0, nullable=False)
+    available_at             = Column(DateTime, default=datetime.datetime.now, nullable=False)     # Retry backoff
+    last_error               = Column(String)
+    correlation_id           = Column(String)                                                      # Of the request that changed the payment
+
+
+class IdempotencyKey(DeclarativeBase):
+    """ ``Idempotency-Key`` of a ``create_payment`` call, claimed in the same
+    transaction as the payment insert. Kept off the payment table so the
+    uniqueness of the key never depends on how that table is laid out.
+    """
+    __tablename__ = "idempotency_key"
+
+    key                      = Column(String(255), primary_key=True)
+    payment_id               = Column(Integer, nullable=False)
+    request_hash             = Column(String(64), nullable=False)                                   # Detects a key reused for another request
+    response                 = Column(JSONB)                                                        # What the first call returned, once it finished
+
+
+
+class PaymentPsp(DeclarativeBase):
+    """ Midtrans transaction id of every charged payment, written in the
+    same transaction as the payment's ``psp_id``. The partitioned payment
+    table cannot have a unique index on ``psp_id`` alone, this key keeps a
+    callback or ``UPDATE ... WHERE psp_id`` to at most one payment.
+    """
+    __tablename__ = "payment_psp"
+
+    psp_id                   = Column(String, primary_key=True)
+    payment_id               = Column(Integer, nullable=False)
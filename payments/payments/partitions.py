@@ -0,0 +1,192 @@
+"""
+Monthly range partitions of the ``payment`` table on ``created_at``.
+
+``payment_default`` catches rows no monthly partition covers, so an
+insert never fails because maintenance fell behind. ``maintain`` keeps
+``--ahead`` months of partitions ready past the current one, moving any
+rows that already landed in the default partition, and archives
+partitions older than ``--retain`` months whose payments are all settled
+or cancelled: it detaches them and moves them into the ``archive``
+schema, or drops them with ``--drop``. Run it daily from cron:
+
+    python -m payments.partitions maintain --ahead 3 --retain 12
+    python -m payments.partitions list
+
+Archived payments keep counting in the summaries, but a summary
+``rebuild`` only sees the partitions still attached.
+"""
+import argparse
+import re
+from datetime import date
+
+from sqlalchemy import create_engine, text
+
+from payments.summary import get_url
+from payments.transitions import FINAL_STATUSES
+
+
+DEFAULT_PARTITION = 'payment_default'
+ARCHIVE_SCHEMA = 'archive'
+
+BOUND_RE = re.compile(r"FROM \('(\d{4}-\d{2}-\d{2})[^']*'\) TO \('(\d{4}-\d{2}-\d{2})[^']*'\)")
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return 'payment_{:%Y_%m}'.format(month)
+
+
+def list_partitions(connection):
+    """ ``(name, from, to)`` of every monthly partition attached to
+    ``payment``, oldest first. The default partition is left out.
+    """
+    rows = connection.execute(text(
+        "SELECT child.relname, pg_get_expr(child.relpartbound, child.oid) "
+        "FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE pg_inherits.inhparent = 'payment'::regclass"
+    ))
+
+    partitions = []
+    for name, bound in rows:
+        match = BOUND_RE.search(bound)
+        if match:
+            partitions.append((name, date.fromisoformat(match.group(1)), date.fromisoformat(match.group(2))))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def create_partition(connection, month):
+    """ Add the partition for the month starting at ``month``. Rows of that
+    month already sitting in the default partition are moved into it, which
+    briefly takes the default partition out of ``payment``.
+    """
+    bounds = {'start': month, 'end': add_months(month, 1)}
+    stranded = has_default_partition(connection) and connection.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM " + DEFAULT_PARTITION + " "
+        "WHERE created_at >= :start AND created_at < :end)"
+    ), bounds).scalar()
+
+    if stranded:
+        connection.execute(text("ALTER TABLE payment DETACH PARTITION " + DEFAULT_PARTITION))
+
+    connection.execute(text(
+        "CREATE TABLE {} PARTITION OF payment FOR VALUES FROM ('{:%Y-%m-%d}') TO ('{:%Y-%m-%d}')".format(
+            partition_name(month), bounds['start'], bounds['end'])
+    ))
+
+    if stranded:
+        connection.execute(text(
+            "WITH moved AS (DELETE FROM " + DEFAULT_PARTITION + " "
+            "WHERE created_at >= :start AND created_at < :end RETURNING *) "
+            "INSERT INTO payment SELECT * FROM moved"
+        ), bounds)
+        connection.execute(text("ALTER TABLE payment ATTACH PARTITION " + DEFAULT_PARTITION + " DEFAULT"))
+
+
+def has_default_partition(connection):
+    return bool(connection.execute(text(
+        "SELECT partdefid <> 0 FROM pg_partitioned_table WHERE partrelid = 'payment'::regclass"
+    )).scalar())
+
+
+def create_default_partition(connection):
+    connection.execute(text("CREATE TABLE " + DEFAULT_PARTITION + " PARTITION OF payment DEFAULT"))
+
+
+def ensure_partitions(connection, first_month, last_month):
+    """ Create every missing monthly partition from ``first_month`` through
+    ``last_month``. Returns the names created.
+    """
+    existing = {start for _, start, _ in list_partitions(connection)}
+
+    created = []
+    month = month_start(first_month)
+    while month <= last_month:
+        if month not in existing:
+            create_partition(connection, month)
+            created.append(partition_name(month))
+        month = add_months(month, 1)
+    return created
+
+
+def archive_partition(connection, name, drop=False):
+    """ Detach partition ``name`` and move it into the ``archive`` schema, or
+    drop it. Returns ``False`` without touching it while any of its payments
+    is still open, so a pending payment never disappears from ``payment``.
+    """
+    open_payments = connection.execute(text(
+        "SELECT count(*) FROM {} WHERE status NOT IN ({})".format(name, ", ".join(str(status) for status in FINAL_STATUSES))
+    )).scalar()
+    if open_payments:
+        return False
+
+    connection.execute(text("ALTER TABLE payment DETACH PARTITION " + name))
+    if drop:
+        connection.execute(text("DROP TABLE " + name))
+    else:
+        connection.execute(text("CREATE SCHEMA IF NOT EXISTS " + ARCHIVE_SCHEMA))
+        connection.execute(text("ALTER TABLE {} SET SCHEMA {}".format(name, ARCHIVE_SCHEMA)))
+    return True
+
+
+def maintain(engine, ahead=3, retain=None, drop=False, today=None):
+    """ Create partitions through ``ahead`` months past the current one and
+    archive those ending ``retain`` or more months before it. Every
+    partition gets a transaction of its own, so a long archive run holds
+    ``payment`` locked for one short DDL statement at a time.
+    """
+    current = month_start(today or date.today())
+
+    for month in (add_months(current, offset) for offset in range(ahead + 1)):
+        with engine.begin() as connection:
+            connection.execute(text("SET LOCAL lock_timeout = '5s'"))
+            for name in ensure_partitions(connection, month, month):
+                print("created {}".format(name))
+
+    if retain is None:
+        return
+
+    cutoff = add_months(current, -retain)
+    with engine.connect() as connection:
+        expired = [name for name, _, end in list_partitions(connection) if end <= cutoff]
+
+    for name in expired:
+        with engine.begin() as connection:
+            connection.execute(text("SET LOCAL lock_timeout = '5s'"))
+            if archive_partition(connection, name, drop):
+                print("{} {}".format("dropped" if drop else "archived", name))
+            else:
+                print("kept {}, it still has open payments".format(name))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    maintain_parser = commands.add_parser('maintain', help='create future partitions and archive old ones')
+    maintain_parser.add_argument('--ahead', type=int, default=3, help='months of partitions to keep ready')
+    maintain_parser.add_argument('--retain', type=int, help='months to keep attached, archives nothing when left out')
+    maintain_parser.add_argument('--drop', action='store_true', help='drop expired partitions instead of archiving them')
+
+    commands.add_parser('list', help='print the attached partitions and their row counts')
+    args = parser.parse_args()
+
+    engine = create_engine(get_url())
+    if args.command == 'maintain':
+        return maintain(engine, args.ahead, args.retain, args.drop)
+
+    with engine.connect() as connection:
+        for name, start, end in list_partitions(connection) + [(DEFAULT_PARTITION, None, None)]:
+            rows = connection.execute(text("SELECT count(*) FROM " + name)).scalar()
+            print("{:<20} {:<10} {:<10} {:>10}".format(name, str(start or '-'), str(end or '-'), rows))
+
+
+if __name__ == '__main__':
+    main()
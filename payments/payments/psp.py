@@ -0,0 +1,29 @@
+from sqlalchemy.dialects.postgresql import insert
+
+from payments.models import PaymentPsp
+
+
+def record_psp_ids(session, payments):
+    """ Claim the ``psp_id`` of each charged payment in ``payment_psp``. A
+    ``psp_id`` some other payment already holds fails the transaction with
+    an ``IntegrityError``, so two payments never share one.
+    """
+    rows = [{"psp_id": payment.psp_id, "payment_id": payment.id} for payment in payments if payment.psp_id]
+    if rows:
+        session.execute(insert(PaymentPsp).values(rows))
+
+
+def claim_psp_ids(session, payments):
+    """ Like ``record_psp_ids``, but a ``psp_id`` some other payment already
+    holds is skipped rather than failing the transaction. Returns the ids
+    of the payments whose ``psp_id`` was claimed.
+    """
+    rows = [{"psp_id": payment.psp_id, "payment_id": payment.id} for payment in payments if payment.psp_id]
+    if not rows:
+        return set()
+    return set(session.execute(
+        insert(PaymentPsp)
+        .values(rows)
+        .on_conflict_do_nothing(index_elements=['psp_id'])
+        .returning(PaymentPsp.payment_id)
+    ).scalars())
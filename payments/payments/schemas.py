@@ -14,10 +14,13 @@ class PaymentSchema(Schema):
     
     psp_id = fields.Str(allow_none=True)
     raw_response = fields.Dict(allow_none=True)
+    payment_info = fields.Str(dump_only=True, allow_none=True)
     
     created_at = fields.DateTime(dump_only=True)
     updated_at = fields.DateTime(dump_only=True)
     settle_date = fields.DateTime(allow_none=True)
+
+    idempotency_key = fields.Str(load_only=True, allow_none=True, validate=validate.Length(min=1, max=255))
     
     def get_payment_method(self, obj):
         return obj.payment_method.value if hasattr(obj.payment_method, "value") else str(obj.payment_method)
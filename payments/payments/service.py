@@ -1,62 +1,114 @@
-import os
-import requests
-from datetime import datetime
-from base64 import b64encode
+from datetime import datetime, timedelta
+from types import SimpleNamespace
 
+from eventlet import GreenPool, Timeout
+from nameko import config
 from nameko.exceptions import BadRequest
-from nameko.events import EventDispatcher
-from nameko.rpc import rpc
+from nameko.events import EventDispatcher, event_handler
+from nameko.rpc import RpcProxy, rpc
+from nameko.timer import timer
+from nameko.web.handlers import http
 from nameko_sqlalchemy import DatabaseSession
+from sqlalchemy import Integer, any_, bindparam, delete, insert, select, text, update
+from sqlalchemy.dialects.postgresql import ARRAY
+from werkzeug import Response
 
-from payments.models import DeclarativeBase, Payment, PaymentMethodEnum
+from payment_common.metrics import CONTENT_TYPE
+from payment_common.tracing import Tracer
+
+from payments.dependencies import CallbackBuffer, IdempotencyCache, PaymentIds, ReconcileState, RecentWrites, ReplicaSession
+from payments.documents import dump_payment, dump_payments, payment_columns
+from payments.entrypoints import flush_timer
+from payments.idempotency import claim_key, find_key, request_hash, save_response
+from payments.metrics import Metrics
+from payments.midtrans import MidtransClient, TRANSACTION_STATUS, charge_error_from_response, payment_info_from_response
+from payments.models import DeclarativeBase, Outbox, Payment, PaymentMethodEnum
+from payments.psp import claim_psp_ids, record_psp_ids
 from payments.schemas import PaymentSchema
-from payments.exceptions import NotFound
+from payments.summary import REPORT_GROUPS, record_payments, record_transitions, report
+from payments.transitions import ALREADY_FINAL, transition_payment
+from payments.exceptions import IdempotencyConflict, NotFound
 
 
 class PaymentsService:
     name = 'payments'
-    
-    midtransUrl = 'https://api.sandbox.midtrans.com/v2'
-    midtransSnapUrl = 'https://app.sandbox.midtrans.com/snap/v1'
-    midtransServerKey = os.environ.get("PAYMENT_SECRET")
 
     db = DatabaseSession(DeclarativeBase)
+    replica = ReplicaSession(DeclarativeBase)
+    recent_writes = RecentWrites()
+    idempotency_cache = IdempotencyCache()
+    payment_ids = PaymentIds()
+    midtrans = MidtransClient()
+    callback_buffer = CallbackBuffer()
+    reconcile_state = ReconcileState()
     event_dispatcher = EventDispatcher()
+    metrics = Metrics()
+    tracer = Tracer()
     
-    # reservation_rpc = rpc('reservation_service')
-    # event_rpc = rpc('event_service')
-    # order_rpc = rpc('order_service')
-    delivery_rpc = rpc('delivery_service"')
+    # reservation_rpc = RpcProxy('reservation_service')
+    # event_rpc = RpcProxy('event_service')
+    # order_rpc = RpcProxy('order_service')
+    delivery_rpc = RpcProxy('delivery_service')
 
     @rpc
-    def get_payment_list(self):
-        paymentList = self.db.query(Payment).all()
+    def get_payment_list(self, after_id=None, limit=None, include_raw=False):
+        paymentList = self.get_payment_page(self.replica.query(*payment_columns(include_raw)), after_id, limit)
 
-        return PaymentSchema(many=True).dump(paymentList).data
+        return dump_payments(paymentList, include_raw)
     
     @rpc
-    def get_payment_by_id(self, payment_id):
-        payment = self.db.query(Payment).get(payment_id)
+    def get_payment_by_id(self, payment_id, include_raw=False):
+        payment = self.read_payment(
+            lambda session: session.query(*payment_columns(include_raw)).filter(Payment.id == payment_id).first(), payment_id
+        )
 
         if not payment: raise NotFound(f'Payment with id {payment_id} not found')
 
-        return PaymentSchema().dump(payment).data
+        return dump_payment(payment, include_raw)
 
     @rpc
-    def get_payment_by_customer_id(self, customer_id):
-        paymentList = (self.db.query(Payment).filter(Payment.customer_id == customer_id).all())
+    def get_payment_by_customer_id(self, customer_id, after_id=None, limit=None, include_raw=False):
+        paymentList = self.get_payment_page(self.replica.query(*payment_columns(include_raw)).filter(Payment.customer_id == customer_id), after_id, limit)
 
-        return PaymentSchema(many=True).dump(paymentList).data
+        return dump_payments(paymentList, include_raw)
     
     @rpc
-    def get_payment_by_requester_id(self, requester_id):
-        paymentList = (self.db.query(Payment).filter(Payment.requester_id == requester_id).all())
+    def get_payment_by_requester_id(self, requester_id, after_id=None, limit=None, include_raw=False):
+        paymentList = self.get_payment_page(self.replica.query(*payment_columns(include_raw)).filter(Payment.requester_id == requester_id), after_id, limit)
 
-        return PaymentSchema(many=True).dump(paymentList).data
+        return dump_payments(paymentList, include_raw)
     
+    def read_session(self, payment_ids):
+        # The replica may lag, ids this instance just wrote are read from the primary
+        return self.db if self.recent_writes.contains(payment_ids) else self.replica
+
+    def read_payment(self, query, payment_id):
+        session = self.read_session([payment_id])
+        result = query(session)
+
+        # A miss on the replica may be a payment another instance created moments ago
+        if result is None and session is self.replica and self.recent_writes.enabled:
+            result = query(self.db)
+        return result
+
+    def get_payment_page(self, query, after_id=None, limit=None):
+        # Keyset pagination: rows are ordered by id and the caller passes the last id it has seen,
+        # so every page is an index range scan no matter how deep the client has paged
+        pageSize = config.get('PAYMENT_PAGE_SIZE', 100)
+        maxPageSize = config.get('PAYMENT_MAX_PAGE_SIZE', 1000)
+        limit = min(limit or pageSize, maxPageSize)
+
+        if after_id is not None:
+            query = query.filter(Payment.id > after_id)
+
+        # Server-side cursor, rows are fetched from postgres in chunks instead of buffered all at once
+        return query.order_by(Payment.id).limit(limit).yield_per(config.get('PAYMENT_FETCH_SIZE', 200))
+
     @rpc
-    def get_payment_status(self, payment_id):
-        status = self.db.query(Payment.status).filter(Payment.id == payment_id).scalar()
+    def get_payment_status(self, payment_id, primary=False):
+        query = lambda session: session.query(Payment.status).filter(Payment.id == payment_id).scalar()
+        # primary for callers that must not see a status older than the last committed change
+        status = query(self.db) if primary else self.read_payment(query, payment_id)
 
         if not status: raise NotFound(f'Payment with id {payment_id} not found')
 
@@ -64,18 +116,87 @@ class PaymentsService:
     
     @rpc
     def get_payment_amount(self, payment_id):
-        amount = self.db.query(Payment.payment_amount).filter(Payment.id == payment_id).scalar()
+        amount = self.read_payment(lambda session: session.query(Payment.payment_amount).filter(Payment.id == payment_id).scalar(), payment_id)
 
         if not amount: raise NotFound(f'Payment with id {payment_id} not found')
 
         return amount
     
     @rpc
-    def create_payment(self, data):
+    def get_payment_statuses(self, payment_ids):
+        paymentIds = self.get_lookup_ids(payment_ids)
+        rows = self.read_payments(lambda session, ids: session.query(Payment.id, Payment.status).filter(Payment.id == any_(bindparam('ids', ids, type_=ARRAY(Integer)))).all(), paymentIds)
+
+        # None marks an id that does not exist
+        statuses = dict.fromkeys(map(str, paymentIds))
+        statuses.update((str(payment_id), status) for payment_id, status in rows)
+        return statuses
+
+    @rpc
+    def get_payments_by_ids(self, payment_ids, include_raw=False):
+        paymentIds = self.get_lookup_ids(payment_ids)
+        paymentList = self.read_payments(lambda session, ids: session.query(*payment_columns(include_raw)).filter(Payment.id == any_(bindparam('ids', ids, type_=ARRAY(Integer)))).all(), paymentIds)
+
+        payments = dict.fromkeys(map(str, paymentIds))
+        for payment in dump_payments(paymentList, include_raw):
+            payments[str(payment['id'])] = payment
+        return payments
+
+    def read_payments(self, query, payment_ids):
+        session = self.read_session(payment_ids)
+        rows = query(session, payment_ids)
+
+        if session is self.replica and self.recent_writes.enabled:
+            foundIds = {row.id for row in rows}
+            missingIds = [payment_id for payment_id in payment_ids if payment_id not in foundIds]
+            if missingIds:
+                rows += query(self.db, missingIds)
+        return rows
+
+    def get_lookup_ids(self, payment_ids):
+        maxIds = config.get('PAYMENT_MAX_LOOKUP_IDS', 500)
+        try:
+            paymentIds = list(dict.fromkeys(int(payment_id) for payment_id in payment_ids))
+        except (TypeError, ValueError):
+            raise BadRequest("Payment ids must be integers")
+
+        if len(paymentIds) > maxIds:
+            raise BadRequest("At most {} payment ids per lookup".format(maxIds))
+        return paymentIds
+
+    @rpc
+    def get_payment_report(self, group_by, customer_id=None, date_from=None, date_to=None):
+        if group_by not in REPORT_GROUPS:
+            raise BadRequest("group_by must be one of {}".format(", ".join(sorted(REPORT_GROUPS))))
+
+        try:
+            return report(self.db, group_by, customer_id, date_from, date_to)
+        except ValueError:
+            raise BadRequest("Dates must be YYYY-MM-DD")
+
+    @rpc
+    def create_payment(self, data, include_raw=False):
         validated, errors = PaymentSchema().load(data)
         if errors:
             raise BadRequest("Validation failed: {}".format(errors))
+
+        # A retry under the same Idempotency-Key gets the first call's payment back
+        idempotencyKey = validated.get('idempotency_key')
+        if idempotencyKey:
+            requestHash = request_hash(validated)
+            replay = self.replay_payment(idempotencyKey, requestHash, include_raw)
+            if replay is not None:
+                return replay
         
+        # In async charge mode non-cash payments start as CHARGING and the Midtrans call
+        # happens in charge_payment, so this RPC worker never waits on the PSP
+        asyncCharge = config.get('MIDTRANS_ASYNC_CHARGE', False) and validated['payment_method'] != PaymentMethodEnum.tunai.value
+
+        # An idempotent create has to commit its key claim before charging, so a concurrent
+        # retry cannot charge twice; it keeps the insert, charge, update sequence below
+        if config.get('PAYMENT_SINGLE_INSERT', False) and not asyncCharge and not idempotencyKey:
+            return self.insert_charged_payment(validated, include_raw)
+
         tempPaymentInstance = Payment(
             customer_id=validated['customer_id'],
             requester_type=validated['requester_type'],
@@ -84,47 +205,332 @@ class PaymentsService:
 
             payment_method=validated['payment_method'],
             payment_amount=validated['payment_amount'],
-            status=validated['status'],                                     # If None, default to 1 in Schema
+            status=4 if asyncCharge else validated['status'],              # If None, default to 1 in Schema
 
             psp_id=None,
             settle_date=None
         )
         
-        self.db.add(tempPaymentInstance)
-        self.db.commit()
+        with self.tracer.span("db.insert"):
+            self.db.add(tempPaymentInstance)
+            self.db.flush()
+
+            if idempotencyKey and not claim_key(self.db, idempotencyKey, requestHash, tempPaymentInstance.id):
+                # A concurrent call with the same key committed first, answer with its payment
+                self.db.rollback()
+                return self.replay_payment(idempotencyKey, requestHash, include_raw)
+
+            record_payments(self.db, [tempPaymentInstance])
+            self.db.commit()
+        self.recent_writes.add(tempPaymentInstance.id)
+
+        if asyncCharge:
+            self.event_dispatcher("payment_charge_requested", {"payment_id": tempPaymentInstance.id})
 
         # If payment method is not cash, create Midtrans transaction
         # After that update the instance with the response from Midtrans
-        if tempPaymentInstance.payment_method != PaymentMethodEnum.tunai:
+        elif tempPaymentInstance.payment_method != PaymentMethodEnum.tunai:
             tempPaymentInstance.raw_response = self.createMidtransTransaction(tempPaymentInstance.id, tempPaymentInstance.payment_method, tempPaymentInstance.payment_amount)
             tempPaymentInstance.psp_id = tempPaymentInstance.raw_response.get('transaction_id')
+            tempPaymentInstance.payment_info = payment_info_from_response(tempPaymentInstance.payment_method, tempPaymentInstance.raw_response)
             
+            with self.tracer.span("db.commit"):
+                record_psp_ids(self.db, [tempPaymentInstance])
+                self.db.commit()
+
+        if idempotencyKey:
+            response = dump_payment(tempPaymentInstance)
+            save_response(self.db, idempotencyKey, response)
             self.db.commit()
-            
-        return PaymentSchema().dump(tempPaymentInstance).data
+            self.idempotency_cache.set(idempotencyKey, requestHash, response)
+
+        return dump_payment(tempPaymentInstance, include_raw)
+
+    def insert_charged_payment(self, validated, include_raw=False):
+        # The id comes from a pre-allocated block, so Midtrans is charged first and the
+        # payment is written once, complete, in a single INSERT and commit. A failed
+        # charge leaves no row behind, only a gap in the ids
+        now = datetime.now()
+        payment = Payment(
+            id=self.payment_ids.next_id(self.db),
+            customer_id=validated['customer_id'],
+            requester_type=validated['requester_type'],
+            requester_id=validated['requester_id'],
+            secondary_requester_id=validated['secondary_requester_id'],
+            payment_method=PaymentMethodEnum(validated['payment_method']),
+            payment_amount=validated['payment_amount'],
+            status=validated['status'],
+            psp_id=None,
+            settle_date=None,
+            created_at=now,
+            updated_at=now,
+        )
+
+        if payment.payment_method != PaymentMethodEnum.tunai:
+            payment.raw_response = self.createMidtransTransaction(payment.id, payment.payment_method, payment.payment_amount)
+            payment.psp_id = payment.raw_response.get('transaction_id')
+            payment.payment_info = payment_info_from_response(payment.payment_method, payment.raw_response)
+
+        # Dumped before the commit expires the instance, nothing reads the row back
+        document = dump_payment(payment, include_raw)
+        with self.tracer.span("db.insert"):
+            self.db.add(payment)
+            record_payments(self.db, [payment])
+            record_psp_ids(self.db, [payment])
+            self.db.commit()
+        self.recent_writes.add(document['id'])
+
+        return document
+
+    def replay_payment(self, key, requestHash, include_raw=False):
+        claimed = None
+        cached = self.idempotency_cache.get(key)
+        if cached is None:
+            claimed = find_key(self.db, key)
+            if claimed is None:
+                return None
+            cached = (claimed.request_hash, claimed.response)
+            if claimed.response is not None:
+                self.idempotency_cache.set(key, *cached)
+
+        storedHash, response = cached
+        if storedHash != requestHash:
+            raise IdempotencyConflict("Idempotency-Key {} was already used for a different payment".format(key))
+
+        # The first call is still charging (or died mid-way), or raw_response was asked for:
+        # answer from the payment row as it is now
+        if response is None or include_raw:
+            if claimed is None:
+                claimed = find_key(self.db, key)
+            payment = self.db.get(Payment, claimed.payment_id) if claimed is not None else None
+            if payment is not None:
+                return dump_payment(payment, include_raw)
+            if response is None:
+                raise NotFound("Payment for Idempotency-Key {} not found".format(key))
+        return response
+
+    @rpc
+    def create_payments_bulk(self, data, include_raw=False):
+        if not isinstance(data, list) or len(data) > config.get('PAYMENT_MAX_BATCH_SIZE', 500):
+            raise BadRequest("Expected a list of at most {} payments".format(config.get('PAYMENT_MAX_BATCH_SIZE', 500)))
+
+        validatedList, errors = PaymentSchema(many=True).load(data)
+        if errors:
+            raise BadRequest("Validation failed: {}".format(errors))
+        if not validatedList:
+            return []
+
+        asyncCharge = config.get('MIDTRANS_ASYNC_CHARGE', False)
+        now = datetime.now()
+
+        rows = [
+            dict(
+                customer_id=validated['customer_id'],
+                requester_type=validated['requester_type'],
+                requester_id=validated['requester_id'],
+                secondary_requester_id=validated.get('secondary_requester_id'),
+                payment_method=PaymentMethodEnum(validated['payment_method']),
+                payment_amount=validated['payment_amount'],
+                status=4 if asyncCharge and validated['payment_method'] != PaymentMethodEnum.tunai.value else validated['status'],
+                psp_id=None,
+                settle_date=None,
+                created_at=now,
+                updated_at=now,
+            )
+            for validated in validatedList
+        ]
+
+        # One multi-row INSERT ... RETURNING for the whole batch
+        paymentIds = self.db.execute(insert(Payment).values(rows).returning(Payment.id)).scalars().all()
+        record_payments(self.db, [SimpleNamespace(**row) for row in rows])
+        self.db.commit()
+        self.recent_writes.add(*paymentIds)
+
+        # Ids come from the sequence in VALUES order, so id order is input order
+        paymentList = self.db.query(Payment).filter(Payment.id.in_(paymentIds)).order_by(Payment.id).all()
+        toCharge = [
+            (payment, (payment.id, payment.payment_method, payment.payment_amount))
+            for payment in paymentList if payment.payment_method != PaymentMethodEnum.tunai
+        ]
+
+        # Per payment, None unless its charge created no transaction that is now its own
+        chargeErrors = {}
+        if asyncCharge:
+            for payment, (payment_id, _, _) in toCharge:
+                self.event_dispatcher("payment_charge_requested", {"payment_id": payment_id})
+
+        elif toCharge:
+            # Charges run concurrently on a bounded pool, the greenthreads only talk to Midtrans
+            pool = GreenPool(config.get('MIDTRANS_CHARGE_CONCURRENCY', 10))
+            responses = pool.imap(lambda args: self.createMidtransTransaction(*args), [args for _, args in toCharge])
+
+            for (payment, _), response in zip(toCharge, responses):
+                payment.raw_response = response
+                payment.psp_id = response.get('transaction_id')
+                payment.payment_info = payment_info_from_response(payment.payment_method, response)
+                chargeErrors[payment.id] = charge_error_from_response(response)
+
+            # Claimed row by row, a transaction id another payment already holds stays off this
+            # one instead of failing the commit and losing every other charge of the batch
+            claimed = claim_psp_ids(self.db, [payment for payment, _ in toCharge])
+            for payment, _ in toCharge:
+                if payment.psp_id and payment.id not in claimed:
+                    chargeErrors[payment.id] = "Midtrans transaction {} already belongs to another payment".format(payment.psp_id)
+                    payment.psp_id = None
+            self.db.commit()
+
+        paymentDocuments = dump_payments(paymentList, include_raw)
+        for document in paymentDocuments:
+            document['charge_error'] = chargeErrors.get(document['id'])
+        return paymentDocuments
+
+    @event_handler("payments", "payment_charge_requested")
+    def charge_payment(self, payload):
+        targetedPayment = self.db.query(Payment).get(payload['payment_id'])
+
+        # Already charged by a redelivered event, nothing to do
+        if not targetedPayment or targetedPayment.status != 4:
+            return
+
+        raw_response = self.createMidtransTransaction(targetedPayment.id, targetedPayment.payment_method, targetedPayment.payment_amount)
+
+        # PENDING, waiting for the customer to pay. Conditional on still CHARGING so a
+        # concurrent redelivery that charged first wins and this response is dropped
+        outcome, payment = transition_payment(
+            self.db, 1, payment_id=targetedPayment.id, from_status=4,
+            values=dict(
+                raw_response=raw_response,
+                psp_id=raw_response.get('transaction_id'),
+                payment_info=payment_info_from_response(targetedPayment.payment_method, raw_response),
+            )
+        )
+        if payment is None:
+            # Cancelled while the charge was in flight, the cancel reached Midtrans before this
+            # transaction existed. It must not stay payable behind the cancelled payment
+            if raw_response.get('transaction_id'):
+                self.cancel_late_charge(targetedPayment.id, raw_response)
+            return
+
+        record_psp_ids(self.db, [payment])
+        self.db.commit()
+        self.notify_state_changed(payment.id, payment.status)
+
+    def cancel_late_charge(self, payment_id, raw_response):
+        # Kept on the cancelled row, so a webhook or a support lookup still finds the transaction
+        recorded = self.db.execute(
+            update(Payment)
+            .where(Payment.id == payment_id, Payment.status == 3, Payment.psp_id.is_(None))
+            .values(psp_id=raw_response['transaction_id'], raw_response=raw_response, updated_at=datetime.now())
+            .returning(Payment.id, Payment.psp_id)
+            .execution_options(synchronize_session=False)
+        ).all()
+        if not recorded:
+            # Charged by a concurrent redelivery instead, its transaction is the live one
+            self.db.rollback()
+            return
+
+        record_psp_ids(self.db, recorded)
+        self.db.commit()
+        self.notify_state_changed(payment_id, 3)
+
+        self.cancelMidtransTransactionStatus(raw_response['transaction_id'])
     
+    @timer(interval=config.get('CHARGE_SWEEP_INTERVAL', 60))
+    def sweep_charging_payments(self):
+        # Async charges whose payment_charge_requested event was lost, or whose
+        # charge_payment died before its transition, would stay CHARGING for good
+        now = datetime.now()
+        retryBefore = now - timedelta(seconds=config.get('CHARGE_RETRY_AFTER', 300))
+        giveUpBefore = now - timedelta(seconds=config.get('CHARGE_GIVE_UP_AFTER', 3600))
+
+        stuck = (
+            self.db.query(Payment.id, Payment.created_at, Payment.payment_method)
+            .filter(Payment.status == 4, Payment.updated_at < retryBefore)
+            .order_by(Payment.id)
+            .limit(config.get('RECONCILE_BATCH_SIZE', 200))
+            .all()
+        )
+        self.db.commit()
+
+        retryIds = []
+        paymentMethods = {}
+        for payment in stuck:
+            if payment.created_at < giveUpBefore:
+                self.cancel_charging_payment(payment.id)
+            else:
+                retryIds.append(payment.id)
+                paymentMethods[payment.id] = payment.payment_method
+
+        if retryIds:
+            # Touched first, the next sweeps leave them to this charge for another CHARGE_RETRY_AFTER
+            retriedIds = self.db.execute(
+                update(Payment)
+                .where(Payment.id.in_(retryIds), Payment.status == 4)
+                .values(updated_at=now)
+                .returning(Payment.id)
+                .execution_options(synchronize_session=False)
+            ).scalars().all()
+            self.db.commit()
+
+            # The lost charge may have gone through. Charging the order id again only gets
+            # Midtrans' duplicate order error back, so ask for the order's transaction first
+            pool = GreenPool(config.get('RECONCILE_CONCURRENCY', 10))
+            responses = pool.imap(self.poll_midtrans_status, retriedIds)
+            for payment_id, response in zip(retriedIds, responses):
+                if response.get('transaction_id'):
+                    self.adopt_midtrans_charge(payment_id, paymentMethods[payment_id], response)
+                elif str(response.get('status_code')) == '404':
+                    self.event_dispatcher("payment_charge_requested", {"payment_id": payment_id})
+                # Midtrans unreachable, the order is asked for again on the next sweep
+
+    def adopt_midtrans_charge(self, payment_id, payment_method, response):
+        # Takes the order's transaction as the charge's result, in whatever state it already is
+        newStatus = TRANSACTION_STATUS.get(response.get('transaction_status'), 1)
+        outcome, payment = transition_payment(
+            self.db, newStatus, payment_id=payment_id, from_status=4,
+            values=dict(
+                raw_response=response,
+                psp_id=response['transaction_id'],
+                payment_info=payment_info_from_response(payment_method, response),
+            )
+        )
+        if payment is None:
+            self.db.rollback()
+            return
+
+        record_psp_ids(self.db, [payment])
+        if payment.status != 1:
+            self.enqueue_requester_status(payment)
+        self.db.commit()
+        self.notify_state_changed(payment.id, payment.status)
+
+    def cancel_charging_payment(self, payment_id):
+        outcome, payment = transition_payment(self.db, 3, payment_id=payment_id, from_status=4)
+        if payment is None:
+            return
+
+        self.enqueue_requester_status(payment)
+        self.db.commit()
+        self.notify_state_changed(payment.id, payment.status)
+
+        # A charge that was lost on the way back may still have created the transaction
+        self.cancelMidtransTransactionStatus(payment.id)
+
     @rpc
     def complete_payment(self, payment_id):
         try: 
-            # Fetch the existing instance
-            targetedPayment = self.db.query(Payment).get(payment_id)
-
-            # If not found or already completed/cancelled, return
-            if not targetedPayment:
-                return "Payment Not Found"
-            if targetedPayment.status != 1:
-                return "Already Finished or Cancelled"
-            
-            # Update the instance in db
-            targetedPayment.status = 2                  # DONE
-            targetedPayment.settle_date = datetime.now()
+            # DONE, only if still pending
+            outcome, targetedPayment = transition_payment(self.db, 2, payment_id=payment_id)
+            if targetedPayment is None:
+                return outcome
+
+            # Requester notification commits atomically with the status change
+            self.enqueue_requester_status(targetedPayment)
             self.db.commit()
-            
-            # Update requester status
-            self.update_requester_status(targetedPayment.requester_type, targetedPayment.requester_id, targetedPayment.secondary_requester_id, targetedPayment.status)
+            self.notify_state_changed(targetedPayment.id, targetedPayment.status)
         
             # Return status
-            return "Success"
+            return outcome
         
         except Exception as e:
             # Return status
@@ -133,34 +539,105 @@ class PaymentsService:
     @rpc
     def cancel_payment(self, payment_id):
         try:
-            # Fetch the existing instance
-            targetedPayment = self.db.query(Payment).get(payment_id)
-
-            # If not found or already completed/cancelled, return
-            if not targetedPayment:
-                return "Payment Not Found"
-            if targetedPayment.status != 1:
-                return "Already Finished or Cancelled"
-            
-            # Update the instance in db
-            targetedPayment.status = 3                  # CANCELLED
-            targetedPayment.settle_date = datetime.now()
+            # CANCELLED, only if still pending or still charging (async charge mode)
+            outcome, targetedPayment = transition_payment(self.db, 3, payment_id=payment_id)
+            if outcome == ALREADY_FINAL:
+                outcome, targetedPayment = transition_payment(self.db, 3, payment_id=payment_id, from_status=4)
+            if targetedPayment is None:
+                return outcome
+
+            # Requester notification commits atomically with the status change
+            self.enqueue_requester_status(targetedPayment)
             self.db.commit()
+            self.notify_state_changed(targetedPayment.id, targetedPayment.status)
             
-            # Cancel Midtrans transaction if payment method is not cash
+            # Cancel Midtrans transaction if payment method is not cash. One cancelled while
+            # charging has no psp_id yet, Midtrans takes the order id as well
             if targetedPayment.payment_method != PaymentMethodEnum.tunai:
-                self.cancelMidtransTransactionStatus(targetedPayment.psp_id)
-            
-            # Update requester status
-            self.update_requester_status(targetedPayment.requester_type, targetedPayment.requester_id, targetedPayment.secondary_requester_id, targetedPayment.status)
+                self.cancelMidtransTransactionStatus(targetedPayment.psp_id or targetedPayment.id)
 
             # Return status
-            return "Success"
+            return outcome
         
         except Exception as e:
             # Return status
             return "Failed"
     
+    def notify_state_changed(self, payment_id, status):
+        self.recent_writes.add(payment_id)
+
+        # Lets readers (the gateway cache) drop whatever they hold for this payment
+        self.event_dispatcher("payment_state_changed", {"payment_id": payment_id, "status": status})
+
+    def enqueue_requester_status(self, payment):
+        self.db.add(Outbox(
+            payment_id=payment.id,
+            requester_type=payment.requester_type,
+            requester_id=payment.requester_id,
+            secondary_requester_id=payment.secondary_requester_id,
+            status=payment.status,
+            correlation_id=self.tracer.correlation_id,
+        ))
+
+    @timer(interval=config.get('OUTBOX_RELAY_INTERVAL', 1))
+    def relay_outbox(self):
+        batchSize = config.get('OUTBOX_BATCH_SIZE', 100)
+        maxAttempts = config.get('OUTBOX_MAX_ATTEMPTS', 10)
+        dispatchTimeout = config.get('OUTBOX_DISPATCH_TIMEOUT', 10)
+        # Long enough for a batch where every dispatch times out, so no other instance
+        # claims a row still being delivered. Rows of a crashed instance come back after it
+        lease = timedelta(seconds=config.get('OUTBOX_LEASE') or batchSize * dispatchTimeout)
+        relayCorrelationId = self.tracer.correlation_id
+
+        while True:
+            # Claimed in a short transaction of its own, no row lock is held across the RPCs.
+            # SKIP LOCKED lets several payments instances claim side by side
+            claimed = (
+                select(Outbox.id)
+                .where(Outbox.available_at <= datetime.now(), Outbox.attempts < maxAttempts)
+                .order_by(Outbox.id)
+                .limit(batchSize)
+                .with_for_update(skip_locked=True)
+            )
+            entries = sorted(self.db.execute(
+                update(Outbox)
+                .where(Outbox.id.in_(claimed))
+                .values(available_at=datetime.now() + lease)
+                .returning(
+                    Outbox.id, Outbox.payment_id, Outbox.requester_type, Outbox.requester_id,
+                    Outbox.secondary_requester_id, Outbox.status, Outbox.attempts, Outbox.correlation_id,
+                )
+                .execution_options(synchronize_session=False)
+            ).all(), key=lambda entry: entry.id)
+            self.db.commit()
+
+            for entry in entries:
+                # Carry the id of the request that changed the payment on to the requester
+                self.tracer.correlation_id = entry.correlation_id or relayCorrelationId
+                try:
+                    with Timeout(dispatchTimeout), self.tracer.span("outbox.dispatch", payment_id=entry.payment_id):
+                        self.update_requester_status(entry.requester_type, entry.requester_id, entry.secondary_requester_id, entry.status)
+                    self.db.execute(delete(Outbox).where(Outbox.id == entry.id))
+                except (Exception, Timeout) as exc:
+                    # Exponential backoff, rows past OUTBOX_MAX_ATTEMPTS stay behind for inspection
+                    self.db.execute(
+                        update(Outbox)
+                        .where(Outbox.id == entry.id)
+                        .values(
+                            attempts=entry.attempts + 1,
+                            last_error=repr(exc)[:500],
+                            available_at=datetime.now() + timedelta(seconds=min(2 ** (entry.attempts + 1), 3600)),
+                        )
+                        .execution_options(synchronize_session=False)
+                    )
+                finally:
+                    self.tracer.correlation_id = relayCorrelationId
+                # Each row settled on its own, a crash mid-batch redelivers only the rest
+                self.db.commit()
+
+            if len(entries) < batchSize:
+                return
+
     # TODO: Update requester status
     def update_requester_status(self, requester_type, requester_id, secondary_requester_id, status):
         # Status: 1 pending | 2 done | 3 cancelled  
@@ -196,16 +673,6 @@ class PaymentsService:
 # =================================================================================FUNGSI MIDTRANS=============================================================================== 
 
     def createMidtransTransaction(self, payment_id, payment_method, amount):
-        # https://api.sandbox.midtrans.com/v2/charge
-        url = self.midtransUrl + "/charge"
-
-        auth = b64encode(f"{self.midtransServerKey}:".encode()).decode()
-        
-        headers = {
-            "Authorization": f"Basic {auth}",
-            "Content-Type": "application/json"
-        }
-        
         if payment_method == PaymentMethodEnum.bca_va:
             json_body = {
                 "payment_type": "bank_transfer",
@@ -237,80 +704,147 @@ class PaymentsService:
                     "gross_amount": amount
                 }
             }
-        return self.call_api("POST", url, headers=headers, json_body=json_body)
+        with self.tracer.span("midtrans.charge", payment_id=payment_id):
+            return self.midtrans.charge(json_body)
     
     def checkMidtransTransactionStatus(self, psp_id):
-        # https://api.sandbox.midtrans.com/v2/{transaction_id}/cancel
-        url = self.midtransUrl + "/" + psp_id + "/status"
-
-        auth = b64encode(f"{self.midtransServerKey}:".encode()).decode()
-        
-        headers = {
-            "Authorization": f"Basic {auth}",
-            "Content-Type": "application/json"
-        }
-
-        return self.call_api("GET", url, headers=headers)
+        return self.midtrans.status(psp_id)
     
     def cancelMidtransTransactionStatus(self, psp_id):
-        # https://api.sandbox.midtrans.com/v2/{transaction_id}/cancel
-        url = self.midtransUrl + "/" + str(psp_id) + "/cancel"
-
-        auth = b64encode(f"{self.midtransServerKey}:".encode()).decode()
-        
-        headers = {
-            "Authorization": f"Basic {auth}",
-            "Content-Type": "application/json"
-        }
-
-        return self.call_api("POST", url, headers=headers)
-    
-    def call_api(self, method, url, headers=None, params=None, json_body=None, timeout=10):
-        try:
-            response = requests.request(
-                method=method.upper(),
-                url=url,
-                headers=headers,
-                params=params,
-                json=json_body,
-                timeout=timeout
-            )
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            return {"error": str(e), "status_code": getattr(e.response, 'status_code', None)}
+        return self.midtrans.cancel(psp_id)
 
     @rpc
     def handle_midtrans_callback(self, midtrans_transaction_id, midtrans_transaction_status):
         try: 
-            # Fetch the existing instance
-            targetedPayment = self.db.query(Payment).filter(Payment.psp_id == midtrans_transaction_id).first()
-            
-            # If not found or already completed/cancelled, return
-            if not targetedPayment:
-                return "Payment Not Found"
-            if targetedPayment.status != 1:
-                return "Already Finished or Cancelled"
-            
-            # Update the instance in db
-            # DONE
-            if midtrans_transaction_status == "settlement":
-                targetedPayment.status = 2           
-            # CANCELLED       
-            elif midtrans_transaction_status == "cancel" or midtrans_transaction_status == "expire":
-                targetedPayment.status = 3           
-            else:
+            # settlement → DONE, cancel / expire → CANCELLED
+            newStatus = TRANSACTION_STATUS.get(midtrans_transaction_status)
+            if newStatus is None:
                 return "Status Not Valid"
-            
-            targetedPayment.settle_date = datetime.now()
+            if not midtrans_transaction_id:
+                return "Transaction Not Valid"
+
+            outcome, targetedPayment = transition_payment(self.db, newStatus, psp_id=midtrans_transaction_id)
+            if targetedPayment is None:
+                return outcome
+
+            # Requester notification commits atomically with the status change
+            self.enqueue_requester_status(targetedPayment)
             self.db.commit()
-            
-            # Update requester status
-            self.update_requester_status(targetedPayment.requester_type, targetedPayment.requester_id, targetedPayment.secondary_requester_id, targetedPayment.status)
+            self.notify_state_changed(targetedPayment.id, targetedPayment.status)
         
             # Return status
-            return "Success"
+            return outcome
         
         except Exception as e:
             # Return status
             return "Failed"
+
+    @event_handler("gateway", "midtrans_callback_received")
+    def buffer_midtrans_callback(self, payload):
+        status = TRANSACTION_STATUS.get(payload.get('transaction_status'))
+        if status is None or not payload.get('transaction_id'):
+            return
+
+        # Flush early when a burst fills the batch, otherwise the timer picks it up
+        if self.callback_buffer.add(payload['transaction_id'], status) >= config.get('MIDTRANS_CALLBACK_BATCH_SIZE', 500):
+            self.flush_midtrans_callbacks()
+
+    @flush_timer(interval=config.get('MIDTRANS_CALLBACK_FLUSH_INTERVAL', 0.2))
+    def flush_midtrans_callbacks(self):
+        # The notifications were acked when buffered. A batch that fails goes back for the next
+        # flush, one still buffered when the process dies is only recovered by the reconciler
+        batchSize = config.get('MIDTRANS_CALLBACK_BATCH_SIZE', 500)
+
+        callbacks = self.callback_buffer.drain(batchSize)
+        while callbacks:
+            try:
+                self.apply_midtrans_callbacks(callbacks)
+            except Exception:
+                self.db.rollback()
+                self.callback_buffer.restore(callbacks)
+                raise
+            callbacks = self.callback_buffer.drain(batchSize)
+
+    def apply_midtrans_callbacks(self, callbacks):
+        # One UPDATE ... FROM (VALUES ...) for the whole batch, only pending payments move
+        values = ", ".join(
+            "(CAST(:psp_id_{0} AS varchar), CAST(:status_{0} AS integer))".format(index) for index in range(len(callbacks))
+        )
+        params = {"now": datetime.now()}
+        for index, (psp_id, status) in enumerate(callbacks):
+            params["psp_id_{}".format(index)] = psp_id
+            params["status_{}".format(index)] = status
+
+        updatedPayments = self.db.execute(text(
+            "UPDATE payment SET status = v.status, settle_date = :now, updated_at = :now "
+            "FROM (VALUES " + values + ") AS v (psp_id, status) "
+            "WHERE payment.psp_id = v.psp_id AND payment.status = 1 "
+            "RETURNING payment.id, payment.requester_type, payment.requester_id, payment.secondary_requester_id, payment.status, "
+            "payment.customer_id, payment.payment_method, payment.payment_amount, payment.created_at"
+        ), params).fetchall()
+
+        for payment in updatedPayments:
+            self.enqueue_requester_status(payment)
+        record_transitions(self.db, updatedPayments, 1)
+        self.db.commit()
+
+        for payment in updatedPayments:
+            self.notify_state_changed(payment.id, payment.status)
+
+        return updatedPayments
+
+    @timer(interval=config.get('RECONCILE_INTERVAL', 60))
+    def reconcile_pending_payments(self):
+        # Pending payments whose webhook never arrived, or was lost from the callback buffer,
+        # ask Midtrans directly. Those rows are still status = 1 with their psp_id set
+        batchSize = config.get('RECONCILE_BATCH_SIZE', 200)
+        maxPerRun = config.get('RECONCILE_MAX_PER_RUN', 5000)
+        cutoff = datetime.now() - timedelta(seconds=config.get('RECONCILE_STALE_AFTER', 900))
+        pool = GreenPool(config.get('RECONCILE_CONCURRENCY', 10))
+
+        checked = 0
+        while checked < maxPerRun:
+            # Keyset batches over the status = 1 partial index, resuming where the last run stopped.
+            # No created_at bound: every partition's index only holds its still pending rows, and
+            # old ones are the lost webhooks this is for. Midtrans answers them expire, which
+            # also frees their partition for archiving
+            batch = (
+                self.db.query(Payment.id, Payment.psp_id)
+                .filter(
+                    Payment.status == 1,
+                    Payment.id > self.reconcile_state.after_id,
+                    Payment.payment_method != PaymentMethodEnum.tunai,
+                    Payment.psp_id.isnot(None),
+                    Payment.updated_at < cutoff,
+                )
+                .order_by(Payment.id)
+                .limit(batchSize)
+                .all()
+            )
+            # Release the snapshot, the Midtrans calls below can take a while
+            self.db.commit()
+
+            if not batch:
+                self.reconcile_state.after_id = 0
+                return
+            self.reconcile_state.after_id = batch[-1].id
+            checked += len(batch)
+
+            responses = pool.imap(self.poll_midtrans_status, [payment.psp_id for payment in batch])
+            callbacks = [
+                (payment.psp_id, TRANSACTION_STATUS[response.get('transaction_status')])
+                for payment, response in zip(batch, responses)
+                if response.get('transaction_status') in TRANSACTION_STATUS
+            ]
+
+            # Same conditional update, outbox and events as the webhook path
+            if callbacks:
+                self.apply_midtrans_callbacks(callbacks)
+
+    def poll_midtrans_status(self, psp_id):
+        self.reconcile_state.limiter.acquire()
+        return self.checkMidtransTransactionStatus(psp_id)
+
+    @http("GET", "/metrics")
+    def get_metrics(self, request):
+        return Response(self.metrics.render(), content_type=CONTENT_TYPE)
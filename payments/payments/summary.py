@@ -0,0 +1,181 @@
+"""
+Incremental maintenance of the ``payment_summary`` and
+``payment_customer_summary`` tables.
+
+Every payment insert and status change passes its rows through
+``record_payments`` / ``record_transitions`` inside the same transaction,
+so the summaries never drift from ``payment``. ``rebuild`` recomputes them
+from scratch:
+
+    python -m payments.summary rebuild
+"""
+import os
+import sys
+from collections import defaultdict
+from datetime import date, datetime
+
+from sqlalchemy import create_engine, func, text
+from sqlalchemy.dialects.postgresql import insert
+
+from payments.models import PaymentCustomerSummary, PaymentMethodEnum, PaymentSummary
+
+
+# Rows each payment_summary group is spread over, changing it needs a rebuild
+SUMMARY_SHARDS = 8
+
+REBUILD_SQL = [
+    """
+    INSERT INTO payment_summary (day, requester_type, payment_method, status, shard,
+                                 payment_count, total_amount, created_at, updated_at)
+    SELECT created_at::date, requester_type, payment_method, status, customer_id % {shards},
+           count(*), sum(payment_amount), now(), now()
+    FROM payment
+    GROUP BY 1, 2, 3, 4, 5
+    """.format(shards=SUMMARY_SHARDS),
+    """
+    INSERT INTO payment_customer_summary (customer_id, day, requester_type, payment_method, status,
+                                          payment_count, total_amount, created_at, updated_at)
+    SELECT customer_id, created_at::date, requester_type, payment_method, status,
+           count(*), sum(payment_amount), now(), now()
+    FROM payment
+    GROUP BY 1, 2, 3, 4, 5
+    """,
+]
+
+# Report name -> summary column the report groups by, every report also splits by status
+REPORT_GROUPS = {
+    'customer': 'customer_id',
+    'requester_type': 'requester_type',
+    'payment_method': 'payment_method',
+    'day': 'day',
+}
+
+
+def record_payments(session, payments):
+    """ Count newly inserted ``payments`` in the summaries. """
+    apply_deltas(session, collect_deltas(payments, 1))
+
+
+def record_transitions(session, payments, from_status):
+    """ Move already counted ``payments`` from ``from_status`` to their current status. """
+    deltas = collect_deltas(payments, -1, status=from_status)
+    for table, tableDeltas in collect_deltas(payments, 1).items():
+        for key, (count, amount) in tableDeltas.items():
+            deltas[table][key][0] += count
+            deltas[table][key][1] += amount
+    apply_deltas(session, deltas)
+
+
+def collect_deltas(payments, sign, status=None):
+    """ Count and amount changes per summary table and primary key. """
+    deltas = {table: defaultdict(lambda: [0, 0.0]) for table in (PaymentSummary, PaymentCustomerSummary)}
+    for payment in payments:
+        day = payment.created_at.date()
+        method = PaymentMethodEnum(getattr(payment.payment_method, 'value', payment.payment_method))
+        paymentStatus = payment.status if status is None else status
+
+        keys = (
+            (PaymentSummary, (day, payment.requester_type, method, paymentStatus, payment.customer_id % SUMMARY_SHARDS)),
+            (PaymentCustomerSummary, (payment.customer_id, day, payment.requester_type, method, paymentStatus)),
+        )
+        for table, key in keys:
+            deltas[table][key][0] += sign
+            deltas[table][key][1] += sign * payment.payment_amount
+    return deltas
+
+
+def apply_deltas(session, deltas):
+    now = datetime.now()
+    for table, tableDeltas in deltas.items():
+        if not tableDeltas:
+            continue
+
+        keyColumns = [column.name for column in table.__table__.primary_key]
+        # Pre-aggregated, so no key appears twice in the statement. Sorted, so concurrent
+        # writers lock summary rows in the same order and cannot deadlock each other
+        rows = [
+            dict(zip(keyColumns, key), payment_count=count, total_amount=amount, created_at=now, updated_at=now)
+            for key, (count, amount)
+            in sorted(tableDeltas.items(), key=lambda item: tuple(getattr(part, 'value', part) for part in item[0]))
+        ]
+
+        statement = insert(table).values(rows)
+        session.execute(statement.on_conflict_do_update(
+            index_elements=keyColumns,
+            set_={
+                'payment_count': table.payment_count + statement.excluded.payment_count,
+                'total_amount': table.total_amount + statement.excluded.total_amount,
+                'updated_at': statement.excluded.updated_at,
+            }
+        ))
+
+
+def report(session, group_by, customer_id=None, date_from=None, date_to=None):
+    """ Counts and totals per ``group_by`` value and status, read from the
+    summaries rather than the payment table. ``date_from`` / ``date_to`` are
+    inclusive ``YYYY-MM-DD`` days.
+
+    Reports of one customer or by customer read ``payment_customer_summary``,
+    the rest the much smaller ``payment_summary``.
+    """
+    table = PaymentCustomerSummary if group_by == 'customer' or customer_id is not None else PaymentSummary
+    column = getattr(table, REPORT_GROUPS[group_by])
+    query = session.query(
+        column, table.status,
+        func.sum(table.payment_count), func.sum(table.total_amount),
+    )
+
+    if customer_id is not None:
+        query = query.filter(table.customer_id == customer_id)
+    if date_from is not None:
+        query = query.filter(table.day >= date.fromisoformat(date_from))
+    if date_to is not None:
+        query = query.filter(table.day <= date.fromisoformat(date_to))
+
+    # Rows whose payments all moved on to another status stay behind at zero
+    rows = (
+        query.group_by(column, table.status)
+        .having(func.sum(table.payment_count) != 0)
+        .order_by(column, table.status)
+    )
+
+    report = []
+    for value, status, count, amount in rows:
+        if isinstance(value, date):
+            value = value.isoformat()
+        report.append({
+            column.key: getattr(value, 'value', value),
+            "status": status,
+            "payment_count": count,
+            "total_amount": amount,
+        })
+    return report
+
+
+def rebuild(connection):
+    connection.execute(text("LOCK TABLE payment IN SHARE MODE"))
+    connection.execute(text("DELETE FROM payment_summary"))
+    connection.execute(text("DELETE FROM payment_customer_summary"))
+    for statement in REBUILD_SQL:
+        connection.execute(text(statement))
+
+
+def get_url():
+    return (
+        "postgresql://{db_user}:{db_pass}@{db_host}:"
+        "{db_port}/{db_name}"
+    ).format(
+        db_user=os.getenv("DB_USER", "postgres"),
+        db_pass=os.getenv("DB_PASSWORD", "password"),
+        db_host=os.getenv("DB_HOST", "localhost"),
+        db_port=os.getenv("DB_PORT", "5432"),
+        db_name=os.getenv("DB_NAME", "payments"),
+    )
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] != ['rebuild']:
+        sys.exit("usage: python -m payments.summary rebuild")
+
+    with create_engine(get_url()).begin() as connection:
+        rebuild(connection)
@@ -0,0 +1,65 @@
+from datetime import datetime
+
+from sqlalchemy import update
+
+from payments.models import Payment
+from payments.summary import record_transitions
+
+
+# Transition outcomes, the state-changing RPCs return these verbatim
+SUCCESS = "Success"
+NOT_FOUND = "Payment Not Found"
+ALREADY_FINAL = "Already Finished or Cancelled"
+
+# Statuses that end a payment's life, they get a settle_date
+FINAL_STATUSES = (2, 3)
+
+
+def transition_payment(session, new_status, payment_id=None, psp_id=None, from_status=1, values=None):
+    """ Move one payment from ``from_status`` to ``new_status`` with a single
+    ``UPDATE ... WHERE status = :from_status RETURNING``.
+
+    The payment is matched by ``payment_id`` or, for Midtrans callbacks, by
+    ``psp_id``, exactly one of them must be given. Extra column ``values`` are written in the same statement.
+    Of any number of concurrent callers, exactly one sees the row come back.
+    Only when nothing comes back is a second query spent on telling a
+    missing payment from one that already left ``from_status``.
+
+    The summary row counts move along in the same transaction.
+
+    Returns ``(outcome, row)``, ``row`` is ``None`` unless the transition
+    happened. The caller owns the commit.
+    """
+    # A None psp_id would match every payment without one (cash, failed charges) at once
+    if (payment_id is None) == (psp_id is None):
+        raise ValueError("transition_payment needs exactly one of payment_id and psp_id")
+
+    if payment_id is not None:
+        criterion = Payment.id == payment_id
+    else:
+        criterion = Payment.psp_id == psp_id
+
+    now = datetime.now()
+    values = dict(values or {}, status=new_status, updated_at=now)
+    if new_status in FINAL_STATUSES:
+        values['settle_date'] = now
+
+    payment = session.execute(
+        update(Payment)
+        .where(criterion, Payment.status == from_status)
+        .values(**values)
+        .returning(
+            Payment.id, Payment.requester_type, Payment.requester_id, Payment.secondary_requester_id,
+            Payment.payment_method, Payment.payment_amount, Payment.psp_id, Payment.status,
+            Payment.customer_id, Payment.created_at,
+        )
+        .execution_options(synchronize_session=False)
+    ).first()
+
+    if payment is not None:
+        record_transitions(session, [payment], from_status)
+        return SUCCESS, payment
+
+    if session.query(Payment.id).filter(criterion).first() is None:
+        return NOT_FOUND, None
+    return ALREADY_FINAL, None
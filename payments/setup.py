@@ -13,6 +13,8 @@ setup(
         'marshmallow==2.19.2',
         'psycopg2-binary==2.9.5',
         'requests==2.31.0',
+        'prometheus-client<1.0',
+        'payment-service-common',
     ],
     extras_require={
         'dev': [
@@ -0,0 +1,108 @@
+from unittest.mock import Mock
+
+import pytest
+from eventlet.support.psycopg2_patcher import make_psycopg_green
+from nameko.testing.services import worker_factory
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from payments.dependencies import IdempotencyCache
+from payments.models import Outbox, Payment, PaymentMethodEnum, PaymentPsp
+from payments.service import PaymentsService
+from payments.summary import apply_deltas, collect_deltas, get_url, record_payments
+
+
+PAYMENT = dict(
+    customer_id=0, requester_type=1, requester_id=0,
+    payment_method=PaymentMethodEnum.tunai, payment_amount=1.0, status=1,
+)
+
+
+@pytest.fixture
+def idempotency_cache():
+    cache = IdempotencyCache()
+    cache.container = Mock(config={})
+    cache.setup()
+    return cache
+
+
+@pytest.fixture
+def service(idempotency_cache):
+    service = worker_factory(PaymentsService, idempotency_cache=idempotency_cache)
+    service.tracer.correlation_id = None
+    return service
+
+
+@pytest.fixture(scope='session')
+def db_engine():
+    """ The migrated database at ``DB_HOST`` / ``DB_NAME``, with green
+    psycopg2 so greenthreads can hold concurrent transactions. Tests using
+    it are skipped when there is no database to talk to.
+    """
+    make_psycopg_green()
+    engine = create_engine(get_url(), pool_size=20, max_overflow=0)
+    try:
+        engine.connect().close()
+    except OperationalError:
+        pytest.skip("needs the payments database at {}".format(engine.url.host))
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def cleanup_payments(db_engine):
+    """ Ids of payments a test made in the database. Each is taken back out
+    of the summary and deleted afterwards, with its outbox and
+    ``payment_psp`` rows.
+    """
+    paymentIds = []
+    yield paymentIds
+
+    session = sessionmaker(bind=db_engine)()
+    payments = session.query(Payment).filter(Payment.id.in_(paymentIds)).all()
+    apply_deltas(session, collect_deltas(payments, -1))
+    for model, column in ((PaymentPsp, PaymentPsp.payment_id), (Outbox, Outbox.payment_id), (Payment, Payment.id)):
+        session.query(model).filter(column.in_(paymentIds)).delete(synchronize_session=False)
+    session.commit()
+    session.close()
+
+
+@pytest.fixture
+def make_db_payments(db_engine, cleanup_payments):
+    """ Inserts ``count`` payments (``PAYMENT`` updated with ``values``)
+    and returns their ids, cleaned up by ``cleanup_payments``.
+    """
+    Session = sessionmaker(bind=db_engine)
+
+    def make(count=1, **values):
+        session = Session()
+        payments = [Payment(**dict(PAYMENT, **values)) for _ in range(count)]
+        session.add_all(payments)
+        session.flush()
+        record_payments(session, payments)
+        session.commit()
+        ids = [payment.id for payment in payments]
+        cleanup_payments.extend(ids)
+        session.close()
+        return ids
+
+    return make
+
+
+@pytest.fixture
+def db_service(db_engine):
+    """ Builds ``PaymentsService`` workers on real sessions of their own. """
+    Session = sessionmaker(bind=db_engine)
+    sessions = []
+
+    def make():
+        sessions.append(Session())
+        service = worker_factory(PaymentsService, db=sessions[-1], replica=sessions[-1])
+        service.tracer.correlation_id = None
+        return service
+
+    yield make
+
+    for session in sessions:
+        session.close()
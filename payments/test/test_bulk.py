@@ -0,0 +1,47 @@
+import uuid
+
+from sqlalchemy.orm import sessionmaker
+
+from payments.models import Payment, PaymentPsp
+
+
+def bulk_item(payment_amount, payment_method='bca_va'):
+    return {
+        'customer_id': 0, 'requester_type': 1, 'requester_id': 0,
+        'payment_method': payment_method, 'payment_amount': payment_amount,
+    }
+
+
+def test_bulk_reports_each_charge(db_engine, db_service, make_db_payments, cleanup_payments):
+    # A transaction id some other payment already holds
+    heldBy, = make_db_payments()
+    heldPspId = "test-{}".format(uuid.uuid4())
+    session = sessionmaker(bind=db_engine)()
+    session.add(PaymentPsp(psp_id=heldPspId, payment_id=heldBy))
+    session.commit()
+    session.close()
+
+    service = db_service()
+    charged = "test-{}".format(uuid.uuid4())
+    responses = {
+        1.0: {"status_code": "201", "transaction_id": charged, "transaction_status": "pending"},
+        2.0: {"status_code": "406", "status_message": "Duplicate order ID"},
+        3.0: {"status_code": "201", "transaction_id": heldPspId, "transaction_status": "pending"},
+    }
+    service.midtrans.charge.side_effect = lambda json_body: responses[json_body['transaction_details']['gross_amount']]
+
+    documents = service.create_payments_bulk([bulk_item(1.0), bulk_item(2.0), bulk_item(3.0), bulk_item(4.0, 'tunai')])
+    cleanup_payments.extend(document['id'] for document in documents)
+
+    assert [(document['psp_id'], document['charge_error']) for document in documents] == [
+        (charged, None),
+        (None, "Duplicate order ID"),
+        (None, "Midtrans transaction {} already belongs to another payment".format(heldPspId)),
+        (None, None),
+    ]
+
+    # The taken id failed only its own payment, the charge before it was kept
+    service.db.expire_all()
+    assert service.db.get(PaymentPsp, charged).payment_id == documents[0]['id']
+    assert service.db.get(PaymentPsp, heldPspId).payment_id == heldBy
+    assert service.db.query(Payment.psp_id).filter(Payment.id == documents[2]['id']).scalar() is None
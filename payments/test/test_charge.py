@@ -0,0 +1,111 @@
+import uuid
+from datetime import datetime
+from unittest.mock import Mock, patch
+
+from payments.models import Outbox, Payment, PaymentMethodEnum, PaymentPsp
+from payments.transitions import SUCCESS
+
+
+def charge_response(order_id):
+    return {
+        "status_code": "201",
+        "transaction_id": "test-{}".format(uuid.uuid4()),
+        "order_id": str(order_id),
+        "transaction_status": "pending",
+        "va_numbers": [{"bank": "bca", "va_number": "0248{:0>12}".format(order_id)}],
+    }
+
+
+def test_charge_moves_charging_payment_to_pending(db_service, make_db_payments):
+    payment_id, = make_db_payments(status=4, payment_method=PaymentMethodEnum.bca_va)
+    service = db_service()
+    response = charge_response(payment_id)
+    service.midtrans.charge.return_value = response
+
+    service.charge_payment({'payment_id': payment_id})
+
+    payment = service.db.get(Payment, payment_id)
+    assert (payment.status, payment.psp_id) == (1, response['transaction_id'])
+    assert payment.payment_info == response['va_numbers'][0]['va_number']
+    assert not service.midtrans.cancel.called
+
+
+def test_cancel_during_charge_cancels_the_late_transaction(db_service, make_db_payments):
+    payment_id, = make_db_payments(status=4, payment_method=PaymentMethodEnum.bca_va)
+    service, canceller = db_service(), db_service()
+    response = charge_response(payment_id)
+
+    def charge(json_body):
+        # The customer cancels while Midtrans is still creating the transaction
+        assert canceller.cancel_payment(payment_id) == SUCCESS
+        return response
+
+    service.midtrans.charge.side_effect = charge
+
+    service.charge_payment({'payment_id': payment_id})
+
+    # The cancel by order id came too early, the transaction itself is cancelled afterwards
+    canceller.midtrans.cancel.assert_called_once_with(payment_id)
+    service.midtrans.cancel.assert_called_once_with(response['transaction_id'])
+
+    payment = service.db.get(Payment, payment_id)
+    assert (payment.status, payment.psp_id) == (3, response['transaction_id'])
+    assert service.db.get(PaymentPsp, response['transaction_id']).payment_id == payment_id
+
+
+def test_late_charge_of_a_payment_charged_meanwhile_is_dropped(db_service, make_db_payments):
+    payment_id, = make_db_payments(status=1, payment_method=PaymentMethodEnum.bca_va, psp_id="test-first")
+    service = db_service()
+
+    service.cancel_late_charge(payment_id, charge_response(payment_id))
+
+    assert not service.midtrans.cancel.called
+    assert service.db.get(Payment, payment_id).psp_id == "test-first"
+
+
+def test_adopt_existing_transaction(db_service, make_db_payments):
+    payment_id, = make_db_payments(status=4, payment_method=PaymentMethodEnum.bca_va)
+    service = db_service()
+    response = dict(charge_response(payment_id), status_code="200")
+
+    service.adopt_midtrans_charge(payment_id, PaymentMethodEnum.bca_va, response)
+
+    payment = service.db.get(Payment, payment_id)
+    assert (payment.status, payment.psp_id) == (1, response['transaction_id'])
+    assert payment.payment_info == response['va_numbers'][0]['va_number']
+
+
+def test_adopt_settled_transaction_notifies_requester(db_service, make_db_payments):
+    payment_id, = make_db_payments(status=4, payment_method=PaymentMethodEnum.bca_va)
+    service = db_service()
+    response = dict(charge_response(payment_id), status_code="200", transaction_status="settlement")
+
+    service.adopt_midtrans_charge(payment_id, PaymentMethodEnum.bca_va, response)
+
+    payment = service.db.get(Payment, payment_id)
+    assert (payment.status, payment.psp_id) == (2, response['transaction_id'])
+    assert payment.settle_date is not None
+    assert service.db.query(Outbox).filter(Outbox.payment_id == payment_id).one().status == 2
+
+
+def test_sweep_asks_midtrans_before_charging_again(service):
+    now = datetime.now()
+    stuck = [
+        Mock(id=1, created_at=now, payment_method=PaymentMethodEnum.bca_va),
+        Mock(id=2, created_at=now, payment_method=PaymentMethodEnum.bca_va),
+        Mock(id=3, created_at=now, payment_method=PaymentMethodEnum.bca_va),
+    ]
+    service.db.query.return_value.filter.return_value.order_by.return_value.limit.return_value.all.return_value = stuck
+    service.db.execute.return_value.scalars.return_value.all.return_value = [1, 2, 3]
+    responses = {
+        1: dict(charge_response(1), status_code="200"),                     # Charged, the response was lost
+        2: {"status_code": "404", "status_message": "Transaction doesn't exist."},
+        3: {"error": "Read timed out", "status_code": None},
+    }
+    service.midtrans.status.side_effect = responses.get
+
+    with patch.object(service, 'adopt_midtrans_charge') as adopt:
+        service.sweep_charging_payments()
+
+    adopt.assert_called_once_with(1, PaymentMethodEnum.bca_va, responses[1])
+    service.event_dispatcher.assert_called_once_with("payment_charge_requested", {"payment_id": 2})
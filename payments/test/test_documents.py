@@ -0,0 +1,66 @@
+import itertools
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from payments.documents import dump_payment, payment_columns
+from payments.models import Payment, PaymentMethodEnum
+from payments.schemas import PaymentSchema
+
+
+def schema_dump(payment, include_raw):
+    return PaymentSchema(exclude=() if include_raw else ('raw_response',)).dump(payment).data
+
+
+def generated_payments(method):
+    """ Payments of ``method`` covering every status, requester type and
+    null column, like ``tools/check_documents.py`` generates.
+    """
+    started = datetime(2026, 10, 18, 7, 41, 15, 927798)
+    cases = itertools.product([1, 2, 3, 4, 9], [1, 2, 3, 7], [None, 67890])
+    for index, (status, requester_type, secondary_requester_id) in enumerate(cases, 1):
+        created_at = started + timedelta(seconds=index * 7)
+        if index % 5 == 0:
+            created_at = created_at.replace(microsecond=0)  # isoformat drops the fraction
+        if index % 11 == 0:
+            created_at = created_at.replace(tzinfo=timezone(timedelta(hours=7)))
+        yield Payment(
+            id=index,
+            customer_id=12345423 + index,
+            requester_type=requester_type,
+            requester_id=index % 1000,
+            secondary_requester_id=secondary_requester_id,
+            payment_method=method,
+            payment_amount=float(index * 500) if index % 3 else index * 500,
+            status=status,
+            psp_id=None if index % 4 == 0 else "9aed5972-{}".format(index),
+            raw_response=None if index % 4 == 0 else {"transaction_id": "9aed5972-{}".format(index), "va_numbers": []},
+            payment_info=None if index % 2 else "0248{:0>12}".format(index),
+            created_at=created_at,
+            updated_at=created_at + timedelta(minutes=5),
+            settle_date=created_at + timedelta(minutes=5) if status in (2, 3) else None,
+        )
+
+
+@pytest.mark.parametrize('include_raw', [False, True])
+@pytest.mark.parametrize('method', list(PaymentMethodEnum) + ['bca_va'])   # A str until the instance is refreshed
+def test_dump_payment_matches_schema(method, include_raw):
+    for payment in generated_payments(method):
+        assert dump_payment(payment, include_raw) == schema_dump(payment, include_raw), payment.id
+
+
+def test_dump_payment_of_columns_matches_schema(db_engine, make_db_payments):
+    paymentIds = make_db_payments(secondary_requester_id=67890) + make_db_payments(
+        payment_method=PaymentMethodEnum.bca_va, status=2, settle_date=datetime.now(),
+        psp_id="test-psp", raw_response={"transaction_id": "test-psp", "va_numbers": []}, payment_info="0248000000000001",
+    )
+
+    session = sessionmaker(bind=db_engine)()
+    try:
+        for include_raw in (False, True):
+            rows = {row.id: row for row in session.query(*payment_columns(include_raw)).filter(Payment.id.in_(paymentIds))}
+            for payment in session.query(Payment).filter(Payment.id.in_(paymentIds)):
+                assert dump_payment(rows[payment.id], include_raw) == schema_dump(payment, include_raw), payment.id
+    finally:
+        session.close()
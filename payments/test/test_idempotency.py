@@ -0,0 +1,73 @@
+from unittest.mock import Mock, patch
+
+import pytest
+
+from payments.exceptions import IdempotencyConflict, NotFound
+from payments.idempotency import request_hash
+
+
+PAYMENT = {
+    'customer_id': 1,
+    'requester_type': 1,
+    'requester_id': 7,
+    'secondary_requester_id': None,
+    'payment_method': 'bca_va',
+    'payment_amount': 150000.0,
+    'status': 1,
+}
+
+
+def test_request_hash_covers_the_payment_fields():
+    assert request_hash(PAYMENT) == request_hash(dict(PAYMENT, idempotency_key='other'))
+    assert request_hash(PAYMENT) != request_hash(dict(PAYMENT, payment_amount=1.0))
+
+
+def test_replay_from_cache_with_another_body_conflicts(service, idempotency_cache):
+    idempotency_cache.set('key-1', request_hash(PAYMENT), {'id': 1})
+
+    with patch('payments.service.find_key') as find_key:
+        with pytest.raises(IdempotencyConflict):
+            service.replay_payment('key-1', request_hash(dict(PAYMENT, payment_amount=1.0)))
+
+    assert not find_key.called
+
+
+def test_replay_from_table_with_another_body_conflicts(service, idempotency_cache):
+    claimed = Mock(payment_id=1, request_hash=request_hash(PAYMENT), response={'id': 1})
+
+    with patch('payments.service.find_key', return_value=claimed):
+        with pytest.raises(IdempotencyConflict):
+            service.replay_payment('key-1', request_hash(dict(PAYMENT, customer_id=2)))
+
+    # A finished response is cached either way, the next retry skips the table
+    assert idempotency_cache.get('key-1') == (request_hash(PAYMENT), {'id': 1})
+
+
+def test_create_with_reused_key_conflicts_before_charging(service, idempotency_cache):
+    idempotency_cache.set('key-1', request_hash(PAYMENT), {'id': 1})
+
+    with pytest.raises(IdempotencyConflict):
+        service.create_payment(dict(PAYMENT, payment_amount=1.0, idempotency_key='key-1'))
+
+    assert not service.midtrans.charge.called
+    assert not service.db.commit.called
+
+
+def test_replay_with_same_body_returns_first_response(service, idempotency_cache):
+    idempotency_cache.set('key-1', request_hash(PAYMENT), {'id': 1})
+
+    assert service.replay_payment('key-1', request_hash(PAYMENT)) == {'id': 1}
+
+
+def test_replay_of_unknown_key(service):
+    with patch('payments.service.find_key', return_value=None):
+        assert service.replay_payment('key-1', request_hash(PAYMENT)) is None
+
+
+def test_replay_of_missing_payment_without_response(service):
+    claimed = Mock(payment_id=1, request_hash=request_hash(PAYMENT), response=None)
+    service.db.get.return_value = None
+
+    with patch('payments.service.find_key', return_value=claimed):
+        with pytest.raises(NotFound):
+            service.replay_payment('key-1', request_hash(PAYMENT))
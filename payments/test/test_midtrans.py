@@ -0,0 +1,28 @@
+from unittest.mock import Mock
+
+import pytest
+
+from payments.midtrans import MidtransClient
+
+
+@pytest.fixture
+def client():
+    client = MidtransClient()
+    client.container = Mock(config={'MIDTRANS_POOL_SIZE': 2})
+    client.setup()
+    client.start()
+    yield client
+    client.stop()
+
+
+def test_worker_correlation_id_is_sent(client):
+    api = client.get_dependency(Mock(data={'correlation_id': 'abc'}))
+
+    assert api.headers['X-Correlation-ID'] == 'abc'
+
+
+def test_client_works_without_a_worker(client):
+    api = client.get_dependency(None)
+
+    assert 'X-Correlation-ID' not in api.headers
+    assert api.headers['Authorization'].startswith('Basic ')
@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+from unittest.mock import Mock
+
+import pytest
+from sqlalchemy import bindparam, update
+from sqlalchemy.orm import sessionmaker
+
+from payments.models import Outbox
+
+
+@pytest.fixture
+def make_outbox(db_engine, make_db_payments):
+    """ Outbox rows for fresh payments. Rows already due in the database are
+    parked for the test, so the relay only sees the ones made here.
+    """
+    Session = sessionmaker(bind=db_engine)
+    session = Session()
+    parked = session.execute(
+        update(Outbox)
+        .where(Outbox.available_at <= datetime.now())
+        .values(available_at=Outbox.available_at + timedelta(days=365))
+        .returning(Outbox.id, Outbox.available_at)
+    ).all()
+    session.commit()
+
+    def make(count):
+        outboxIds = []
+        for payment_id in make_db_payments(count, status=2):
+            entry = Outbox(payment_id=payment_id, requester_type=1, requester_id=payment_id, secondary_requester_id=payment_id, status=2)
+            session.add(entry)
+            session.flush()
+            outboxIds.append(entry.id)
+        session.commit()
+        return outboxIds
+
+    yield make
+
+    if parked:
+        session.connection().execute(
+            update(Outbox.__table__).where(Outbox.id == bindparam('outbox_id')),
+            [{'outbox_id': id_, 'available_at': availableAt - timedelta(days=365)} for id_, availableAt in parked],
+        )
+    session.commit()
+    session.close()
+
+
+def test_relay_deletes_delivered_and_backs_off_failed(db_service, make_outbox):
+    delivered, failed = make_outbox(2)
+    service = db_service()
+    # Relayed in id order
+    service.update_requester_status = Mock(side_effect=[None, ZeroDivisionError()])
+
+    service.relay_outbox()
+
+    assert service.update_requester_status.call_count == 2
+    service.db.expire_all()
+    assert service.db.get(Outbox, delivered) is None
+    entry = service.db.get(Outbox, failed)
+    assert entry.attempts == 1
+    assert 'ZeroDivisionError' in entry.last_error
+    assert entry.available_at > datetime.now()
+
+
+def test_relay_holds_no_lock_while_delivering(db_service, make_outbox):
+    outboxId, = make_outbox(1)
+    service, other = db_service(), db_service()
+    other.update_requester_status = Mock()
+
+    def deliver(*args):
+        # Another session can lock the row, yet another relay leaves the leased row alone
+        session = other.db
+        entry = session.query(Outbox).filter(Outbox.id == outboxId).with_for_update(nowait=True).one()
+        assert entry.available_at > datetime.now()
+        session.rollback()
+
+        other.relay_outbox()
+        assert not other.update_requester_status.called
+
+    service.update_requester_status = Mock(side_effect=deliver)
+
+    service.relay_outbox()
+
+    assert service.update_requester_status.call_count == 1
+    assert service.db.get(Outbox, outboxId) is None
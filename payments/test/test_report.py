@@ -0,0 +1,50 @@
+import pytest
+from nameko.exceptions import BadRequest
+from sqlalchemy.orm import sessionmaker
+
+from payments.models import PaymentCustomerSummary, PaymentSummary
+from payments.summary import SUMMARY_SHARDS, report
+
+
+def test_report_rejects_unknown_group(service):
+    with pytest.raises(BadRequest):
+        service.get_payment_report('amount')
+
+    assert not service.db.query.called
+
+
+@pytest.mark.parametrize('dates', [
+    {'date_from': '2026-13-01'},
+    {'date_to': 'yesterday'},
+])
+def test_report_rejects_bad_dates(service, dates):
+    with pytest.raises(BadRequest):
+        service.get_payment_report('day', **dates)
+
+
+REPORT_REQUESTER_TYPE = 99
+
+
+def test_report_reads_both_summaries(db_engine, make_db_payments):
+    customers = range(900000, 900020)
+    for customer_id in customers:
+        make_db_payments(2, customer_id=customer_id, requester_type=REPORT_REQUESTER_TYPE, payment_amount=5.0)
+
+    session = sessionmaker(bind=db_engine)()
+    try:
+        byType = [row for row in report(session, 'requester_type') if row['requester_type'] == REPORT_REQUESTER_TYPE]
+        assert byType == [{'requester_type': REPORT_REQUESTER_TYPE, 'status': 1, 'payment_count': 40, 'total_amount': 200.0}]
+
+        assert report(session, 'payment_method', customer_id=900003) == [
+            {'payment_method': 'tunai', 'status': 1, 'payment_count': 2, 'total_amount': 10.0},
+        ]
+
+        # The global rollup does not grow with the number of customers
+        globalRows = session.query(PaymentSummary).filter(PaymentSummary.requester_type == REPORT_REQUESTER_TYPE).count()
+        customerRows = session.query(PaymentCustomerSummary).filter(
+            PaymentCustomerSummary.requester_type == REPORT_REQUESTER_TYPE
+        ).count()
+        assert globalRows <= SUMMARY_SHARDS
+        assert customerRows == len(customers)
+    finally:
+        session.close()
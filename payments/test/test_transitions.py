@@ -0,0 +1,95 @@
+from collections import Counter
+from unittest.mock import Mock, patch
+
+import pytest
+from eventlet import GreenPool
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import sessionmaker
+
+from payments.transitions import SUCCESS, transition_payment
+
+
+STRESS_ROUNDS = 10
+STRESS_CONCURRENCY = 20
+
+
+@pytest.fixture
+def session():
+    session = Mock()
+    session.execute.return_value.first.return_value = Mock(status=2)
+    return session
+
+
+@pytest.fixture
+def record_transitions():
+    with patch('payments.transitions.record_transitions') as record_transitions:
+        yield record_transitions
+
+
+def executed_sql(session):
+    statement = session.execute.call_args[0][0]
+    return str(statement.compile(dialect=postgresql.dialect()))
+
+
+@pytest.mark.parametrize('criterion', [
+    {},
+    {'payment_id': 1, 'psp_id': 'psp-1'},
+    {'psp_id': None},
+])
+def test_transition_needs_exactly_one_criterion(session, record_transitions, criterion):
+    with pytest.raises(ValueError):
+        transition_payment(session, 2, **criterion)
+
+    assert not session.execute.called
+
+
+def test_transition_by_payment_id(session, record_transitions):
+    outcome, row = transition_payment(session, 2, payment_id=1)
+
+    assert outcome == SUCCESS
+    record_transitions.assert_called_once_with(session, [row], 1)
+    sql = executed_sql(session)
+    assert 'payment.id = %(id_1)s' in sql
+    assert 'psp_id =' not in sql
+    assert 'payment.status = %(status_1)s' in sql
+
+
+def test_transition_by_psp_id(session, record_transitions):
+    outcome, _ = transition_payment(session, 3, psp_id='psp-1')
+
+    assert outcome == SUCCESS
+    sql = executed_sql(session)
+    assert 'payment.psp_id = %(psp_id_1)s' in sql
+    assert 'payment.id =' not in sql
+
+
+@pytest.mark.parametrize('transaction_id', [None, ''])
+def test_callback_without_transaction_id_touches_nothing(service, transaction_id):
+    assert service.handle_midtrans_callback(transaction_id, 'settlement') == "Transaction Not Valid"
+    assert not service.db.execute.called
+    assert not service.db.commit.called
+
+
+def test_callback_with_unknown_status(service):
+    assert service.handle_midtrans_callback('psp-1', 'authorize') == "Status Not Valid"
+    assert not service.db.execute.called
+
+
+def test_concurrent_transitions_have_one_winner(db_engine, make_db_payments):
+    Session = sessionmaker(bind=db_engine)
+
+    def transition(payment_id, new_status):
+        session = Session()
+        try:
+            outcome, _ = transition_payment(session, new_status, payment_id=payment_id)
+            session.commit()
+            return outcome
+        finally:
+            session.close()
+
+    pool = GreenPool(STRESS_CONCURRENCY)
+    for payment_id in make_db_payments(STRESS_ROUNDS):
+        outcomes = Counter(pool.starmap(
+            transition, [(payment_id, 2 + index % 2) for index in range(STRESS_CONCURRENCY)]
+        ))
+        assert outcomes[SUCCESS] == 1, (payment_id, dict(outcomes))
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+"""
+Write throughput of ``create_payment`` in the insert, charge, update flow
+against ``PAYMENT_SINGLE_INSERT``, which charges first with an id from a
+pre-allocated block and writes the payment in one INSERT.
+
+Every mode creates ``--payments`` charged (``bca_va``) payments from
+``--concurrency`` greenthreads, each with a service worker and session of
+its own, against a local Postgres. Midtrans is stubbed with
+``--charge-ms`` of latency. Reports creates per second, create latency,
+and the WAL written and row updates made per payment.
+
+Benchmark payments belong to customer ids from ``BENCH_CUSTOMER_BASE``
+up and are left in the table.
+
+    DB_HOST=localhost python tools/bench_create.py --payments 5000 --concurrency 20 --charge-ms 50
+"""
+import eventlet
+eventlet.monkey_patch()
+
+from eventlet.support.psycopg2_patcher import make_psycopg_green  # noqa: E402
+make_psycopg_green()
+
+import argparse  # noqa: E402
+import json  # noqa: E402
+import statistics  # noqa: E402
+import time  # noqa: E402
+import warnings  # noqa: E402
+from itertools import count  # noqa: E402
+from types import SimpleNamespace  # noqa: E402
+
+from eventlet import GreenPool  # noqa: E402
+from nameko import config  # noqa: E402
+from nameko.testing.services import worker_factory  # noqa: E402
+from sqlalchemy import create_engine, text  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from common import get_url, percentile, use_services  # noqa: E402
+use_services('payments')
+
+from payments.dependencies import PaymentIds  # noqa: E402
+from payments.service import PaymentsService  # noqa: E402
+
+
+BENCH_CUSTOMER_BASE = 910000000
+MODES = {
+    "insert, charge, update": {'PAYMENT_SINGLE_INSERT': False},
+    "single insert": {'PAYMENT_SINGLE_INSERT': True},
+}
+
+
+def fake_charge(latency):
+    def charge(json_body):
+        eventlet.sleep(latency)
+        order_id = json_body["transaction_details"]["order_id"]
+        return {
+            "transaction_id": "bench-create-{}-{}".format(order_id, time.time_ns()),
+            "transaction_status": "pending",
+            "va_numbers": [{"bank": "bca", "va_number": "0248{:0>12}".format(order_id)}],
+        }
+    return charge
+
+
+def payment_stats(engine):
+    # Row updates are counted per partition, with the usual stats collector delay
+    with engine.connect() as connection:
+        eventlet.sleep(1.5)
+        connection.execute(text("SELECT pg_stat_clear_snapshot()"))
+        return connection.execute(text(
+            "SELECT pg_current_wal_lsn(), coalesce(sum(n_tup_upd), 0) FROM pg_stat_user_tables "
+            "WHERE relid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = 'payment'::regclass)"
+        )).one()
+
+
+def wal_bytes(engine, start, end):
+    with engine.connect() as connection:
+        return connection.execute(text("SELECT pg_wal_lsn_diff(:end, :start)"), {"start": start, "end": end}).scalar()
+
+
+def run(engine, Session, args, payment_ids):
+    customers = iter(count())
+    remaining = iter(range(args.payments))
+    timings = []
+
+    def create_many():
+        session = Session()
+        service = worker_factory(PaymentsService, db=session, replica=session, payment_ids=payment_ids)
+        service.midtrans.charge.side_effect = fake_charge(args.charge_ms / 1000)
+        try:
+            for _ in remaining:
+                started = time.perf_counter()
+                service.create_payment({
+                    "customer_id": BENCH_CUSTOMER_BASE + next(customers) % args.customers,
+                    "requester_type": 1,
+                    "requester_id": 1,
+                    "secondary_requester_id": None,
+                    "payment_method": "bca_va",
+                    "payment_amount": 150000.0,
+                    "status": 1,
+                })
+                timings.append(time.perf_counter() - started)
+                session.expunge_all()
+        finally:
+            session.close()
+
+    startLsn, startUpdates = payment_stats(engine)
+    started = time.perf_counter()
+    pool = GreenPool(args.concurrency)
+    for _ in range(args.concurrency):
+        pool.spawn(create_many)
+    pool.waitall()
+    elapsed = time.perf_counter() - started
+    endLsn, endUpdates = payment_stats(engine)
+
+    timings.sort()
+    return {
+        "payments": len(timings),
+        "creates_per_sec": len(timings) / elapsed,
+        "median_ms": statistics.median(timings) * 1000,
+        "p95_ms": percentile(timings, 0.95) * 1000,
+        "wal_bytes_per_payment": wal_bytes(engine, startLsn, endLsn) / len(timings),
+        "row_updates_per_payment": (endUpdates - startUpdates) / len(timings),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--payments', type=int, default=2000, help='payments to create per mode')
+    parser.add_argument('--concurrency', type=int, default=20, help='greenthreads creating payments')
+    parser.add_argument('--charge-ms', type=float, default=0, help='stubbed Midtrans charge latency')
+    parser.add_argument('--block-size', type=int, default=50, help='PAYMENT_ID_BLOCK_SIZE for the single insert mode')
+    parser.add_argument('--customers', type=int, default=1000)
+    parser.add_argument('--output', help='also write the results as JSON here')
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore")
+
+    engine = create_engine(get_url(), pool_size=args.concurrency + 2)
+    Session = sessionmaker(bind=engine)
+
+    payment_ids = PaymentIds()
+    payment_ids.container = SimpleNamespace(config={'PAYMENT_ID_BLOCK_SIZE': args.block_size})
+    payment_ids.setup()
+
+    results = {}
+    print("{:<24} {:>10} {:>10} {:>10} {:>12} {:>12}".format(
+        "mode", "creates/s", "median ms", "p95 ms", "WAL B/pmt", "updates/pmt"))
+    for name, mode in MODES.items():
+        with config.patch(mode):
+            results[name] = run(engine, Session, args, payment_ids)
+
+        stats = results[name]
+        print("{:<24} {:>10.1f} {:>10.2f} {:>10.2f} {:>12.0f} {:>12.2f}".format(
+            name, stats["creates_per_sec"], stats["median_ms"], stats["p95_ms"],
+            stats["wal_bytes_per_payment"], stats["row_updates_per_payment"]))
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({"args": vars(args), "results": results}, output_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Compare a fresh ``requests.request`` per Midtrans call (the old
+``PaymentsService.call_api``) against the pooled ``MidtransClient``
+dependency, both talking to the local fake Midtrans server.
+
+    python tools/bench_midtrans_client.py --calls 2000 --concurrency 10
+"""
+import argparse
+import time
+from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import requests
+
+from common import use_services
+use_services('payments')
+
+from fake_midtrans import FakeMidtrans  # noqa: E402
+from payments.midtrans import MidtransClient  # noqa: E402
+
+
+CHARGE_BODY = {
+    "payment_type": "bank_transfer",
+    "bank_transfer": {"bank": "bca"},
+    "transaction_details": {"order_id": "1", "gross_amount": 150000.0},
+}
+
+
+def unpooled_charge(base_url):
+    auth = b64encode("server-key:".encode()).decode()
+    headers = {
+        "Authorization": "Basic {}".format(auth),
+        "Content-Type": "application/json"
+    }
+    response = requests.request("POST", base_url + "/charge", headers=headers, json=CHARGE_BODY, timeout=10)
+    response.raise_for_status()
+    return response.json()
+
+
+def pooled_client(base_url, pool_size):
+    provider = MidtransClient()
+    provider.container = SimpleNamespace(
+        config={'MIDTRANS_URL': base_url, 'MIDTRANS_SERVER_KEY': 'server-key', 'MIDTRANS_POOL_SIZE': pool_size},
+        max_workers=pool_size,
+    )
+    provider.setup()
+    provider.start()
+    return provider
+
+
+def run(server, label, call, calls, concurrency):
+    connections_before = server.connections
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(lambda _: call(), range(calls)))
+    elapsed = time.perf_counter() - started
+
+    print("{:<10} {:>8.1f} calls/s {:>8.3f} ms/call {:>6d} tcp connections".format(
+        label, calls / elapsed, elapsed / calls * 1000, server.connections - connections_before))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=10)
+    args = parser.parse_args()
+
+    server = FakeMidtrans()
+    server.serve_in_thread()
+
+    provider = pooled_client(server.url, args.concurrency)
+    api = provider.get_dependency(None)
+
+    run(server, 'unpooled', lambda: unpooled_charge(server.url), args.calls, args.concurrency)
+    run(server, 'pooled', lambda: api.charge(CHARGE_BODY), args.calls, args.concurrency)
+
+    provider.stop()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
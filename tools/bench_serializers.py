@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+"""
+Payload size and encode / decode time of the gateway <-> payments RPC
+messages under nameko's default ``json`` serializer and the opt-in
+``msgpack-ext`` one (see ``PAYMENTS_RPC_SERIALIZER``).
+
+Payloads are built the way the services build them: Payment rows dumped
+through ``PaymentSchema`` and wrapped in nameko's reply envelope. Both
+serializers are called through kombu, as nameko calls them. No database
+or broker is needed.
+
+    python tools/bench_serializers.py
+    python tools/bench_serializers.py --rows 10000 --output serializers.json
+"""
+import argparse
+import json
+import statistics
+import time
+from datetime import datetime, timedelta
+
+import kombu.serialization
+
+from common import use_services
+use_services('payments', 'payment_common')
+
+from payment_common import serialization  # noqa: E402
+from payments.models import Payment, PaymentMethodEnum  # noqa: E402
+from payments.schemas import PaymentSchema  # noqa: E402
+
+
+SERIALIZERS = ('json', serialization.NAME)
+METHODS = list(PaymentMethodEnum)
+
+
+def register():
+    # What nameko does at startup for the SERIALIZERS config entry
+    kombu.serialization.register(
+        serialization.NAME, serialization.dumps, serialization.loads,
+        content_type=serialization.CONTENT_TYPE, content_encoding='binary',
+    )
+
+
+def raw_response(index, created_at):
+    return {
+        "status_code": "201",
+        "status_message": "Success, Bank Transfer transaction is created",
+        "transaction_id": "9aed5972-5b6a-401e-894b-{:012d}".format(index),
+        "order_id": str(index),
+        "merchant_id": "G812785002",
+        "gross_amount": "{:.2f}".format(1000 + index % 500000),
+        "currency": "IDR",
+        "payment_type": "bank_transfer",
+        "transaction_time": created_at.strftime("%Y-%m-%d %H:%M:%S"),
+        "transaction_status": "pending",
+        "fraud_status": "accept",
+        "va_numbers": [{"bank": "bca", "va_number": "0248{:0>12}".format(index)}],
+        "expiry_time": (created_at + timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def payment(index):
+    created_at = datetime(2026, 10, 1) + timedelta(seconds=index * 37)
+    return Payment(
+        id=index,
+        customer_id=100000 + index % 5000,
+        requester_type=index % 3 + 1,
+        requester_id=index % 1000,
+        secondary_requester_id=index % 7 or None,
+        payment_method=METHODS[index % len(METHODS)],
+        payment_amount=float(1000 + index % 500000),
+        status=index % 3 + 1,
+        psp_id="9aed5972-5b6a-401e-894b-{:012d}".format(index),
+        raw_response=raw_response(index, created_at),
+        payment_info="0248{:0>12}".format(index),
+        created_at=created_at,
+        updated_at=created_at + timedelta(minutes=5),
+        settle_date=created_at + timedelta(minutes=5) if index % 3 else None,
+    )
+
+
+def payloads(rows):
+    single = payment(1)
+    many = [payment(index) for index in range(1, rows + 1)]
+
+    def reply(result):
+        return {'result': result, 'error': None}
+
+    return {
+        "create_payment request": {'args': [{
+            "customer_id": 12345423, "requester_type": 1, "requester_id": 12345, "secondary_requester_id": 67890,
+            "payment_method": "bca_va", "payment_amount": 150000.0, "idempotency_key": None,
+        }], 'kwargs': {}},
+        "payment reply": reply(PaymentSchema(exclude=('raw_response',)).dump(single).data),
+        "payment reply, include_raw": reply(PaymentSchema().dump(single).data),
+        "{} row list reply".format(rows): reply(PaymentSchema(many=True, exclude=('raw_response',)).dump(many).data),
+        "{} row list reply, include_raw".format(rows): reply(PaymentSchema(many=True).dump(many).data),
+    }
+
+
+def measure(fn, iterations):
+    fn()
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+def run(name, payload, iterations):
+    results = {}
+    for serializer in SERIALIZERS:
+        content_type, encoding, body = kombu.serialization.dumps(payload, serializer)
+        accept = kombu.serialization.prepare_accept_content([serializer])
+
+        decoded = kombu.serialization.loads(body, content_type, encoding, accept=accept)
+        assert decoded == payload, "{} does not round trip {}".format(serializer, name)
+
+        results[serializer] = {
+            "bytes": len(body),
+            "encode_ms": measure(lambda: kombu.serialization.dumps(payload, serializer), iterations),
+            "decode_ms": measure(lambda: kombu.serialization.loads(body, content_type, encoding, accept=accept), iterations),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000, help='rows in the list replies')
+    parser.add_argument('--iterations', type=int, default=200, help='timed runs of the single payment payloads')
+    parser.add_argument('--output', help='also write the results as JSON here')
+    args = parser.parse_args()
+
+    register()
+    results = {}
+
+    print("{:<34} {:<12} {:>10} {:>11} {:>11}".format("payload", "serializer", "bytes", "encode ms", "decode ms"))
+    for name, payload in payloads(args.rows).items():
+        # Size the list runs so each payload gets roughly the same total time
+        iterations = args.iterations if 'list' not in name else max(5, args.iterations * 10 // args.rows)
+        results[name] = run(name, payload, iterations)
+
+        for serializer, stats in results[name].items():
+            print("{:<34} {:<12} {:>10} {:>11.3f} {:>11.3f}".format(
+                name, serializer, stats["bytes"], stats["encode_ms"], stats["decode_ms"]))
+
+        base, packed = results[name]['json'], results[name][serialization.NAME]
+        print("{:<34} {:<12} {:>9.0f}% {:>10.0f}% {:>10.0f}%".format(
+            "", "vs json", packed["bytes"] / base["bytes"] * 100,
+            packed["encode_ms"] / base["encode_ms"] * 100, packed["decode_ms"] / base["decode_ms"] * 100))
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({"rows": args.rows, "results": results}, output_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
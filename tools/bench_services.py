@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+"""
+In-process microbenchmarks for the PaymentsService and GatewayService hot
+paths, run through ``nameko.testing.services.worker_factory`` against a
+local Postgres with Midtrans stubbed out. No RabbitMQ is needed.
+
+Benchmark payments belong to customer ids from ``BENCH_CUSTOMER_BASE``
+up, ``--rows`` of them are seeded on first run and reused afterwards.
+Results are written as JSON; pass an earlier result file to ``--compare``
+to print the change per benchmark.
+
+    DB_HOST=localhost python tools/bench_services.py --rows 100000 --output before.json
+    DB_HOST=localhost python tools/bench_services.py --rows 100000 --compare before.json
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import warnings
+from datetime import datetime
+from itertools import count
+from types import SimpleNamespace
+
+from nameko.testing.services import worker_factory
+from sqlalchemy import create_engine, func, insert
+from sqlalchemy.orm import sessionmaker
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
+
+from common import ROOT, get_url, percentile, use_services
+use_services('payments', 'gateway')
+
+from gateway.dependencies import PaymentCache  # noqa: E402
+from gateway.documents import render_payments  # noqa: E402
+from gateway.schemas import GetPaymentSchema  # noqa: E402
+from gateway.service import GatewayService  # noqa: E402
+from payments.documents import dump_payments  # noqa: E402
+from payments.models import Payment, PaymentMethodEnum  # noqa: E402
+from payments.schemas import PaymentSchema  # noqa: E402
+from payments.service import PaymentsService  # noqa: E402
+from payments.summary import record_payments  # noqa: E402
+
+
+BENCH_CUSTOMER_BASE = 900000000
+METHODS = list(PaymentMethodEnum)
+
+
+def fake_charge(json_body):
+    order_id = json_body["transaction_details"]["order_id"]
+    return {
+        "transaction_id": "bench-{}-{}".format(order_id, time.time_ns()),
+        "transaction_status": "pending",
+        "va_numbers": [{"bank": "bca", "va_number": "0248{:0>12}".format(order_id)}],
+        "actions": [{"name": "generate-qr-code", "url": "https://example.invalid/qr/{}".format(order_id)}],
+    }
+
+
+def seed(Session, rows, customers):
+    session = Session()
+    existing = session.query(func.count(Payment.id)).filter(Payment.customer_id >= BENCH_CUSTOMER_BASE).scalar()
+
+    now = datetime.now()
+    for start in range(existing, rows, 5000):
+        batch = [
+            dict(
+                customer_id=BENCH_CUSTOMER_BASE + index % customers,
+                requester_type=index % 3 + 1,
+                requester_id=index % 1000,
+                secondary_requester_id=None,
+                payment_method=METHODS[index % len(METHODS)],
+                payment_amount=float(1000 + index % 500000),
+                status=index % 3 + 1,
+                psp_id=None,
+                settle_date=None,
+                created_at=now,
+                updated_at=now,
+            )
+            for index in range(start, min(rows, start + 5000))
+        ]
+        session.execute(insert(Payment).values(batch))
+        record_payments(session, [SimpleNamespace(**row) for row in batch])
+        session.commit()
+
+    session.close()
+    return max(existing, rows)
+
+
+def measure(fn, iterations, warmup):
+    for _ in range(warmup):
+        fn()
+
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+
+    timings.sort()
+    return {
+        "iterations": iterations,
+        "min_ms": timings[0] * 1000,
+        "median_ms": statistics.median(timings) * 1000,
+        "mean_ms": statistics.mean(timings) * 1000,
+        "p95_ms": percentile(timings, 0.95) * 1000,
+        "ops_per_sec": iterations / sum(timings),
+    }
+
+
+def request(path):
+    return Request(EnvironBuilder(path=path).get_environ())
+
+
+def selected(args, name):
+    return not args.only or any(pattern in name for pattern in args.only)
+
+
+def benchmarks(Session, args):
+    session = Session()
+    service = worker_factory(PaymentsService, db=session, replica=session)
+    service.midtrans.charge.side_effect = fake_charge
+
+    cache = PaymentCache()
+    cache.container = SimpleNamespace(config={})
+    cache.setup()
+    gateway = worker_factory(GatewayService, payment_cache=cache)
+
+    customers = iter(count())
+    create_body = lambda method: {
+        "customer_id": BENCH_CUSTOMER_BASE + next(customers) % args.customers,
+        "requester_type": 1,
+        "requester_id": 1,
+        "secondary_requester_id": None,
+        "payment_method": method,
+        "payment_amount": 150000.0,
+        "status": 1,
+    }
+
+    # Pending, charged payments for the callbacks to settle, one per run
+    pendingPspIds = iter([
+        service.create_payment(create_body("bca_va"))['psp_id']
+        for _ in range(args.iterations + args.warmup if selected(args, "payments.handle_midtrans_callback") else 0)
+    ])
+
+    # Loaded instances for the schema benchmarks, detached so no commit can expire them
+    fixtures = Session()
+    firstId = fixtures.query(func.min(Payment.id)).filter(Payment.customer_id >= BENCH_CUSTOMER_BASE).scalar()
+    payments = fixtures.query(Payment).filter(Payment.id >= firstId).order_by(Payment.id).limit(args.page_size).all()
+    documents = PaymentSchema(many=True, exclude=('raw_response',)).dump(payments).data
+    fixtures.expunge_all()
+    fixtures.close()
+    gateway.payments_rpc.get_payment_list.return_value = documents
+
+    cases = {
+        "payments.create_payment[tunai]":
+            lambda: service.create_payment(create_body("tunai")),
+        "payments.create_payment[bca_va]":
+            lambda: service.create_payment(create_body("bca_va")),
+        "payments.get_payment_list":
+            lambda: service.get_payment_list(firstId, args.page_size),
+        "payments.get_payment_by_customer_id":
+            lambda: service.get_payment_by_customer_id(BENCH_CUSTOMER_BASE + 1, None, args.page_size),
+        "payments.handle_midtrans_callback":
+            lambda: service.handle_midtrans_callback(next(pendingPspIds), "settlement"),
+        "schemas.PaymentSchema.dump":
+            lambda: PaymentSchema(many=True, exclude=('raw_response',)).dump(payments),
+        "schemas.GetPaymentSchema.dump":
+            lambda: GetPaymentSchema(many=True).dump(documents),
+        "documents.dump_payments":
+            lambda: dump_payments(payments),
+        "documents.render_payments":
+            lambda: render_payments(documents),
+        "gateway.get_payment_list":
+            lambda: gateway.get_payment_list(request('/payment?limit={}'.format(args.page_size))).render(),
+    }
+
+    results = {}
+    for name, fn in cases.items():
+        if not selected(args, name):
+            continue
+        results[name] = measure(fn, args.iterations, args.warmup)
+        # Each worker gets a fresh session in the service, don't let one grow across runs
+        session.expunge_all()
+        print("{:<40} {:>9.3f} ms median {:>9.1f} ops/s".format(
+            name, results[name]["median_ms"], results[name]["ops_per_sec"]), file=sys.stderr)
+
+    session.close()
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)["results"]
+
+    for name, result in results.items():
+        if name in baseline:
+            change = (result["median_ms"] / baseline[name]["median_ms"] - 1) * 100
+            print("{:<40} {:>9.3f} -> {:>9.3f} ms median ({:+.1f}%)".format(
+                name, baseline[name]["median_ms"], result["median_ms"], change), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000, help='benchmark payments to seed')
+    parser.add_argument('--customers', type=int, default=1000, help='distinct customers over the seeded rows')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--only', action='append', help='run benchmarks whose name contains this, repeatable')
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    parser.add_argument('--compare', help='earlier JSON result to compare medians against')
+    args = parser.parse_args()
+
+    warnings.simplefilter("ignore")
+
+    engine = create_engine(get_url())
+    Session = sessionmaker(bind=engine)
+    rows = seed(Session, args.rows, args.customers)
+
+    output = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "rows": rows,
+            "customers": args.customers,
+            "page_size": args.page_size,
+        },
+        "results": benchmarks(Session, args),
+    }
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(output, output_file, indent=2)
+    else:
+        print(json.dumps(output, indent=2))
+
+    if args.compare:
+        compare(output["results"], args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""
+Parity check of the single-pass payment documents against the marshmallow
+schemas they replace:
+
+- ``payments.documents.dump_payment`` against ``PaymentSchema.dump``, for
+  ORM payments and for ``payment_columns()`` rows, with and without
+  ``raw_response``.
+- ``gateway.documents.render_payment`` against ``GetPaymentSchema.dump``,
+  for the payments documents as they arrive over json RPC.
+
+Checks generated payments covering every method, status, requester type
+and null column, and with ``--db`` also real rows from the payment table.
+Exits non-zero on the first mismatches. ``test/test_documents.py`` of each
+service runs the generated comparisons with the test suite.
+
+    python tools/check_documents.py
+    DB_HOST=localhost python tools/check_documents.py --db --rows 50000
+"""
+import argparse
+import itertools
+import json
+import sys
+from datetime import datetime, timedelta, timezone
+
+from common import get_url, use_services
+use_services('payments', 'gateway')
+
+from gateway.documents import render_payment  # noqa: E402
+from gateway.schemas import GetPaymentSchema  # noqa: E402
+from payments.documents import dump_payment, payment_columns  # noqa: E402
+from payments.models import Payment, PaymentMethodEnum  # noqa: E402
+from payments.schemas import PaymentSchema  # noqa: E402
+
+
+class Mismatches(object):
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.count = 0
+        self.checked = 0
+
+    def compare(self, label, expected, actual):
+        self.checked += 1
+        if expected == actual:
+            return
+
+        self.count += 1
+        if self.count <= self.limit:
+            keys = sorted(set(expected) | set(actual))
+            print("MISMATCH {}".format(label))
+            for key in keys:
+                if expected.get(key, '<missing>') != actual.get(key, '<missing>'):
+                    print("    {:<24} schema={!r} single-pass={!r}".format(
+                        key, expected.get(key, '<missing>'), actual.get(key, '<missing>')))
+
+
+def generated_payments():
+    started = datetime(2026, 10, 18, 7, 41, 15, 927798)
+    cases = itertools.product(
+        list(PaymentMethodEnum) + ['bca_va'],          # A str until the instance is refreshed
+        [1, 2, 3, 4, 9],                               # 9 has no status text
+        [1, 2, 3, 7],                                  # 7 has no requester text
+        [None, 67890],
+    )
+    for index, (method, status, requester_type, secondary_requester_id) in enumerate(cases, 1):
+        created_at = started + timedelta(seconds=index * 7)
+        if index % 5 == 0:
+            created_at = created_at.replace(microsecond=0)  # isoformat drops the fraction
+        if index % 11 == 0:
+            created_at = created_at.replace(tzinfo=timezone(timedelta(hours=7)))
+        yield Payment(
+            id=index,
+            customer_id=12345423 + index,
+            requester_type=requester_type,
+            requester_id=index % 1000,
+            secondary_requester_id=secondary_requester_id,
+            payment_method=method,
+            payment_amount=float(index * 500) if index % 3 else index * 500,
+            status=status,
+            psp_id=None if index % 4 == 0 else "9aed5972-{}".format(index),
+            raw_response=None if index % 4 == 0 else {"transaction_id": "9aed5972-{}".format(index), "va_numbers": []},
+            payment_info=None if index % 2 else "0248{:0>12}".format(index),
+            created_at=created_at,
+            updated_at=created_at + timedelta(minutes=5),
+            settle_date=created_at + timedelta(minutes=5) if status in (2, 3) else None,
+        )
+
+
+def check_payment(mismatches, payment, rows=None):
+    for include_raw in (False, True):
+        expected = PaymentSchema(exclude=() if include_raw else ('raw_response',)).dump(payment).data
+        mismatches.compare("dump_payment id={} include_raw={}".format(payment.id, include_raw),
+                           expected, dump_payment(payment, include_raw))
+        if rows is not None:
+            mismatches.compare("dump_payment row id={} include_raw={}".format(payment.id, include_raw),
+                               expected, dump_payment(rows[include_raw], include_raw))
+
+    # What the gateway receives: the payments document after a json RPC hop
+    document = json.loads(json.dumps(PaymentSchema(exclude=('raw_response',)).dump(payment).data))
+    mismatches.compare("render_payment id={}".format(payment.id),
+                       GetPaymentSchema().dump(document).data, render_payment(document))
+
+    # Documents with real datetimes, or without some keys, take the other branches
+    native = dict(document, created_at=payment.created_at, updated_at=payment.updated_at, settle_date=payment.settle_date)
+    partial = {key: value for key, value in document.items() if key not in ('payment_info', 'status', 'settle_date')}
+    for label, variant in (("native", native), ("partial", partial)):
+        mismatches.compare("render_payment {} id={}".format(label, payment.id),
+                           GetPaymentSchema().dump(variant).data, render_payment(variant))
+
+
+def check_database(mismatches, rows):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    session = sessionmaker(bind=create_engine(get_url()))()
+    payments = session.query(Payment).order_by(Payment.id.desc()).limit(rows).all()
+    paymentIds = [payment.id for payment in payments]
+    columnRows = [
+        {row.id: row for row in session.query(*payment_columns(include_raw)).filter(Payment.id.in_(paymentIds))}
+        for include_raw in (False, True)
+    ]
+    for payment in payments:
+        check_payment(mismatches, payment, [rows[payment.id] for rows in columnRows])
+    session.close()
+    return len(payments)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', action='store_true', help='also check the newest rows of the payment table')
+    parser.add_argument('--rows', type=int, default=10000, help='payment rows to check with --db')
+    parser.add_argument('--show', type=int, default=10, help='mismatches to print')
+    args = parser.parse_args()
+
+    mismatches = Mismatches(args.show)
+    generated = 0
+    for payment in generated_payments():
+        check_payment(mismatches, payment)
+        generated += 1
+    print("generated payments: {}".format(generated))
+
+    if args.db:
+        print("database payments: {}".format(check_database(mismatches, args.rows)))
+
+    print("{} comparisons, {} mismatches".format(mismatches.checked, mismatches.count))
+    if mismatches.count:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+"""
+Helpers shared by the scripts in ``tools/``. Every script is run as
+``python tools/<name>.py``, which puts this directory on ``sys.path``.
+"""
+import os
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def use_services(*names):
+    """ Make the ``payments`` / ``gateway`` packages importable from the
+    service directories of this checkout.
+    """
+    for name in names:
+        path = os.path.join(ROOT, name)
+        if path not in sys.path:
+            sys.path.append(path)
+
+
+def get_url():
+    return (
+        "postgresql://{db_user}:{db_pass}@{db_host}:"
+        "{db_port}/{db_name}"
+    ).format(
+        db_user=os.getenv("DB_USER", "postgres"),
+        db_pass=os.getenv("DB_PASSWORD", "password"),
+        db_host=os.getenv("DB_HOST", "localhost"),
+        db_port=os.getenv("DB_PORT", "5432"),
+        db_name=os.getenv("DB_NAME", "payments"),
+    )
+
+
+def percentile(ordered, p):
+    # ``ordered`` is sorted, None when there is nothing to rank
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+Print EXPLAIN ANALYZE for the payment lookup paths before and after the
+lookup indexes from revision 5d1f0a7c3b92 (the customer one as replaced in
+d8e3b5c1f2a6).
+
+The "before" plans are taken inside a transaction that drops the indexes
+and is rolled back afterwards, so the database is left untouched.
+
+    DB_HOST=localhost DB_PORT=5432 python tools/explain_lookups.py --seed 200000
+"""
+import argparse
+
+from sqlalchemy import create_engine, text
+
+from common import get_url
+
+
+LOOKUP_INDEXES = [
+    'ix_payment_psp_id',
+    'ix_payment_customer_id_id',
+    'ix_payment_requester_id_requester_type',
+    'ix_payment_pending',
+]
+
+QUERIES = {
+    'handle_midtrans_callback (psp_id)':
+        "SELECT * FROM payment WHERE psp_id = (SELECT psp_id FROM payment ORDER BY id DESC LIMIT 1)",
+    'get_payment_by_customer_id':
+        "SELECT * FROM payment WHERE customer_id = 42 ORDER BY id LIMIT 100",
+    'get_payment_by_requester_id':
+        "SELECT * FROM payment WHERE requester_id = 42 ORDER BY id LIMIT 100",
+    'pending work (status = 1)':
+        "SELECT id FROM payment WHERE status = 1 ORDER BY id LIMIT 500",
+}
+
+
+def seed(connection, rows):
+    # ~1% of rows stay pending, the rest are settled or cancelled, like a long-running deployment
+    connection.execute(text("""
+        INSERT INTO payment (customer_id, requester_type, requester_id, secondary_requester_id,
+                             payment_method, payment_amount, status, psp_id,
+                             created_at, updated_at, settle_date)
+        SELECT (random() * 5000)::int,
+               1 + (g % 3),
+               (random() * 20000)::int,
+               NULL,
+               (ARRAY['tunai', 'bca_va', 'qris', 'gopay', 'ovo'])[1 + g % 5]::payment_method_enum,
+               1000 + (random() * 500000)::int,
+               CASE WHEN g % 100 = 0 THEN 1 ELSE 2 + g % 2 END,
+               md5(g::text || clock_timestamp()::text),
+               now() - (g || ' seconds')::interval,
+               now() - (g || ' seconds')::interval,
+               NULL
+        FROM generate_series(1, :rows) AS g
+    """), {'rows': rows})
+    connection.execute(text("ANALYZE payment"))
+
+
+def explain(connection):
+    for name, query in QUERIES.items():
+        print("--- {}".format(name))
+        for line in connection.execute(text("EXPLAIN ANALYZE " + query)):
+            print("    " + line[0])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seed', type=int, default=0, help='insert this many synthetic payments first')
+    args = parser.parse_args()
+
+    engine = create_engine(get_url())
+
+    if args.seed:
+        with engine.begin() as connection:
+            seed(connection, args.seed)
+
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        for index in LOOKUP_INDEXES:
+            connection.execute(text("DROP INDEX IF EXISTS {}".format(index)))
+        print("=== BEFORE (primary key only)")
+        explain(connection)
+        transaction.rollback()
+
+    with engine.connect() as connection:
+        print("=== AFTER (lookup indexes)")
+        explain(connection)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+"""
+Local stand-in for the Midtrans core API (``/charge``, ``/<id>/status``,
+``/<id>/cancel``) for benchmarks and load tests.
+
+Speaks HTTP/1.1 keep-alive and counts accepted TCP connections, so
+connection reuse by the client can be observed.
+
+Latency and failures can be injected per request. With ``--webhook-url``
+every charged transaction is settled (or expired, see ``--settle-ratio``)
+``--settle-after`` seconds later, and the matching HTTP notification is
+POSTed to the gateway the way Midtrans would.
+
+    python tools/fake_midtrans.py --port 8090 --latency-ms 150 --failure-rate 0.01 \
+        --webhook-url http://localhost:8003/payment/midtrans/callback
+    MIDTRANS_URL=http://localhost:8090/v2 nameko run --config config.yml payments.service
+"""
+import argparse
+import hashlib
+import heapq
+import json
+import random
+import socket
+import threading
+import time
+import urllib.request
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeMidtransHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super(FakeMidtransHandler, self).setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = self.read_json()
+        parts = self.path_parts()
+        if self.server.inject():
+            return self.send_json(500, {"status_code": "500", "status_message": "Sorry. Our system is recovering from unexpected issues. Please retry."})
+
+        if parts == ['charge']:
+            return self.send_json(200, self.server.charge(body))
+        if len(parts) == 2 and parts[1] == 'cancel':
+            return self.send_json(200, self.server.transition(parts[0], 'cancel'))
+        self.send_json(404, {"status_code": "404", "status_message": "Not found"})
+
+    def do_GET(self):
+        parts = self.path_parts()
+        if self.server.inject():
+            return self.send_json(500, {"status_code": "500", "status_message": "Sorry. Our system is recovering from unexpected issues. Please retry."})
+
+        if len(parts) == 2 and parts[1] == 'status':
+            return self.send_json(200, self.server.transition(parts[0], None))
+        self.send_json(404, {"status_code": "404", "status_message": "Not found"})
+
+    def path_parts(self):
+        parts = [part for part in self.path.split('?')[0].split('/') if part]
+        # Accept both ``/v2/charge`` and ``/charge``
+        return parts[1:] if parts and parts[0] == 'v2' else parts
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeMidtrans(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0, jitter=0.0, failure_rate=0.0,
+                 webhook_url=None, settle_after=1.0, settle_ratio=0.9, server_key="", webhook_workers=8):
+        super(FakeMidtrans, self).__init__(address, FakeMidtransHandler)
+        self.lock = threading.Lock()
+        self.transactions = {}
+        self.orders = {}                    # order_id -> transaction_id, status and cancel take either
+        self.connections = 0
+        self.requests = 0
+        self.failures = 0
+
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+
+        self.webhook_url = webhook_url
+        self.settle_after = settle_after
+        self.settle_ratio = settle_ratio
+        self.server_key = server_key
+        self.webhooks_sent = 0
+        self.webhooks_failed = 0
+        self.webhook_latencies = deque(maxlen=10000)
+
+        # Pending settlements as a (due, transaction_id) heap, one thread waits on it
+        # and hands due notifications to a small pool of senders
+        self.schedule = []
+        self.schedule_ready = threading.Condition(self.lock)
+        if webhook_url:
+            self.senders = ThreadPoolExecutor(max_workers=webhook_workers)
+            threading.Thread(target=self.run_schedule, daemon=True).start()
+
+    @property
+    def url(self):
+        return 'http://{}:{}/v2'.format(*self.server_address[:2])
+
+    def get_request(self):
+        connection = super(FakeMidtrans, self).get_request()
+        with self.lock:
+            self.connections += 1
+        return connection
+
+    def inject(self):
+        """ Sleep for the configured latency, then tell the handler whether
+        this request should fail.
+        """
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        if self.failure_rate and random.random() < self.failure_rate:
+            with self.lock:
+                self.failures += 1
+            return True
+        return False
+
+    def charge(self, body):
+        transaction_id = str(uuid.uuid4())
+        details = body.get('transaction_details', {})
+        payment_type = body.get('payment_type')
+
+        response = {
+            "status_code": "201",
+            "status_message": "Success, transaction is created",
+            "transaction_id": transaction_id,
+            "order_id": details.get('order_id'),
+            "gross_amount": "{:.2f}".format(float(details.get('gross_amount') or 0)),
+            "payment_type": payment_type,
+            "transaction_time": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "transaction_status": "pending",
+        }
+        if payment_type == 'bank_transfer':
+            response["va_numbers"] = [{"bank": "bca", "va_number": uuid.uuid4().hex[:23]}]
+        elif payment_type in ('gopay', 'qris'):
+            response["actions"] = [{
+                "name": "generate-qr-code",
+                "method": "GET",
+                "url": "http://{}:{}/v2/{}/qr-code".format(*self.server_address[:2], transaction_id),
+            }]
+
+        with self.lock:
+            self.requests += 1
+            self.transactions[transaction_id] = response
+            self.orders[response["order_id"]] = transaction_id
+            if self.webhook_url:
+                heapq.heappush(self.schedule, (time.monotonic() + self.settle_after, transaction_id))
+                self.schedule_ready.notify()
+        return response
+
+    def transition(self, transaction_id, new_status):
+        with self.lock:
+            self.requests += 1
+            transaction = self.transactions.get(self.orders.get(transaction_id, transaction_id))
+            if transaction is None:
+                return {"status_code": "404", "status_message": "Transaction doesn't exist."}
+            if new_status is not None:
+                transaction["transaction_status"] = new_status
+            return dict(transaction, status_code="200")
+
+    def run_schedule(self):
+        with self.lock:
+            while True:
+                if not self.schedule:
+                    self.schedule_ready.wait()
+                    continue
+
+                due, transaction_id = self.schedule[0]
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self.schedule_ready.wait(wait)
+                    continue
+
+                heapq.heappop(self.schedule)
+                transaction = self.transactions[transaction_id]
+                if transaction["transaction_status"] != "pending":
+                    continue
+
+                transaction["transaction_status"] = "settlement" if random.random() < self.settle_ratio else "expire"
+                self.senders.submit(self.send_webhook, self.notification(transaction))
+
+    def notification(self, transaction):
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        notification = dict(
+            transaction,
+            status_code="200",
+            status_message="midtrans payment notification",
+            fraud_status="accept",
+            signature_key=hashlib.sha512("{}200{}{}".format(
+                transaction["order_id"], transaction["gross_amount"], self.server_key
+            ).encode()).hexdigest(),
+        )
+        if transaction["transaction_status"] == "settlement":
+            notification["settlement_time"] = now
+        return notification
+
+    def send_webhook(self, notification):
+        request = urllib.request.Request(
+            self.webhook_url,
+            data=json.dumps(notification).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        started = time.perf_counter()
+        try:
+            urllib.request.urlopen(request, timeout=10).close()
+            ok = True
+        except OSError:
+            ok = False
+
+        with self.lock:
+            if ok:
+                self.webhooks_sent += 1
+                self.webhook_latencies.append(time.perf_counter() - started)
+            else:
+                self.webhooks_failed += 1
+
+    def stats(self):
+        with self.lock:
+            latencies = sorted(self.webhook_latencies)
+            return {
+                "connections": self.connections,
+                "requests": self.requests,
+                "injected_failures": self.failures,
+                "webhooks_pending": len(self.schedule),
+                "webhooks_sent": self.webhooks_sent,
+                "webhooks_failed": self.webhooks_failed,
+                "webhook_p50_ms": latencies[len(latencies) // 2] * 1000 if latencies else None,
+                "webhook_p99_ms": latencies[int(len(latencies) * 0.99)] * 1000 if latencies else None,
+            }
+
+    def serve_in_thread(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--latency-ms', type=float, default=0, help='added to every response')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='latency varies uniformly by this much either way')
+    parser.add_argument('--failure-rate', type=float, default=0, help='fraction of requests answered with HTTP 500')
+    parser.add_argument('--webhook-url', help='gateway callback url to send settlement notifications to')
+    parser.add_argument('--settle-after', type=float, default=1.0, help='seconds from charge to notification')
+    parser.add_argument('--settle-ratio', type=float, default=0.9, help='fraction of transactions that settle, the rest expire')
+    parser.add_argument('--server-key', default='', help='used for the notification signature_key')
+    parser.add_argument('--stats-interval', type=float, default=10, help='seconds between stats lines, 0 to disable')
+    args = parser.parse_args()
+
+    server = FakeMidtrans(
+        (args.host, args.port),
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        failure_rate=args.failure_rate,
+        webhook_url=args.webhook_url,
+        settle_after=args.settle_after,
+        settle_ratio=args.settle_ratio,
+        server_key=args.server_key,
+    )
+    print("fake midtrans listening on {}".format(server.url), flush=True)
+
+    if args.stats_interval:
+        def report():
+            while True:
+                time.sleep(args.stats_interval)
+                print(json.dumps(server.stats()), flush=True)
+        threading.Thread(target=report, daemon=True).start()
+
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+"""
+End-to-end load generator for the gateway (and, behind it, RabbitMQ and
+the payments service).
+
+Replays a weighted mix of operations read from a JSON-lines file, one
+operation per line:
+
+    {"op": "create", "weight": 10, "payment_method": "bca_va"}
+    {"op": "get", "weight": 30}
+    {"op": "status", "weight": 40}
+    {"op": "list_customer", "weight": 10}
+    {"op": "callback", "weight": 10}
+
+``create`` POSTs ``/payment`` (``payment_method`` optional, random when
+missing), ``get`` / ``status`` read back payments created by this run,
+``list`` and ``list_customer`` page ``/payment`` and
+``/payment/customer/<id>``, and ``callback`` POSTs a Midtrans
+notification for an unknown transaction to exercise webhook intake. An
+optional ``name`` key reports a line separately.
+
+Matched settlement webhooks come from ``tools/fake_midtrans.py
+--webhook-url`` instead, see ``docker-compose.load.yml``.
+
+By default ``--concurrency`` clients loop back to back (closed loop).
+With ``--rate`` requests arrive at that many per second regardless of
+how fast they are answered (open loop); latency then counts from the
+scheduled start, so time spent queued behind a saturated system shows.
+
+    python tools/load_payments.py --url http://localhost:8003 --duration 60 --concurrency 50
+    python tools/load_payments.py --mix tools/load_mix.jsonl --rate 200 --duration 120 --output run.json
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from common import percentile
+
+
+PAYMENT_METHODS = ["tunai", "bca_va", "qris", "gopay"]
+OPS = ("create", "get", "status", "list", "list_customer", "callback")
+
+DEFAULT_MIX = [
+    {"op": "create", "weight": 10},
+    {"op": "get", "weight": 30},
+    {"op": "status", "weight": 40},
+    {"op": "list_customer", "weight": 10},
+    {"op": "callback", "weight": 10},
+]
+
+
+class LoadRun(object):
+
+    def __init__(self, url, mix, customers, timeout):
+        self.url = url.rstrip('/')
+        self.mix = mix
+        self.weights = [entry.get("weight", 1) for entry in mix]
+        self.customers = customers
+        self.timeout = timeout
+
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.paymentIds = deque(maxlen=10000)
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(Counter)
+
+    @property
+    def session(self):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = self.local.session = requests.Session()
+        return session
+
+    def pick(self):
+        return random.choices(self.mix, weights=self.weights)[0]
+
+    def known_payment(self):
+        with self.lock:
+            return random.choice(self.paymentIds) if self.paymentIds else None
+
+    def request(self, entry):
+        op = entry["op"]
+        payment_id = self.known_payment()
+
+        # Reads need something to read, create first until this run has made a payment
+        if op in ("get", "status") and payment_id is None:
+            entry = {"op": "create"}
+            op = "create"
+
+        if op == "create":
+            return "POST", "/payment", {
+                "customer_id": random.randrange(self.customers),
+                "requester_type": random.randint(1, 3),
+                "requester_id": random.randrange(100000),
+                "secondary_requester_id": None,
+                "payment_method": entry.get("payment_method") or random.choice(PAYMENT_METHODS),
+                "payment_amount": float(random.randrange(10000, 1000000, 500)),
+            }, entry
+        if op == "get":
+            return "GET", "/payment/{}".format(payment_id), None, entry
+        if op == "status":
+            return "GET", "/payment/{}/status".format(payment_id), None, entry
+        if op == "list":
+            return "GET", "/payment?limit=50", None, entry
+        if op == "list_customer":
+            return "GET", "/payment/customer/{}?limit=20".format(random.randrange(self.customers)), None, entry
+        return "POST", "/payment/midtrans/callback", {
+            "transaction_id": str(uuid.uuid4()),
+            "order_id": str(random.randrange(1 << 30)),
+            "transaction_status": "settlement",
+            "status_code": "200",
+            "gross_amount": "150000.00",
+            "payment_type": "bank_transfer",
+            "fraud_status": "accept",
+        }, entry
+
+    def execute(self, entry, scheduled=None):
+        method, path, body, entry = self.request(entry)
+        name = entry.get("name") or entry["op"]
+
+        started = scheduled if scheduled is not None else time.perf_counter()
+        try:
+            response = self.session.request(method, self.url + path, json=body, timeout=self.timeout)
+            error = None if response.status_code < 400 else "HTTP {}".format(response.status_code)
+        except requests.RequestException as exc:
+            response = None
+            error = type(exc).__name__
+        elapsed = time.perf_counter() - started
+
+        with self.lock:
+            self.latencies[name].append(elapsed)
+            if error:
+                self.errors[name][error] += 1
+            elif entry["op"] == "create":
+                self.paymentIds.append(response.json()["id"])
+
+    def closed_loop(self, concurrency, deadline, total):
+        remaining = [total]
+
+        def client():
+            while time.perf_counter() < deadline:
+                with self.lock:
+                    if remaining[0] is not None:
+                        if remaining[0] <= 0:
+                            return
+                        remaining[0] -= 1
+                self.execute(self.pick())
+
+        threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def open_loop(self, rate, concurrency, deadline, total):
+        sent = 0
+        scheduled = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while scheduled < deadline and (total is None or sent < total):
+                # Poisson arrivals at ``rate`` per second
+                scheduled += random.expovariate(rate)
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(self.execute, self.pick(), scheduled)
+                sent += 1
+
+    def report(self, elapsed):
+        def summarize(latencies, errors):
+            latencies = sorted(latencies)
+            count = len(latencies)
+            failed = sum(errors.values())
+
+            def percentile_ms(p):
+                return percentile(latencies, p) * 1000 if count else None
+
+            return {
+                "requests": count,
+                "errors": failed,
+                "error_rate": failed / count if count else 0.0,
+                "throughput": count / elapsed,
+                "p50_ms": percentile_ms(0.50),
+                "p95_ms": percentile_ms(0.95),
+                "p99_ms": percentile_ms(0.99),
+                "max_ms": latencies[-1] * 1000 if count else None,
+                "error_kinds": dict(errors),
+            }
+
+        with self.lock:
+            operations = {name: summarize(self.latencies[name], self.errors[name]) for name in sorted(self.latencies)}
+            total = summarize(
+                [latency for latencies in self.latencies.values() for latency in latencies],
+                sum(self.errors.values(), Counter()),
+            )
+        return {"elapsed": elapsed, "operations": operations, "total": total}
+
+
+def load_mix(path):
+    mix = []
+    with open(path) as mix_file:
+        for line in mix_file:
+            if line.strip():
+                entry = json.loads(line)
+                if entry.get("op") not in OPS:
+                    sys.exit("unknown op {!r} in {}, expected one of {}".format(entry.get("op"), path, ", ".join(OPS)))
+                mix.append(entry)
+    return mix
+
+
+def print_report(report):
+    print("{:<16} {:>8} {:>8} {:>8} {:>9} {:>9} {:>9} {:>9}".format(
+        "operation", "requests", "req/s", "errors", "p50 ms", "p95 ms", "p99 ms", "max ms"), file=sys.stderr)
+
+    rows = list(report["operations"].items()) + [("total", report["total"])]
+    for name, stats in rows:
+        if not stats["requests"]:
+            continue
+        print("{:<16} {:>8} {:>8.1f} {:>7.2f}% {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}".format(
+            name, stats["requests"], stats["throughput"], stats["error_rate"] * 100,
+            stats["p50_ms"], stats["p95_ms"], stats["p99_ms"], stats["max_ms"]), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:8003', help='gateway base url')
+    parser.add_argument('--mix', help='JSON-lines operation mix, defaults to the built-in mix')
+    parser.add_argument('--concurrency', type=int, default=20, help='clients, or the in-flight cap with --rate')
+    parser.add_argument('--rate', type=float, help='open loop arrivals per second')
+    parser.add_argument('--duration', type=float, default=30, help='seconds to run')
+    parser.add_argument('--requests', type=int, help='stop after this many requests')
+    parser.add_argument('--customers', type=int, default=1000, help='customer ids to spread creates and lists over')
+    parser.add_argument('--timeout', type=float, default=30, help='per request timeout in seconds')
+    parser.add_argument('--output', help='also write the report as JSON here')
+    args = parser.parse_args()
+
+    run = LoadRun(args.url, load_mix(args.mix) if args.mix else DEFAULT_MIX, args.customers, args.timeout)
+
+    started = time.perf_counter()
+    deadline = started + args.duration
+    if args.rate:
+        run.open_loop(args.rate, args.concurrency, deadline, args.requests)
+    else:
+        run.closed_loop(args.concurrency, deadline, args.requests)
+
+    report = run.report(time.perf_counter() - started)
+    report["config"] = {
+        "url": args.url,
+        "mode": "open" if args.rate else "closed",
+        "rate": args.rate,
+        "concurrency": args.concurrency,
+        "duration": args.duration,
+        "mix": run.mix,
+    }
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""
+Hammer single payments with concurrent complete / cancel / callback
+transitions from many greenthreads and check that exactly one wins.
+
+Each round inserts a fresh pending payment and lets ``--concurrency``
+greenthreads, each with its own session, race ``transition_payment`` on
+it. ``--legacy`` runs the old read / check in Python / write sequence
+instead, to show the double transitions it allowed.
+
+    DB_HOST=localhost python tools/stress_transitions.py --rounds 200 --concurrency 50
+"""
+import eventlet
+eventlet.monkey_patch()
+
+from eventlet.support.psycopg2_patcher import make_psycopg_green  # noqa: E402
+make_psycopg_green()
+
+import argparse  # noqa: E402
+import random  # noqa: E402
+import sys  # noqa: E402
+from collections import Counter  # noqa: E402
+from datetime import datetime  # noqa: E402
+
+from eventlet import GreenPool  # noqa: E402
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from common import get_url, use_services  # noqa: E402
+use_services('payments')
+
+from payments.models import Payment, PaymentMethodEnum  # noqa: E402
+from payments.transitions import SUCCESS, transition_payment  # noqa: E402
+
+
+def conditional(Session, payment_id):
+    session = Session()
+    try:
+        outcome, _ = transition_payment(session, random.choice((2, 3)), payment_id=payment_id)
+        session.commit()
+        return outcome
+    finally:
+        session.close()
+
+
+def legacy(Session, payment_id):
+    session = Session()
+    try:
+        payment = session.query(Payment).get(payment_id)
+        if payment.status != 1:
+            return "Already Finished or Cancelled"
+        eventlet.sleep(0)           # where a slow query or RPC would give others a turn
+        payment.status = random.choice((2, 3))
+        payment.settle_date = datetime.now()
+        session.commit()
+        return SUCCESS
+    finally:
+        session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--legacy', action='store_true', help='race the old read-check-write path instead')
+    args = parser.parse_args()
+
+    engine = create_engine(get_url(), pool_size=args.concurrency, max_overflow=0)
+    Session = sessionmaker(bind=engine)
+    transition = legacy if args.legacy else conditional
+
+    badRounds = 0
+    for _ in range(args.rounds):
+        session = Session()
+        payment = Payment(
+            customer_id=0, requester_type=1, requester_id=0,
+            payment_method=PaymentMethodEnum.tunai, payment_amount=1.0, status=1,
+        )
+        session.add(payment)
+        session.commit()
+        payment_id = payment.id
+        session.close()
+
+        pool = GreenPool(args.concurrency)
+        outcomes = Counter(pool.imap(lambda _: transition(Session, payment_id), range(args.concurrency)))
+        if outcomes[SUCCESS] != 1:
+            badRounds += 1
+            print("payment {}: {}".format(payment_id, dict(outcomes)))
+
+    print("{} rounds x {} greenthreads, {} rounds without exactly one winner".format(args.rounds, args.concurrency, badRounds))
+    sys.exit(1 if badRounds else 0)
+
+
+if __name__ == '__main__':
+    main()
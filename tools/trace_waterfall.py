@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+Rebuild per-request waterfalls from the JSON-lines span logs the gateway
+and payments services write to ``SPAN_LOG_PATH``.
+
+Without ``--trace`` lists the slowest traces; with it prints that trace
+as a tree of spans, each with its offset from the start of the request,
+its duration and a bar on a shared time axis.
+
+    python tools/trace_waterfall.py gateway-spans.jsonl payments-spans.jsonl
+    python tools/trace_waterfall.py *.jsonl --trace 3f2a9c0e6b7d4e51a8c2f1d0b9e8a7c6
+"""
+import argparse
+import json
+import sys
+from collections import defaultdict
+
+
+def load_spans(paths):
+    traces = defaultdict(list)
+    for path in paths:
+        with open(path) as span_file:
+            for line in span_file:
+                if line.strip():
+                    span = json.loads(line)
+                    traces[span.get('trace_id')].append(span)
+    return traces
+
+
+def trace_bounds(spans):
+    start = min(span['start'] for span in spans)
+    end = max(span['start'] + span['duration_ms'] / 1000 for span in spans)
+    return start, end
+
+
+def print_slowest(traces, count):
+    ranked = sorted(traces.items(), key=lambda item: trace_bounds(item[1])[0] - trace_bounds(item[1])[1])
+    print("{:<34} {:>10} {:>6}  {}".format("trace", "total ms", "spans", "root"))
+    for trace_id, spans in ranked[:count]:
+        start, end = trace_bounds(spans)
+        root = min(spans, key=lambda span: span['start'])
+        print("{:<34} {:>10.1f} {:>6}  {}.{}".format(
+            trace_id, (end - start) * 1000, len(spans), root['service'], root['name']))
+
+
+def print_waterfall(spans, width):
+    start, end = trace_bounds(spans)
+    total = max(end - start, 1e-9)
+
+    spanIds = {span['span_id'] for span in spans}
+    children = defaultdict(list)
+    for span in spans:
+        parent = span.get('parent_id') if span.get('parent_id') in spanIds else None
+        children[parent].append(span)
+
+    print("{:>9} {:>9}  {:<48} {}".format("start ms", "dur ms", "span", "timeline"))
+
+    def walk(parent, depth):
+        for span in sorted(children[parent], key=lambda span: span['start']):
+            offset = span['start'] - start
+            duration = span['duration_ms'] / 1000
+            left = int(offset / total * width)
+            bar = " " * left + "#" * max(1, int(round(duration / total * width)))
+            label = "{}{}.{}{}".format(
+                "  " * depth, span['service'], span['name'], "" if span['outcome'] == 'success' else " !")
+            print("{:>9.1f} {:>9.1f}  {:<48} |{:<{width}}|".format(
+                offset * 1000, span['duration_ms'], label[:48], bar[:width], width=width))
+            walk(span['span_id'], depth + 1)
+
+    walk(None, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('span_logs', nargs='+', help='span log files from every service')
+    parser.add_argument('--trace', help='correlation id to draw')
+    parser.add_argument('--slowest', type=int, default=10, help='traces to list without --trace')
+    parser.add_argument('--width', type=int, default=60, help='timeline width in characters')
+    args = parser.parse_args()
+
+    traces = load_spans(args.span_logs)
+    if args.trace is None:
+        return print_slowest(traces, args.slowest)
+
+    if args.trace not in traces:
+        sys.exit("no spans for trace {}".format(args.trace))
+    print_waterfall(traces[args.trace], args.width)
+
+
+if __name__ == '__main__':
+    main()